@@ -0,0 +1,256 @@
+"""
+Searchable archive of ingested articles and sent newsletter issues.
+
+Every stored article and every issue gets one ArchiveDocument row, written
+in the same transaction as the article or issue itself. Searches go through
+the inverted index beside that table (FTS5 on SQLite, a tsvector GIN index
+on PostgreSQL), ranked by relevance with title and art form matches weighted
+highest, and only the requested page is read back. Queries so broad that
+scoring every match would be slow, fall back to newest first. Each query
+word also matches as a prefix, so "choreo" finds choreography.
+"""
+
+import os
+import re
+import time
+from datetime import datetime
+from collections import namedtuple
+from markupsafe import Markup, escape
+from sqlalchemy import select, delete, insert, text, or_
+from app import db
+from models import ArchiveDocument, Article, ArticleArtForm, NewsletterIssue
+from metrics import ARCHIVE_SEARCH_SECONDS
+
+ARCHIVE_PAGE_SIZE = int(os.environ.get('ARCHIVE_PAGE_SIZE', '20'))
+MAX_PAGE_SIZE = 100
+# Queries matching more documents than this list newest first instead of
+# scoring every match, which would take the index's speed away
+RANK_LIMIT = int(os.environ.get('ARCHIVE_RANK_LIMIT', '5000'))
+# Rows per statement when indexing or backfilling
+INDEX_CHUNK_SIZE = 500
+
+KINDS = ('article', 'issue')
+
+SearchPage = namedtuple('SearchPage', 'query kind page per_page total results took_ms')
+
+# Snippet highlight markers; control characters can't occur in the indexed text
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+
+def _join(values, separator=' · '):
+    return separator.join(value for value in values if value)
+
+
+def _article_documents(executor, article_ids):
+    """Archive rows for stored articles, tagged with all their art forms"""
+    art_forms = {}
+    for article_id, art_form in executor.execute(
+            select(ArticleArtForm.article_id, ArticleArtForm.art_form).where(
+                ArticleArtForm.article_id.in_(article_ids)).order_by(ArticleArtForm.art_form)):
+        art_forms.setdefault(article_id, []).append(art_form)
+    return [{
+        'kind': 'article',
+        'ref_id': row.id,
+        'url': row.url,
+        'title': row.title,
+        'body': row.description,
+        'source': row.source,
+        'art_forms': '; '.join(art_forms.get(row.id, [])),
+        'published_at': row.published_at,
+    } for row in executor.execute(
+        select(Article.id, Article.url, Article.title, Article.description, Article.source,
+               Article.published_at).where(Article.id.in_(article_ids)))]
+
+
+def _issue_document(issue_id, subject, articles, created_at):
+    articles = articles or []
+    return {
+        'kind': 'issue',
+        'ref_id': issue_id,
+        'url': None,
+        'title': _join(article.get('title') for article in articles) or subject,
+        'body': _join(article.get('description') for article in articles),
+        'source': _join(dict.fromkeys(article.get('source') for article in articles)),
+        'art_forms': _join(dict.fromkeys(article.get('art_form') for article in articles), '; '),
+        'published_at': created_at,
+    }
+
+
+def _replace(executor, kind, documents):
+    """Swap in fresh archive rows for these references; the index follows via triggers or generation"""
+    if not documents:
+        return
+    executor.execute(delete(ArchiveDocument).where(
+        ArchiveDocument.kind == kind, ArchiveDocument.ref_id.in_([document['ref_id'] for document in documents])))
+    executor.execute(insert(ArchiveDocument), documents)
+
+
+def index_articles(article_ids, executor=None):
+    """(Re)index stored articles, e.g. after ingestion tags them; doesn't commit"""
+    executor = executor or db.session
+    article_ids = list(article_ids)
+    for start in range(0, len(article_ids), INDEX_CHUNK_SIZE):
+        _replace(executor, 'article', _article_documents(executor, article_ids[start:start + INDEX_CHUNK_SIZE]))
+
+
+def index_issues(issues, executor=None):
+    """Index newsletter issues (ORM objects with ids); doesn't commit"""
+    executor = executor or db.session
+    documents = [_issue_document(issue.id, issue.subject, issue.articles, issue.created_at) for issue in issues]
+    for start in range(0, len(documents), INDEX_CHUNK_SIZE):
+        _replace(executor, 'issue', documents[start:start + INDEX_CHUNK_SIZE])
+
+
+def backfill(conn):
+    """Index every article and issue already in the database, one keyset chunk at a time"""
+    last_id = 0
+    while True:
+        article_ids = conn.execute(select(Article.id).where(Article.id > last_id).order_by(Article.id)
+                                   .limit(INDEX_CHUNK_SIZE)).scalars().all()
+        if not article_ids:
+            break
+        _replace(conn, 'article', _article_documents(conn, article_ids))
+        last_id = article_ids[-1]
+
+    last_id = 0
+    while True:
+        rows = conn.execute(select(NewsletterIssue.id, NewsletterIssue.subject, NewsletterIssue.articles,
+                                   NewsletterIssue.created_at).where(NewsletterIssue.id > last_id)
+                            .order_by(NewsletterIssue.id).limit(INDEX_CHUNK_SIZE)).all()
+        if not rows:
+            break
+        _replace(conn, 'issue', [_issue_document(*row) for row in rows])
+        last_id = rows[-1].id
+
+
+def _terms(query):
+    """Words in a free-text query; punctuation and search operators are dropped"""
+    return re.findall(r'\w+', query or '')
+
+
+def _highlight(snippet):
+    """Escape a snippet and turn the index's match markers into <mark> tags"""
+    if not snippet:
+        return Markup('')
+    html = str(escape(snippet)).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+    return Markup(html)
+
+
+_COLUMNS = "d.id, d.kind, d.ref_id, d.url, d.title, d.source, d.art_forms, d.published_at"
+
+
+def _search_sqlite(terms, kind, limit, offset):
+    match = ' '.join(f'"{term}"*' for term in terms)
+    kind_filter = "AND d.kind = :kind" if kind else ""
+    params = {'match': match, 'kind': kind, 'limit': limit, 'offset': offset,
+              'start': _MARK_START, 'end': _MARK_END}
+    # The join is only needed to filter by kind; counting the index alone is much cheaper
+    total = db.session.execute(text(
+        "SELECT count(*) FROM archive_fts JOIN archive_document d ON d.id = archive_fts.rowid "
+        f"WHERE archive_fts MATCH :match {kind_filter}" if kind else
+        "SELECT count(*) FROM archive_fts WHERE archive_fts MATCH :match"
+    ), params).scalar()
+    # bm25 weights follow the fts5 column order: title, body, source, art_forms
+    order = ("bm25(archive_fts, 10.0, 3.0, 1.0, 5.0), d.published_at DESC" if total <= RANK_LIMIT
+             else "archive_fts.rowid DESC")
+    rows = db.session.execute(text(
+        f"SELECT {_COLUMNS}, snippet(archive_fts, 1, :start, :end, '…', 24) AS snippet "
+        "FROM archive_fts JOIN archive_document d ON d.id = archive_fts.rowid "
+        f"WHERE archive_fts MATCH :match {kind_filter} "
+        f"ORDER BY {order} LIMIT :limit OFFSET :offset"
+    ), params).all()
+    return total, rows
+
+
+def _search_postgresql(terms, kind, limit, offset):
+    tsquery = ' & '.join(f'{term}:*' for term in terms)
+    kind_filter = "AND d.kind = :kind" if kind else ""
+    params = {'tsquery': tsquery, 'kind': kind, 'limit': limit, 'offset': offset,
+              'options': f'StartSel={_MARK_START}, StopSel={_MARK_END}, MaxWords=35, MinWords=15'}
+    total = db.session.execute(text(
+        "SELECT count(*) FROM archive_document d "
+        f"WHERE d.search_vector @@ to_tsquery('english', :tsquery) {kind_filter}"
+    ), params).scalar()
+    order = ("ts_rank_cd(d.search_vector, q) DESC, d.published_at DESC" if total <= RANK_LIMIT
+             else "d.published_at DESC")
+    # Headlines are costly, so only the page's rows get one
+    rows = db.session.execute(text(
+        f"SELECT {_COLUMNS}, ts_headline('english', coalesce(d.body, ''), q, :options) AS snippet "
+        "FROM (SELECT d.*, q FROM archive_document d, to_tsquery('english', :tsquery) q "
+        f"WHERE d.search_vector @@ q {kind_filter} "
+        f"ORDER BY {order} LIMIT :limit OFFSET :offset) d"
+    ), params).all()
+    return total, rows
+
+
+def _search_like(terms, kind, limit, offset):
+    """Unindexed fallback for databases with neither FTS5 nor tsvector"""
+    query = db.session.query(ArchiveDocument)
+    for term in terms:
+        pattern = f'%{term}%'
+        query = query.filter(or_(ArchiveDocument.title.ilike(pattern), ArchiveDocument.body.ilike(pattern),
+                                 ArchiveDocument.source.ilike(pattern), ArchiveDocument.art_forms.ilike(pattern)))
+    return _page(query, kind, limit, offset)
+
+
+def _page(query, kind, limit, offset):
+    if kind:
+        query = query.filter(ArchiveDocument.kind == kind)
+    total = query.count()
+    documents = query.order_by(ArchiveDocument.published_at.desc(), ArchiveDocument.id.desc()).offset(offset).limit(limit).all()
+    return total, [
+        {'id': document.id, 'kind': document.kind, 'ref_id': document.ref_id, 'url': document.url,
+         'title': document.title, 'source': document.source, 'art_forms': document.art_forms,
+         'published_at': document.published_at, 'snippet': (document.body or '')[:240]}
+        for document in documents
+    ]
+
+
+def search(query, kind=None, page=1, per_page=ARCHIVE_PAGE_SIZE):
+    """One page of archive entries matching `query`, best first; newest first when it's empty"""
+    kind = kind if kind in KINDS else None
+    page = max(page, 1)
+    per_page = min(max(per_page, 1), MAX_PAGE_SIZE)
+    offset = (page - 1) * per_page
+    terms = _terms(query)
+
+    dialect = db.engine.dialect.name
+    if not terms:
+        mode = 'browse'
+    elif dialect == 'sqlite':
+        mode = 'fts5'
+    elif dialect == 'postgresql':
+        mode = 'tsvector'
+    else:
+        mode = 'like'
+
+    started = time.perf_counter()
+    if mode == 'browse':
+        total, rows = _page(db.session.query(ArchiveDocument), kind, per_page, offset)
+    elif mode == 'fts5':
+        total, rows = _search_sqlite(terms, kind, per_page, offset)
+    elif mode == 'tsvector':
+        total, rows = _search_postgresql(terms, kind, per_page, offset)
+    else:
+        total, rows = _search_like(terms, kind, per_page, offset)
+    took = time.perf_counter() - started
+    ARCHIVE_SEARCH_SECONDS.observe(took, mode=mode)
+
+    results = []
+    for row in rows:
+        row = row if isinstance(row, dict) else row._asdict()
+        published_at = row['published_at']
+        if isinstance(published_at, str):
+            # Raw SQL on SQLite hands back the stored text
+            published_at = datetime.fromisoformat(published_at)
+        results.append({
+            'kind': row['kind'],
+            'ref_id': row['ref_id'],
+            'url': row['url'],
+            'title': row['title'],
+            'source': row['source'],
+            'art_forms': [name for name in (row['art_forms'] or '').split('; ') if name],
+            'published_at': published_at,
+            'snippet': _highlight(row['snippet']) if mode in ('fts5', 'tsvector') else escape(row['snippet'] or ''),
+        })
+    return SearchPage(query or '', kind, page, per_page, total, results, round(took * 1000, 2))
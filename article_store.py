@@ -0,0 +1,235 @@
+"""
+Local article store fed by incremental NewsAPI ingestion.
+
+Active art forms are packed into as few combined keyword queries as
+NewsAPI's query length allows, each polled with the oldest of its forms'
+newest stored publishedAt as a watermark. Each query pages back, newest
+first, until it reaches its watermark, so a busy interval can't skip the
+articles below the first page. Results are deduplicated by URL and by
+a hash of their normalised title and description, tagged with every art
+form the keyword classifier finds in their title and description, and
+indexed in the searchable archive. Digest assembly reads from here, so
+send time doesn't wait on NewsAPI, and articles sent recently are held
+back from the next issues.
+"""
+
+import os
+import re
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import func, or_
+from app import db
+from models import Article, ArticleArtForm, ArtForm
+from classifier import get_classifier
+from image_cache import cache_article_images
+from archive import index_articles
+
+INGEST_PAGE_SIZE = int(os.environ.get('INGEST_PAGE_SIZE', '50'))
+# Most pages one query may request per pass; what is older is logged and left out
+INGEST_MAX_PAGES = int(os.environ.get('INGEST_MAX_PAGES', '10'))
+# Don't repeat an article in a digest within this many days
+REPEAT_WINDOW_DAYS = int(os.environ.get('ARTICLE_REPEAT_WINDOW_DAYS', '14'))
+# NewsAPI rejects `q` values longer than this
+MAX_QUERY_LENGTH = int(os.environ.get('NEWS_API_MAX_QUERY_LENGTH', '500'))
+
+
+def content_hash(title, description):
+    """Stable hash of an article's text, so syndicated copies at other URLs dedupe"""
+    normalised = re.sub(r'\s+', ' ', f'{title} {description}'.lower()).strip()
+    return hashlib.sha256(normalised.encode('utf-8')).hexdigest()
+
+
+def parse_published_at(value):
+    """NewsAPI publishedAt as a naive UTC datetime, or None"""
+    if not value:
+        return None
+    try:
+        published = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if published.tzinfo is not None:
+        published = (published - published.utcoffset()).replace(tzinfo=None)
+    return published
+
+
+def watermark(art_form):
+    """Newest publishedAt stored for an art form"""
+    return db.session.query(func.max(Article.published_at)).join(
+        ArticleArtForm, ArticleArtForm.article_id == Article.id
+    ).filter(ArticleArtForm.art_form == art_form).scalar()
+
+
+def latest_articles(art_form, limit):
+    """Newest stored articles for an art form that haven't gone out recently"""
+    cutoff = datetime.utcnow() - timedelta(days=REPEAT_WINDOW_DAYS)
+    articles = Article.query.join(ArticleArtForm, ArticleArtForm.article_id == Article.id).filter(
+        ArticleArtForm.art_form == art_form,
+        or_(Article.last_sent_at.is_(None), Article.last_sent_at < cutoff)
+    ).order_by(Article.published_at.desc()).limit(limit).all()
+    return [article.as_digest_article(art_form) for article in articles]
+
+
+def mark_sent(urls):
+    """Record that these articles went out, so the next issues skip them"""
+    urls = list(urls)
+    if urls:
+        Article.query.filter(Article.url.in_(urls)).update(
+            {'last_sent_at': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+
+
+def store_articles(tagged_articles):
+    """Insert new articles and tag new and existing ones; returns how many were new
+
+    `tagged_articles` is an iterable of (raw NewsAPI article, art form names).
+    """
+    candidates = {}
+    for raw, art_forms in tagged_articles:
+        url = raw.get('url')
+        if not url or not art_forms:
+            continue
+        if url in candidates:
+            candidates[url][2].update(art_forms)
+        else:
+            candidates[url] = (content_hash(raw.get('title', ''), raw.get('description', '')), raw, set(art_forms))
+    if not candidates:
+        return 0
+
+    hashes = {digest for digest, _, _ in candidates.values()}
+    by_url = dict(db.session.query(Article.url, Article.id).filter(Article.url.in_(list(candidates))))
+    by_hash = dict(db.session.query(Article.content_hash, Article.id).filter(Article.content_hash.in_(list(hashes))))
+
+    wanted = {}
+    created = 0
+    for url, (digest, raw, art_forms) in candidates.items():
+        article_id = by_url.get(url) or by_hash.get(digest)
+        if article_id is None:
+            article = Article(
+                url=url,
+                content_hash=digest,
+                title=raw.get('title', 'No title')[:500],
+                description=raw.get('description'),
+                source=(raw.get('source') or {}).get('name'),
+                image_url=(raw.get('urlToImage') or '')[:1000],
+                published_at=parse_published_at(raw.get('publishedAt'))
+            )
+            db.session.add(article)
+            db.session.flush()
+            article_id = by_hash[digest] = article.id
+            created += 1
+        wanted.setdefault(article_id, set()).update(art_forms)
+
+    tagged = set(db.session.query(ArticleArtForm.article_id, ArticleArtForm.art_form).filter(
+        ArticleArtForm.article_id.in_(list(wanted))))
+    for article_id, art_forms in wanted.items():
+        for art_form in art_forms:
+            if (article_id, art_form) not in tagged:
+                db.session.add(ArticleArtForm(article_id=article_id, art_form=art_form))
+
+    db.session.flush()
+    index_articles(wanted)
+    db.session.commit()
+    return created
+
+
+def _query_terms(name, keywords):
+    return list(keywords) if keywords else [name]
+
+
+def plan_queries(art_forms):
+    """Pack art forms into combined OR queries that fit NewsAPI's length limit
+
+    Returns a list of (art form names, query string).
+    """
+    batches = []
+    names, terms = [], []
+    for name, keywords in art_forms:
+        form_terms = _query_terms(name, keywords)
+        if terms and len(' OR '.join(terms + form_terms)) > MAX_QUERY_LENGTH:
+            batches.append((names, ' OR '.join(terms)))
+            names, terms = [], []
+        names.append(name)
+        terms.extend(form_terms)
+    if terms:
+        batches.append((names, ' OR '.join(terms)))
+    return batches
+
+
+def _ingest_params(query, since, until=None):
+    params = {
+        'q': query,
+        'language': 'en',
+        'sortBy': 'publishedAt',
+        'pageSize': INGEST_PAGE_SIZE
+    }
+    if since is not None:
+        params['from'] = since.strftime('%Y-%m-%dT%H:%M:%S')
+    if until is not None:
+        params['to'] = until.strftime('%Y-%m-%dT%H:%M:%S')
+    return params
+
+
+def fetch_since(news_service, names, query, since):
+    """Every article for `query` published since `since`, paging back from the newest
+
+    Each page asks for articles up to the oldest one on the previous page,
+    rather than for a page number, so NewsAPI's cap on paged results doesn't
+    apply. Stops at a short page, or after INGEST_MAX_PAGES with a warning,
+    since the watermark then moves past articles that were never fetched.
+    """
+    articles, until = [], None
+    for _ in range(INGEST_MAX_PAGES):
+        page = news_service.search_everything(_ingest_params(query, since, until))
+        articles.extend(page)
+        oldest = min(filter(None, (parse_published_at(raw.get('publishedAt')) for raw in page)), default=None)
+        if len(page) < INGEST_PAGE_SIZE or oldest is None or oldest == until:
+            return articles
+        # The boundary article comes back on the next page too; store_articles dedupes it
+        until = oldest
+    logging.warning(f"Stopped ingesting art forms {', '.join(names)} after {INGEST_MAX_PAGES} pages: "
+                    f"articles published between {since or 'the start'} and {until} were skipped")
+    return articles
+
+
+def _batch_watermark(names):
+    """Oldest watermark in a batch, so no form in it misses articles; None if any form is empty"""
+    marks = [watermark(name) for name in names]
+    if not marks or any(mark is None for mark in marks):
+        return None
+    return min(marks)
+
+
+def ingest_all(news_service):
+    """Pull everything newer than the active art forms' watermarks into the store"""
+    art_forms = [(art_form.name, art_form.keywords) for art_form in ArtForm.query.filter_by(active=True).all()]
+    classifier = get_classifier()
+    # Pick up art forms changed by other processes since this one built its classifier
+    classifier.sync(art_forms)
+    queries = [(names, query, _batch_watermark(names)) for names, query in plan_queries(art_forms)]
+
+    def fetch(planned):
+        names, query, since = planned
+        try:
+            # All pages or none: storing only the newest would move the watermark past the rest
+            return [raw for raw in fetch_since(news_service, names, query, since)
+                    if news_service._is_quality_article(raw)]
+        except Exception as e:
+            logging.error(f"Error ingesting articles for art forms {', '.join(names)}: {str(e)}")
+            return []
+
+    # Fetch concurrently, then classify and write from this thread
+    created = 0
+    for raw_articles in news_service.executor.map(fetch, queries):
+        created += store_articles(
+            (raw, classifier.classify(raw.get('title'), raw.get('description'))) for raw in raw_articles)
+
+    logging.info(f"Ingested {created} new articles for {len(art_forms)} art forms in {len(queries)} queries")
+
+    # Cache their images now, so digests and previews serve them locally
+    try:
+        cache_article_images(news_service.executor)
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error caching article images: {str(e)}")
+    return created
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the data layer's bulk paths, on SQLite and optionally PostgreSQL.
+
+For each backend and subscriber-table size a fresh worker process times:
+
+  * subscriber_io.import_subscribers on a generated CSV (COPY + upsert on PostgreSQL),
+  * the delivery insert of mail_queue.enqueue_run for every subscriber,
+  * counting subscribers who like one art form (GIN containment on PostgreSQL),
+  * a full Subscriber.iter_active scan.
+
+    python benchmarks/bench_datalayer.py --sizes 10000 100000
+    python benchmarks/bench_datalayer.py --postgres-url postgresql://localhost/sevenarts_bench
+
+The PostgreSQL database should be a throwaway one: every worker drops and
+recreates its tables.
+"""
+
+import io
+import os
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def subscriber_csv(size, seed=7):
+    """CSV bytes for `size` synthetic subscribers with random art form preferences"""
+    from schema import DEFAULT_ART_FORMS
+
+    names = [art_form['name'] for art_form in DEFAULT_ART_FORMS]
+    rng = random.Random(seed)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('email', 'name', 'art_forms', 'active'))
+    for i in range(size):
+        writer.writerow((f'reader{i}@bench{i % 50}.example', f'Reader {i}' if i % 3 else '',
+                         ';'.join(rng.sample(names, rng.randint(0, 3))), 'true'))
+    return buffer.getvalue().encode()
+
+
+def timed(operation):
+    started = time.perf_counter()
+    value = operation()
+    return round((time.perf_counter() - started) * 1000, 1), value
+
+
+def run_worker(args):
+    """Run every scenario for one backend and size in this process and print a JSON result"""
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        workdir = tempfile.mkdtemp(prefix='sevenarts-bench-')
+        os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(workdir, "bench.db")}'
+    os.environ.setdefault('NEWS_API_KEY', 'bench')
+
+    import logging
+    from app import app, db
+    logging.getLogger().setLevel(logging.WARNING)
+
+    import subscriber_io
+    from bulk import copy_insert
+    from models import Subscriber, DigestRun, NewsletterIssue, NewsletterSent
+
+    with app.app_context():
+        result = {'backend': db.engine.dialect.name, 'size': args.size}
+        if args.database_url:
+            db.drop_all()
+            db.create_all()
+
+        data = subscriber_csv(args.size)
+        result['import_ms'], imported = timed(lambda: subscriber_io.import_subscribers(io.BytesIO(data), 'csv'))
+        result['import_rows_per_s'] = round(imported.imported / (result['import_ms'] / 1000), 1)
+
+        subscriber_ids = [row.id for row in db.session.query(Subscriber.id).order_by(Subscriber.id)]
+        run = DigestRun(subject='Bench', status='queued')
+        db.session.add(run)
+        db.session.flush()
+        issue = NewsletterIssue(run_id=run.id, subject='Bench', articles=[])
+        db.session.add(issue)
+        db.session.commit()
+
+        def enqueue():
+            # Same chunking as mail_queue.enqueue_run
+            from mail_queue import ENQUEUE_CHUNK_SIZE
+            for start in range(0, len(subscriber_ids), ENQUEUE_CHUNK_SIZE):
+                copy_insert(NewsletterSent, [
+                    {'subscriber_id': subscriber_id, 'run_id': run.id, 'issue_id': issue.id,
+                     'status': 'pending', 'attempts': 0}
+                    for subscriber_id in subscriber_ids[start:start + ENQUEUE_CHUNK_SIZE]
+                ])
+                db.session.commit()
+
+        result['enqueue_ms'], _ = timed(enqueue)
+        result['enqueue_rows_per_s'] = round(len(subscriber_ids) / (result['enqueue_ms'] / 1000), 1)
+        result['likes_count_ms'], result['likes_dance'] = timed(
+            lambda: db.session.query(Subscriber.id).filter(Subscriber.likes('Dance')).count())
+        result['iter_active_ms'], _ = timed(lambda: sum(1 for _ in Subscriber.iter_active()))
+
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--postgres-url', help='also benchmark this (throwaway) PostgreSQL database')
+    parser.add_argument('--json', action='store_true', help='print raw JSON results only')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--database-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    results = []
+    for database_url in [None] + ([args.postgres_url] if args.postgres_url else []):
+        for size in args.sizes:
+            command = [sys.executable, os.path.abspath(__file__), '--worker', '--size', str(size)]
+            if database_url:
+                command += ['--database-url', database_url]
+            output = subprocess.run(command, check=True, capture_output=True, text=True, cwd=ROOT).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'backend':>10} {'subscribers':>11} {'import rows/s':>13} {'enqueue rows/s':>14} "
+          f"{'likes ms':>9} {'scan ms':>9}")
+    for result in results:
+        print(f"{result['backend']:>10} {result['size']:>11} {result['import_rows_per_s']:>13} "
+              f"{result['enqueue_rows_per_s']:>14} {result['likes_count_ms']:>9} {result['iter_active_ms']:>9}")
+
+
+if __name__ == '__main__':
+    main()
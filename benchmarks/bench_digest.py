@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the digest pipeline.
+
+Starts a fake NewsAPI server and an SMTP sink on localhost, then for each
+subscriber-table size runs a fresh worker process that:
+
+  * seeds a throwaway SQLite database with synthetic subscribers,
+  * times NewsService.get_curated_articles (cold and warm cache),
+  * times EmailService.send_newsletter one message at a time,
+  * runs the full scheduler.send_scheduled_newsletter path,
+
+and reports throughput, p50/p99 per-message latency and peak RSS.
+
+    python benchmarks/bench_digest.py --sizes 1000 10000 100000 --smtp-latency 5 --news-latency 50
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def seed_subscribers(db, size, seed=7):
+    """Insert `size` synthetic subscribers with random art form preferences"""
+    from sqlalchemy import insert
+    from models import Subscriber
+    from schema import DEFAULT_ART_FORMS
+
+    names = [art_form['name'] for art_form in DEFAULT_ART_FORMS]
+    rng = random.Random(seed)
+    chunk = []
+    for i in range(size):
+        chunk.append({
+            'email': f'reader{i}@bench.example',
+            'name': f'Reader {i}' if i % 3 else None,
+            'art_forms': rng.sample(names, rng.randint(0, 3)),
+            'active': True,
+        })
+        if len(chunk) == 5000:
+            db.session.execute(insert(Subscriber), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(insert(Subscriber), chunk)
+    db.session.commit()
+
+
+def run_worker(args):
+    """Run every scenario for one table size in this process and print a JSON result"""
+    workdir = tempfile.mkdtemp(prefix='sevenarts-bench-')
+    os.environ.update({
+        'DATABASE_URL': f'sqlite:///{os.path.join(workdir, "bench.db")}',
+        'NEWS_API_BASE_URL': args.news_url,
+        'NEWS_API_KEY': 'bench',
+        'SMTP_SERVER': args.smtp_host,
+        'SMTP_PORT': str(args.smtp_port),
+        'SMTP_USE_TLS': 'false',
+        'SMTP_USERNAME': '',
+        'FROM_EMAIL': 'digest@bench.example',
+    })
+
+    import logging
+    from app import app, db
+    logging.getLogger().setLevel(logging.WARNING)
+
+    import email_service as email_service_module
+    from news_service import NewsService
+    from email_service import EmailService
+    import scheduler
+
+    latencies = []
+    send_digest = email_service_module.EmailService.send_digest
+
+    def timed_send_digest(self, *a, **kw):
+        started = time.perf_counter()
+        try:
+            return send_digest(self, *a, **kw)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    email_service_module.EmailService.send_digest = timed_send_digest
+    result = {'size': args.size}
+
+    with app.app_context():
+        seed_subscribers(db, args.size)
+        result['rss_after_seed_mb'] = round(peak_rss_mb(), 1)
+
+        news_service = NewsService()
+        started = time.perf_counter()
+        articles = news_service.get_curated_articles()
+        result['fetch_cold_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        started = time.perf_counter()
+        news_service.get_curated_articles()
+        result['fetch_warm_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+        # The per-recipient API: render and send one message at a time
+        email_service = EmailService()
+        sample = min(args.size, args.sample)
+        started = time.perf_counter()
+        for i in range(sample):
+            email_service.send_newsletter(f'reader{i}@bench.example', 'Bench', articles, f'Reader {i}')
+        elapsed = time.perf_counter() - started
+        email_service.close()
+        result['send_newsletter'] = {
+            'messages': sample,
+            'throughput_per_s': round(sample / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        }
+
+    # The full scheduled path: group, plan, enqueue and drain
+    latencies.clear()
+    started = time.perf_counter()
+    # Seeded subscribers keep the default delivery time, so send their slot
+    from delivery_slots import DEFAULT_DELIVERY_HOUR
+    scheduler.send_scheduled_newsletter(datetime.utcnow().replace(hour=DEFAULT_DELIVERY_HOUR, minute=0, second=0, microsecond=0))
+    elapsed = time.perf_counter() - started
+    result['scheduled_send'] = {
+        'messages': len(latencies),
+        'seconds': round(elapsed, 2),
+        'throughput_per_s': round(len(latencies) / elapsed, 1) if elapsed else 0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+    result['peak_rss_mb'] = round(peak_rss_mb(), 1)
+
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--smtp-latency', type=float, default=0.0, help='milliseconds per message at the sink')
+    parser.add_argument('--news-latency', type=float, default=0.0, help='milliseconds per NewsAPI request')
+    parser.add_argument('--sample', type=int, default=500, help='messages for the one-at-a-time send test')
+    parser.add_argument('--json', action='store_true', help='print raw JSON results only')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--news-url', help=argparse.SUPPRESS)
+    parser.add_argument('--smtp-host', help=argparse.SUPPRESS)
+    parser.add_argument('--smtp-port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    from fake_newsapi import FakeNewsAPIServer
+    from smtp_sink import SMTPSink
+
+    news = FakeNewsAPIServer(latency=args.news_latency / 1000).start()
+    sink = SMTPSink(latency=args.smtp_latency / 1000).start()
+    smtp_host, smtp_port = sink.address
+
+    results = []
+    try:
+        for size in args.sizes:
+            # A fresh process per size keeps peak RSS figures independent
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--worker', '--size', str(size),
+                 '--sample', str(args.sample), '--news-url', news.base_url,
+                 '--smtp-host', smtp_host, '--smtp-port', str(smtp_port)],
+                check=True, capture_output=True, text=True, cwd=ROOT,
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        news.stop()
+        sink.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'subscribers':>11} {'fetch cold':>10} {'fetch warm':>10} "
+          f"{'single msg/s':>12} {'digest msg/s':>12} {'p50 ms':>8} {'p99 ms':>8} {'peak RSS MB':>11}")
+    for result in results:
+        send = result['scheduled_send']
+        print(f"{result['size']:>11} {result['fetch_cold_ms']:>10} {result['fetch_warm_ms']:>10} "
+              f"{result['send_newsletter']['throughput_per_s']:>12} {send['throughput_per_s']:>12} "
+              f"{send['p50_ms']:>8} {send['p99_ms']:>8} {result['peak_rss_mb']:>11}")
+
+
+if __name__ == '__main__':
+    main()
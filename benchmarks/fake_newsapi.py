@@ -0,0 +1,86 @@
+"""
+Local stand-in for the NewsAPI /v2/everything endpoint.
+
+Returns deterministic, quality-passing articles for any query after an
+optional injected delay, so fetch timings can be measured offline.
+"""
+
+import json
+import time
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+def make_articles(query, count):
+    """Synthetic articles whose URLs are stable for a given query"""
+    digest = hashlib.sha1(query.encode()).hexdigest()[:10]
+    return [
+        {
+            'source': {'id': None, 'name': f'Bench Source {i % 5}'},
+            'title': f'{query.split(" OR ")[0].title()} story {i} ({digest})',
+            'description': f'A synthetic article about {query} used to exercise the digest pipeline '
+                           f'without calling the real NewsAPI. Item {i}.',
+            'url': f'https://bench.example/{digest}/{i}',
+            'urlToImage': '',
+            'publishedAt': f'2025-06-{(i % 28) + 1:02d}T08:00:00Z',
+            'content': '',
+        }
+        for i in range(count)
+    ]
+
+
+class FakeNewsAPIServer:
+    """Threaded HTTP server answering /v2/everything with `latency` seconds of delay"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+                if not url.path.endswith('/everything'):
+                    self.send_error(404)
+                    return
+
+                query = params.get('q', ['art'])[0]
+                page_size = int(params.get('pageSize', ['10'])[0])
+                body = json.dumps({
+                    'status': 'ok',
+                    'totalResults': page_size,
+                    'articles': make_articles(query, page_size),
+                }).encode()
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/v2'
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,78 @@
+"""
+Minimal threaded SMTP sink for benchmarks.
+
+Speaks just enough SMTP for smtplib (EHLO/HELO, AUTH, MAIL, RCPT, DATA,
+RSET, NOOP, QUIT), discards every message and can inject latency after
+each DATA to imitate a remote relay. No TLS: run EmailService with
+SMTP_USE_TLS=false against it.
+"""
+
+import time
+import threading
+import socketserver
+
+
+class SMTPSink:
+    """Accept and count messages on a local port"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency
+        self.messages = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode() + b'\r\n')
+
+            def handle(self):
+                with sink._lock:
+                    sink.connections += 1
+                self.reply('220 bench.sink ESMTP ready')
+
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    verb = line.decode(errors='replace').strip().split(' ', 1)[0].upper()
+
+                    if verb == 'EHLO':
+                        self.wfile.write(b'250-bench.sink\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n')
+                    elif verb == 'AUTH':
+                        self.reply('235 2.7.0 Authentication successful')
+                    elif verb == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        while self.rfile.readline() not in (b'.\r\n', b''):
+                            pass
+                        if sink.latency:
+                            time.sleep(sink.latency)
+                        with sink._lock:
+                            sink.messages += 1
+                        self.reply('250 2.0.0 Queued')
+                    elif verb == 'QUIT':
+                        self.reply('221 2.0.0 Bye')
+                        return
+                    elif verb in ('HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP'):
+                        self.reply('250 2.0.0 OK')
+                    else:
+                        self.reply('502 5.5.2 Command not recognised')
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self._server = Server((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
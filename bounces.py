@@ -0,0 +1,278 @@
+"""
+Bounce processing: stop mailing addresses that can't be delivered to.
+
+Bounces come from two places. A relay that refuses a recipient during the
+send gives an SMTP reply, classified as the delivery fails. A relay that
+accepts the message and fails later returns a delivery status notification
+(RFC 3464). Those are read from a local mailbox (BOUNCE_MAILBOX) by a
+scheduler job.
+
+Both are classified the same way, from the RFC 3463 enhanced status code
+when there is one and otherwise from the basic reply code:
+  * hard: the address itself is dead, e.g. an unknown user or domain;
+  * soft: the address may recover, e.g. a full mailbox or a policy block;
+  * none: the fault is the message's or our own, e.g. it was too big.
+
+Each batch of bounces is applied with a few set-based UPDATEs. These bump
+the subscribers' counters and deactivate everyone who has reached
+HARD_BOUNCE_LIMIT hard bounces, or SOFT_BOUNCE_LIMIT soft bounces with no
+gap longer than SOFT_BOUNCE_RESET_DAYS between them. Deactivated
+subscribers drop out of the next delivery slot's plan, and any of their
+deliveries still queued are skipped.
+"""
+
+import os
+import re
+import smtplib
+import logging
+import mailbox
+from collections import namedtuple, Counter
+from datetime import datetime, timedelta
+from sqlalchemy import update, case, func, or_
+from app import db
+from models import DeliveryEvent, Subscriber
+from bulk import copy_insert
+from dashboard import invalidate_dashboard
+from metrics import BOUNCES
+
+HARD_BOUNCE_LIMIT = int(os.environ.get('HARD_BOUNCE_LIMIT', '1'))
+SOFT_BOUNCE_LIMIT = int(os.environ.get('SOFT_BOUNCE_LIMIT', '3'))
+# A soft bounce this long after the previous one starts the count over
+SOFT_BOUNCE_RESET_DAYS = int(os.environ.get('SOFT_BOUNCE_RESET_DAYS', '7'))
+# Local mailbox that receives DSNs (the Return-Path of outgoing mail); unset disables it
+BOUNCE_MAILBOX = os.environ.get('BOUNCE_MAILBOX')
+BOUNCE_MAILBOX_FORMAT = os.environ.get('BOUNCE_MAILBOX_FORMAT', 'mbox').lower()  # 'mbox' or 'maildir'
+# DSN messages per transaction
+BOUNCE_BATCH_SIZE = int(os.environ.get('BOUNCE_BATCH_SIZE', '500'))
+# Subscriber IDs per UPDATE
+UPDATE_CHUNK_SIZE = 1000
+
+HARD, SOFT = 'hard', 'soft'
+
+# subject.detail codes (RFC 3463) that mean the address is dead: bad mailbox,
+# bad system, bad syntax, moved, no MX (RFC 7505), disabled mailbox
+_HARD_DETAILS = {'1.0', '1.1', '1.2', '1.3', '1.6', '1.10', '2.1'}
+# Bad sender addresses, and the mail system, protocol and content subjects: our fault
+_NOT_RECIPIENT_DETAILS = {'1.7', '1.8'}
+_NOT_RECIPIENT_SUBJECTS = {'3', '5', '6'}
+# Basic reply codes meaning the same when there is no enhanced status
+_HARD_REPLY_CODES = {550, 551, 553}
+_SOFT_REPLY_CODES = {552, 554}
+
+_ENHANCED_STATUS = re.compile(r'\b([245])\.(\d{1,3})\.(\d{1,3})\b')
+
+Bounce = namedtuple('Bounce', 'subscriber_id kind issue_id')
+MailboxReport = namedtuple('MailboxReport', 'messages bounces deactivated')
+
+
+def classify(reply_code=None, status=None):
+    """'hard', 'soft' or None for a failure's SMTP reply code and/or enhanced status ('5.1.1')"""
+    if status:
+        klass, _, detail = status.partition('.')
+        if klass == '4':
+            return SOFT
+        if klass != '5':
+            return None
+        if detail in _HARD_DETAILS:
+            return HARD
+        if detail in _NOT_RECIPIENT_DETAILS or detail.partition('.')[0] in _NOT_RECIPIENT_SUBJECTS:
+            return None
+        return SOFT
+    if reply_code is None:
+        return None
+    if 400 <= reply_code < 500 or reply_code in _SOFT_REPLY_CODES:
+        return SOFT
+    if reply_code in _HARD_REPLY_CODES:
+        return HARD
+    # Syntax and sequence errors (500-504) are ours
+    return None
+
+
+def enhanced_status(text):
+    """First enhanced status code ('5.1.1') in a reply or diagnostic, or None"""
+    match = _ENHANCED_STATUS.search(text or '')
+    return '.'.join(match.groups()) if match else None
+
+
+def classify_smtp(error):
+    """Classify the exception a send raised; None unless the recipient's server refused it"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        # Digests go to one recipient at a time
+        code, message = next(iter(error.recipients.values()), (None, b''))
+    elif isinstance(error, smtplib.SMTPSenderRefused):
+        # A problem with our From address, not the subscriber's
+        return None
+    elif isinstance(error, smtplib.SMTPResponseException):
+        code, message = error.smtp_code, error.smtp_error
+    else:
+        # Dropped connections, timeouts and the like say nothing about the address
+        return None
+    if isinstance(message, bytes):
+        message = message.decode('utf-8', 'replace')
+    return classify(code, enhanced_status(message))
+
+
+def _address(field):
+    """Bare address from a DSN recipient field like 'rfc822; reader@example.com'"""
+    if not field:
+        return None
+    address = str(field).rpartition(';')[2].strip().strip('<>').strip()
+    return address or None
+
+
+def parse_dsn(message):
+    """(address, kind) for each recipient a bounce message reports as failed, or None if it isn't one
+
+    Reads multipart/report delivery-status parts, and falls back to the
+    X-Failed-Recipients header that some MTAs send instead. Delays and
+    successful deliveries are ignored.
+    """
+    failures = []
+    is_report = False
+    for part in message.walk():
+        if part.get_content_type() != 'message/delivery-status':
+            continue
+        is_report = True
+        # One block for the message, then one per recipient
+        for block in (part.get_payload() or [])[1:]:
+            if (block.get('Action') or '').strip().lower() != 'failed':
+                continue
+            address = _address(block.get('Final-Recipient') or block.get('Original-Recipient'))
+            diagnostic = str(block.get('Diagnostic-Code') or '')
+            code = re.search(r'\b([45]\d\d)\b', diagnostic)
+            status = enhanced_status(str(block.get('Status') or ''))
+            if status is None or status.endswith('.0.0'):
+                # The remote server's own code is often more specific than the generic X.0.0
+                status = enhanced_status(diagnostic) or status
+            kind = classify(int(code.group(1)) if code else None, status)
+            if address and kind:
+                failures.append((address, kind))
+    if is_report:
+        return failures
+
+    # Exim and friends send plain-text bounces with this header, for permanent failures only
+    failed_recipients = message.get('X-Failed-Recipients')
+    if failed_recipients:
+        return [(address.strip(), HARD) for address in str(failed_recipients).split(',') if address.strip()]
+    return None
+
+
+def record_bounces(bounces, source):
+    """Count `bounces`, log them as delivery events and deactivate whoever reached a limit
+
+    Returns how many subscribers were deactivated. Doesn't commit.
+    """
+    if not bounces:
+        return 0
+    now = datetime.utcnow()
+    reset_before = now - timedelta(days=SOFT_BOUNCE_RESET_DAYS)
+
+    copy_insert(DeliveryEvent, [
+        {'kind': f'{bounce.kind}_bounce', 'subscriber_id': bounce.subscriber_id, 'issue_id': bounce.issue_id,
+         'link': None, 'created_at': now}
+        for bounce in bounces
+    ])
+
+    # One UPDATE per distinct count, so a subscriber bouncing twice in a batch counts twice
+    for kind, column in ((HARD, Subscriber.hard_bounces), (SOFT, Subscriber.soft_bounces)):
+        counts = Counter(bounce.subscriber_id for bounce in bounces if bounce.kind == kind)
+        by_count = {}
+        for subscriber_id, count in counts.items():
+            by_count.setdefault(count, []).append(subscriber_id)
+        for count, subscriber_ids in by_count.items():
+            if kind == HARD:
+                value = func.coalesce(column, 0) + count
+            else:
+                value = case((Subscriber.last_bounce_at >= reset_before, func.coalesce(column, 0) + count),
+                             else_=count)
+            for start in range(0, len(subscriber_ids), UPDATE_CHUNK_SIZE):
+                db.session.execute(update(Subscriber).where(
+                    Subscriber.id.in_(subscriber_ids[start:start + UPDATE_CHUNK_SIZE])
+                ).values({column: value, Subscriber.last_bounce_at: now}))
+        BOUNCES.inc(sum(counts.values()), kind=kind, source=source)
+
+    deactivated = 0
+    subscriber_ids = sorted({bounce.subscriber_id for bounce in bounces})
+    for start in range(0, len(subscriber_ids), UPDATE_CHUNK_SIZE):
+        deactivated += db.session.execute(update(Subscriber).where(
+            Subscriber.id.in_(subscriber_ids[start:start + UPDATE_CHUNK_SIZE]),
+            Subscriber.active.is_(True),
+            or_(func.coalesce(Subscriber.hard_bounces, 0) >= HARD_BOUNCE_LIMIT,
+                func.coalesce(Subscriber.soft_bounces, 0) >= SOFT_BOUNCE_LIMIT)
+        ).values(active=False)).rowcount
+    if deactivated:
+        invalidate_dashboard()
+        logging.info(f"Deactivated {deactivated} subscribers after repeated bounces")
+    return deactivated
+
+
+def _subscriber_ids(addresses):
+    """Subscriber IDs by lowercased address; MTAs don't always keep the case we sent to
+
+    Stored addresses are lowercase (see subscriber_io), so this is a plain index lookup.
+    """
+    addresses = sorted({address.lower() for address in addresses})
+    ids = {}
+    for start in range(0, len(addresses), UPDATE_CHUNK_SIZE):
+        for subscriber_id, email in db.session.query(Subscriber.id, Subscriber.email).filter(
+                Subscriber.email.in_(addresses[start:start + UPDATE_CHUNK_SIZE])):
+            ids[email.lower()] = subscriber_id
+    return ids
+
+
+def _open_mailbox(path, fmt):
+    if fmt == 'maildir':
+        return mailbox.Maildir(path, factory=None, create=False)
+    if fmt == 'mbox':
+        return mailbox.mbox(path, create=False)
+    raise ValueError(f"Unsupported bounce mailbox format: {fmt}")
+
+
+def process_mailbox(path=BOUNCE_MAILBOX, fmt=BOUNCE_MAILBOX_FORMAT, remove=True):
+    """Apply the bounces reported by DSNs in a local mailbox, BOUNCE_BATCH_SIZE messages per commit
+
+    Bounce messages are removed once their batch is committed (unless
+    `remove` is False), so a crash re-reads at most one batch; anything that
+    isn't a bounce is left in place. Bounces for unknown addresses are dropped.
+    """
+    box = _open_mailbox(path, fmt)
+    box.lock()
+    messages = bounced = deactivated = 0
+    try:
+        batch, keys = [], []
+
+        def apply():
+            nonlocal bounced, deactivated
+            ids = _subscriber_ids({address for address, _ in batch})
+            bounces = [Bounce(ids[address.lower()], kind, None)
+                       for address, kind in batch if address.lower() in ids]
+            deactivated += record_bounces(bounces, 'dsn')
+            db.session.commit()
+            if remove:
+                for key in keys:
+                    box.discard(key)
+                box.flush()
+            bounced += len(bounces)
+            batch.clear()
+            keys.clear()
+
+        # Keys are listed up front since removing them changes the mailbox
+        for key in list(box.keys()):
+            failures = parse_dsn(box.get_message(key))
+            if failures is None:
+                continue
+            messages += 1
+            batch.extend(failures)
+            keys.append(key)
+            if len(keys) >= BOUNCE_BATCH_SIZE:
+                apply()
+        if keys:
+            apply()
+    finally:
+        box.unlock()
+        box.close()
+
+    if messages:
+        logging.info(f"Processed {messages} bounce messages from {path}: {bounced} bounces, "
+                     f"{deactivated} subscribers deactivated")
+    return MailboxReport(messages, bounced, deactivated)
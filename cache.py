@@ -0,0 +1,85 @@
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after `ttl` seconds
+
+    Entries older than `ttl` but younger than `ttl + stale_ttl` are still
+    served while a single background refresh replaces them.
+    """
+
+    def __init__(self, maxsize=128, ttl=300, stale_ttl=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        """Return (value, age) for a usable entry, or (_MISSING, None)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING, None
+        value, stored_at = entry
+        age = time.monotonic() - stored_at
+        if age > self.ttl + self.stale_ttl:
+            del self._entries[key]
+            return _MISSING, None
+        self._entries.move_to_end(key)
+        return value, age
+
+    def get(self, key, default=None):
+        """Return a fresh cached value, or `default`"""
+        with self._lock:
+            value, age = self._lookup(key)
+        if value is _MISSING or age > self.ttl:
+            return default
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=_MISSING):
+        """Drop one key, or everything when no key is given"""
+        with self._lock:
+            if key is _MISSING:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for `key`, calling `loader()` on a miss
+
+        A stale hit is returned immediately and refreshed in the background.
+        """
+        with self._lock:
+            value, age = self._lookup(key)
+            refresh = value is not _MISSING and age > self.ttl and key not in self._refreshing
+            if refresh:
+                self._refreshing.add(key)
+
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value)
+        elif refresh:
+            threading.Thread(target=self._refresh, args=(key, loader), daemon=True).start()
+        return value
+
+    def _refresh(self, key, loader):
+        try:
+            self.set(key, loader())
+        except Exception as e:
+            logging.warning(f"Background cache refresh failed for {key}: {str(e)}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
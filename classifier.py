@@ -0,0 +1,118 @@
+import re
+import threading
+
+
+_WORD = re.compile(r'\w+')
+# Trie key holding the art forms whose keyword ends at that node
+_FORMS = None
+
+
+def _normalise(keyword):
+    return ' '.join(keyword.lower().split())
+
+
+def _words(text):
+    return _WORD.findall(text.lower())
+
+
+class ArtFormClassifier:
+    """Tag text with every art form whose keywords it mentions, in a single pass
+
+    All keywords go into one trie of lowercased words, each ending in the
+    art forms that own it. Classifying walks the trie from every word of
+    the text, so a match is found wherever it starts. Overlapping keywords
+    of different forms therefore all count: 'music theater' credits the
+    form that owns the phrase as well as Music and Theater. A regex
+    alternation can't do that, since it consumes the text it matches.
+    Adding or removing an art form only updates the keyword index; the
+    trie is rebuilt lazily on the next lookup.
+    """
+
+    def __init__(self, art_forms=()):
+        self._keywords = {}   # art form -> set of normalised keywords
+        self._owners = {}     # normalised keyword -> set of art forms
+        self._trie = None
+        self._lock = threading.Lock()
+        for name, keywords in art_forms:
+            self.add(name, keywords)
+
+    def add(self, name, keywords):
+        """Register or replace an art form's keywords (its name counts as a keyword too)"""
+        with self._lock:
+            self._discard(name)
+            normalised = {_normalise(keyword) for keyword in list(keywords or []) + [name] if keyword.strip()}
+            self._keywords[name] = normalised
+            for keyword in normalised:
+                self._owners.setdefault(keyword, set()).add(name)
+            self._trie = None
+
+    def remove(self, name):
+        with self._lock:
+            self._discard(name)
+            self._trie = None
+
+    def sync(self, art_forms):
+        """Apply only the differences between the registered art forms and `art_forms`"""
+        wanted = {name: {_normalise(keyword) for keyword in list(keywords or []) + [name] if keyword.strip()}
+                  for name, keywords in art_forms}
+        for name in set(self._keywords) - set(wanted):
+            self.remove(name)
+        for name, keywords in art_forms:
+            if self._keywords.get(name) != wanted[name]:
+                self.add(name, keywords)
+
+    def _discard(self, name):
+        for keyword in self._keywords.pop(name, ()):
+            owners = self._owners.get(keyword)
+            if owners:
+                owners.discard(name)
+                if not owners:
+                    del self._owners[keyword]
+
+    def _compiled(self):
+        with self._lock:
+            if self._trie is None:
+                trie = {}
+                for keyword, owners in self._owners.items():
+                    node = trie
+                    for word in _words(keyword):
+                        node = node.setdefault(word, {})
+                    if node is not trie:
+                        node.setdefault(_FORMS, set()).update(owners)
+                self._trie = trie
+            return self._trie
+
+    def classify(self, *texts):
+        """Set of art forms mentioned anywhere in `texts`"""
+        trie = self._compiled()
+        if not trie:
+            return set()
+        words = _words(' '.join(text for text in texts if text))
+        art_forms = set()
+        for start in range(len(words)):
+            node = trie
+            for word in words[start:]:
+                node = node.get(word)
+                if node is None:
+                    break
+                art_forms |= node.get(_FORMS, set())
+        return art_forms
+
+    @property
+    def art_forms(self):
+        return set(self._keywords)
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier():
+    """Process-wide classifier, built from the active art forms on first use"""
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            from models import ArtForm
+            _classifier = ArtFormClassifier(
+                (art_form.name, art_form.keywords) for art_form in ArtForm.query.filter_by(active=True).all())
+        return _classifier
@@ -0,0 +1,41 @@
+import os
+from sqlalchemy.orm import joinedload
+from models import Subscriber, NewsletterSent, ArtForm
+from cache import TTLCache
+
+# The landing page aggregates, cached briefly and dropped whenever a
+# subscribe, unsubscribe, art form change or send touches them
+_cache = TTLCache(maxsize=1, ttl=int(os.environ.get('DASHBOARD_CACHE_TTL', '30')))
+
+
+def _load_dashboard():
+    recent_newsletters = NewsletterSent.query.options(
+        joinedload(NewsletterSent.subscriber), joinedload(NewsletterSent.issue)
+    ).order_by(NewsletterSent.sent_at.desc()).limit(5).all()
+
+    # Plain values only, so cached entries never touch a closed session
+    return {
+        'subscribers_count': Subscriber.query.filter_by(active=True).count(),
+        'recent_newsletters': [
+            {
+                'subject': newsletter.issue.subject if newsletter.issue else '',
+                'sent_at': newsletter.sent_at,
+                'status': newsletter.status,
+                'email': newsletter.subscriber.email,
+            }
+            for newsletter in recent_newsletters
+        ],
+        'art_forms': [
+            {'id': art_form.id, 'name': art_form.name}
+            for art_form in ArtForm.query.filter_by(active=True).all()
+        ],
+    }
+
+
+def get_dashboard():
+    """Aggregates shown on the index page"""
+    return _cache.get_or_load('dashboard', _load_dashboard)
+
+
+def invalidate_dashboard():
+    _cache.invalidate()
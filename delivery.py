@@ -0,0 +1,92 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+DIGEST_SUBJECT = "🔥 Your SevenArts Fix - Artistic Overload Incoming"
+
+
+class TokenBucket:
+    """Allow `rate` sends per second on average, with bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_for = (1 - self._tokens) / self.rate
+            time.sleep(wait_for)
+
+
+def _parse_rate_limits(value):
+    """Parse 'host=rate,host=rate' into a dict of per-relay send rates"""
+    limits = {}
+    for item in value.split(','):
+        if '=' in item:
+            host, rate = item.split('=', 1)
+            limits[host.strip()] = float(rate)
+    return limits
+
+
+# One bucket per SMTP relay, shared by every engine in the process so that a
+# manual send and a scheduled send together still respect the relay's limit
+_relay_buckets = {}
+_relay_buckets_lock = threading.Lock()
+
+
+def get_relay_bucket(relay):
+    """Token bucket for an SMTP relay, or None when the relay is not rate limited"""
+    with _relay_buckets_lock:
+        if relay not in _relay_buckets:
+            limits = _parse_rate_limits(os.environ.get('SMTP_RATE_LIMITS', ''))
+            rate = limits.get(relay, float(os.environ.get('SMTP_RATE_LIMIT', '0')))
+            burst = int(os.environ.get('SMTP_RATE_BURST', '0')) or None
+            _relay_buckets[relay] = TokenBucket(rate, burst) if rate > 0 else None
+        return _relay_buckets[relay]
+
+
+class DeliveryEngine:
+    """Fan messages out over a thread pool with bounded in-flight work and per-relay rate limits"""
+
+    def __init__(self, email_service, concurrency=None, max_in_flight=None):
+        self.relay = email_service.smtp_server
+        self.concurrency = concurrency or int(os.environ.get('SMTP_CONCURRENCY', str(email_service.pool_size)))
+        # Backpressure: never queue more than this many jobs ahead of the workers
+        self.max_in_flight = max_in_flight or int(os.environ.get('DELIVERY_MAX_IN_FLIGHT', str(self.concurrency * 4)))
+        self.bucket = get_relay_bucket(self.relay)
+
+    def _run(self, job, send):
+        if self.bucket is not None:
+            self.bucket.acquire()
+        try:
+            send(job)
+            return job, None
+        except Exception as e:
+            return job, e
+
+    def deliver(self, jobs, send):
+        """Call `send(job)` for every job in parallel, yielding (job, error) as each one finishes"""
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='delivery') as executor:
+            in_flight = set()
+            for job in jobs:
+                if len(in_flight) >= self.max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                in_flight.add(executor.submit(self._run, job, send))
+
+            for future in wait(in_flight).done:
+                yield future.result()
+
@@ -0,0 +1,91 @@
+"""
+Per-subscriber delivery times, bucketed into fixed send slots.
+
+Each subscriber picks a local delivery hour and an IANA time zone (unset
+means DEFAULT_DELIVERY_HOUR in DEFAULT_TIMEZONE, which is the server's own
+zone unless configured, so the old 08:00 server time for everyone). The day is cut into SLOT_MINUTES-long UTC slots; at the start
+of each slot the scheduler sends to exactly the subscribers whose local
+delivery time falls inside it. Half- and quarter-hour zones land in the
+slot that contains their hour, and DST is resolved per day by zoneinfo.
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError, available_timezones
+from sqlalchemy import and_, or_, func
+from tzlocal import get_localzone_name
+
+DEFAULT_DELIVERY_HOUR = int(os.environ.get('DEFAULT_DELIVERY_HOUR', '8'))
+# The server's zone by default, which the single daily cron used before slots
+DEFAULT_TIMEZONE = os.environ.get('DEFAULT_TIMEZONE') or get_localzone_name() or 'UTC'
+# Must divide an hour so the slots tile every day evenly; 15 gives :30 and :45 zones their own slot
+SLOT_MINUTES = int(os.environ.get('DELIVERY_SLOT_MINUTES', '15'))
+
+# Offered first in the subscribe form; any IANA name is accepted
+COMMON_TIMEZONES = (
+    'UTC', 'Europe/London', 'Europe/Madrid', 'Europe/Paris', 'Europe/Berlin', 'Europe/Athens',
+    'America/New_York', 'America/Chicago', 'America/Denver', 'America/Los_Angeles',
+    'America/Mexico_City', 'America/Sao_Paulo', 'America/Buenos_Aires', 'Africa/Lagos',
+    'Africa/Johannesburg', 'Asia/Dubai', 'Asia/Kolkata', 'Asia/Shanghai', 'Asia/Tokyo',
+    'Australia/Sydney', 'Pacific/Auckland',
+)
+
+
+def get_zone(name):
+    """ZoneInfo for an IANA name, or None if it isn't one"""
+    if not name or name not in _zone_names():
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+_names = None
+
+
+def _zone_names():
+    # Checked against the known names first, so user input never becomes a file path
+    global _names
+    if _names is None:
+        _names = available_timezones() | {'UTC'}
+    return _names
+
+
+def slot_start(now=None):
+    """Start of the UTC slot containing `now` (naive UTC)"""
+    now = now or datetime.utcnow()
+    return now.replace(minute=now.minute - now.minute % SLOT_MINUTES, second=0, microsecond=0)
+
+
+def is_due(zone, hour, start):
+    """Whether `hour`:00 local time in `zone` falls in the slot beginning at naive-UTC `start`"""
+    start = start.replace(tzinfo=timezone.utc)
+    end = start + timedelta(minutes=SLOT_MINUTES)
+    # The local date can change within a slot, so try the dates at both ends
+    for local_date in {start.astimezone(zone).date(), (end - timedelta(microseconds=1)).astimezone(zone).date()}:
+        local = datetime(local_date.year, local_date.month, local_date.day, hour, tzinfo=zone)
+        if start <= local.astimezone(timezone.utc) < end:
+            return True
+    return False
+
+
+def due_filter(start):
+    """Criterion selecting active subscribers due in the slot beginning at `start`, or None if nobody is
+
+    Only the distinct (time zone, hour) pairs in use are checked, so this
+    costs one grouped scan however many subscribers share them.
+    """
+    from app import db
+    from models import Subscriber
+
+    zone_name = func.coalesce(Subscriber.timezone, DEFAULT_TIMEZONE)
+    hour = func.coalesce(Subscriber.delivery_hour, DEFAULT_DELIVERY_HOUR)
+    pairs = db.session.query(zone_name, hour).filter(Subscriber.active.is_(True)).distinct().all()
+
+    due = []
+    for name, delivery_hour in pairs:
+        zone = get_zone(name) or ZoneInfo(DEFAULT_TIMEZONE)
+        if is_due(zone, delivery_hour, start):
+            due.append(and_(zone_name == name, hour == delivery_hour))
+    return or_(*due) if due else None
@@ -0,0 +1,100 @@
+import random
+import logging
+from array import array
+from collections import defaultdict, namedtuple
+from models import ArtForm, NewsletterIssue
+
+# `issue_id` is set when the plan reuses an issue already sent in the same edition
+DigestPlan = namedtuple('DigestPlan', 'articles subscriber_ids signature issue_id')
+
+# Number of articles in every digest
+DIGEST_SIZE = 3
+
+
+def preference_signature(art_forms):
+    """Canonical, hashable key for a subscriber's art form preferences"""
+    return tuple(sorted(set(art_forms or [])))
+
+
+def signature_key(signature):
+    """A preference signature as stored on NewsletterIssue.signature"""
+    return '|'.join(signature)
+
+
+def group_by_preferences(subscribers):
+    """Index (id, email, name, art_forms) rows by preference signature
+
+    Returns a dict of signature -> array of subscriber IDs, so the index stays
+    small however the rows are streamed in.
+    """
+    groups = defaultdict(lambda: array('q'))
+    for subscriber_id, _, _, art_forms in subscribers:
+        groups[preference_signature(art_forms)].append(subscriber_id)
+    return groups
+
+
+def compose_digest(articles_by_form, art_forms, size=DIGEST_SIZE):
+    """Pick `size` articles spread round-robin over a random ordering of `art_forms`"""
+    art_forms = [name for name in art_forms if articles_by_form.get(name)]
+    random.shuffle(art_forms)
+
+    digest = []
+    for position in range(size):
+        for name in art_forms:
+            articles = articles_by_form[name]
+            if position < len(articles) and len(digest) < size:
+                digest.append(articles[position])
+    return digest
+
+
+def _edition_issues(edition, signatures):
+    """Issues already planned for these signatures in `edition`, by signature key"""
+    keys = [signature_key(signature) for signature in signatures]
+    found = {}
+    for start in range(0, len(keys), 500):
+        for issue in NewsletterIssue.query.filter(
+                NewsletterIssue.edition == edition,
+                NewsletterIssue.signature.in_(keys[start:start + 500])).order_by(NewsletterIssue.id):
+            found.setdefault(issue.signature, issue)
+    return found
+
+
+def plan_digests(news_service, groups, edition=None):
+    """Build one article list per preference group, fetching each art form only once
+
+    Returns a list of DigestPlans; groups whose preferences match no active art
+    form get the shared curated digest. With `edition`, groups that already got
+    an issue in that edition (an earlier delivery slot the same day) reuse it, so
+    every slot of a day sends the same content and nothing is fetched twice.
+    """
+    reused = _edition_issues(edition, groups) if edition is not None else {}
+    plans = [DigestPlan(reused[signature_key(signature)].articles, subscriber_ids, signature,
+                        reused[signature_key(signature)].id)
+             for signature, subscriber_ids in groups.items() if signature_key(signature) in reused]
+    groups = {signature: subscriber_ids for signature, subscriber_ids in groups.items()
+              if signature_key(signature) not in reused}
+
+    active_forms = {art_form.name: art_form.keywords for art_form in ArtForm.query.filter_by(active=True).all()}
+
+    wanted = sorted({name for signature in groups for name in signature if name in active_forms})
+    articles_by_form = news_service.get_articles_for_art_forms(
+        [(name, active_forms[name]) for name in wanted], DIGEST_SIZE)
+
+    curated_articles = None
+    for signature, subscriber_ids in groups.items():
+        preferred = [name for name in signature if name in active_forms]
+        articles = compose_digest(articles_by_form, preferred) if preferred else []
+
+        if not articles:
+            if curated_articles is None:
+                curated_articles = news_service.get_curated_articles()
+            articles = curated_articles
+
+        if articles:
+            plans.append(DigestPlan(articles, subscriber_ids, signature, None))
+        else:
+            logging.warning(f"No articles found for preference group {signature or '(none)'}")
+
+    logging.info(f"Planned {len(plans)} digests for {len(groups) + len(reused)} preference groups "
+                 f"from {len(wanted)} art form queries, reusing {len(reused)} issues")
+    return plans
@@ -1,9 +1,77 @@
 import smtplib
 import os
+import re
+from urllib.parse import quote
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from flask import render_template
+from markupsafe import escape
 import logging
+import threading
+from smtp_pool import SMTPConnectionPool
+from metrics import RENDER_SECONDS
+
+# Placeholders rendered into a digest where per-recipient values go later.
+# They contain nothing Jinja's autoescaping would rewrite.
+NAME_SLOT = '%%SEVENARTS_NAME%%'
+EMAIL_SLOT = '%%SEVENARTS_EMAIL%%'
+TOKEN_SLOT = '%%SEVENARTS_TOKEN%%'  # The subscriber's signed link token, see tracking.py
+UNSUBSCRIBE_SLOT = '%%SEVENARTS_UNSUBSCRIBE%%'  # Path of the unsubscribe link, see unsubscribe_path
+_SLOT_PATTERN = re.compile(r'%%SEVENARTS_(NAME|EMAIL|TOKEN|UNSUBSCRIBE)%%')
+
+
+def unsubscribe_path(to_email, token=''):
+    """Path of a recipient's unsubscribe link: /u/<token>, or the old /unsubscribe/<email> without a token"""
+    return f'u/{token}' if token else f"unsubscribe/{quote(to_email, safe='@')}"
+
+
+class SplicedBody:
+    """A rendered body pre-split around its placeholders so filling it is a single join"""
+    
+    def __init__(self, rendered):
+        pieces = _SLOT_PATTERN.split(rendered)
+        self.segments = pieces[0::2]
+        self.slots = pieces[1::2]
+    
+    def fill(self, values):
+        parts = [self.segments[0]]
+        for slot, segment in zip(self.slots, self.segments[1:]):
+            parts.append(values[slot])
+            parts.append(segment)
+        return ''.join(parts)
+
+
+class RenderedDigest:
+    """HTML and text bodies of one digest, rendered once and personalised per recipient"""
+    
+    def __init__(self, html_named, html_anonymous, text_named, text_anonymous):
+        self.html_named = SplicedBody(html_named)
+        self.html_anonymous = SplicedBody(html_anonymous)
+        self.text_named = SplicedBody(text_named)
+        self.text_anonymous = SplicedBody(text_anonymous)
+    
+    @classmethod
+    def from_issue(cls, issue):
+        """The digest snapshotted on a NewsletterIssue, or None if it was never rendered"""
+        if issue.rendered_at is None:
+            return None
+        return cls(issue.html_named, issue.html_anonymous, issue.text_named, issue.text_anonymous)
+    
+    def personalise(self, to_email, subscriber_name=None, token=''):
+        """Return (html, text) bodies for one recipient"""
+        if subscriber_name:
+            html_body, text_body = self.html_named, self.text_named
+        else:
+            html_body, text_body = self.html_anonymous, self.text_anonymous
+        
+        # Tokens and quoted paths are URL-safe already; EMAIL is only in snapshots from before tokens
+        unsubscribe = unsubscribe_path(to_email, token)
+        html = html_body.fill({'NAME': str(escape(subscriber_name or '')), 'EMAIL': str(escape(to_email)),
+                               'TOKEN': token, 'UNSUBSCRIBE': unsubscribe})
+        text = text_body.fill({'NAME': subscriber_name or '', 'EMAIL': to_email, 'TOKEN': token,
+                               'UNSUBSCRIBE': unsubscribe})
+        return html, text
+
 
 class EmailService:
     def __init__(self):
@@ -12,25 +80,78 @@ class EmailService:
         self.smtp_username = os.environ.get('SMTP_USERNAME', 'your-email@gmail.com')
         self.smtp_password = os.environ.get('SMTP_PASSWORD', 'your-app-password')
         self.from_email = os.environ.get('FROM_EMAIL', self.smtp_username)
+        self.use_tls = os.environ.get('SMTP_USE_TLS', 'true').lower() not in ('0', 'false', 'no')
         self.from_name = os.environ.get('FROM_NAME', 'SevenArts')
+        self.base_url = os.environ.get('PUBLIC_BASE_URL', 'http://localhost:5000').rstrip('/')
+        self.pool_size = int(os.environ.get('SMTP_POOL_SIZE', '4'))
+        self.max_messages_per_connection = int(os.environ.get('SMTP_MAX_MESSAGES_PER_CONNECTION', '100'))
+        self._pool = None
+        self._pool_lock = threading.Lock()
     
-    def send_newsletter(self, to_email, subject, articles, subscriber_name=None):
+    @property
+    def pool(self):
+        """Shared SMTP connection pool, opened on first use"""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = SMTPConnectionPool(self.smtp_server, self.smtp_port,
+                                                self.smtp_username, self.smtp_password,
+                                                size=self.pool_size,
+                                                max_messages_per_connection=self.max_messages_per_connection,
+                                                use_tls=self.use_tls)
+            return self._pool
+    
+    def close(self):
+        """Close pooled SMTP connections at the end of a send run"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+    
+    def render_bodies(self, articles, issue_id=None):
+        """The four placeholder bodies of a digest, as a dict of RenderedDigest's arguments
+        
+        With an `issue_id`, article links go through the click redirect and the
+        HTML carries an open pixel; both are tagged with the reader's token.
+        """
+        links = {'unsubscribe_url': f"{self.base_url}/{UNSUBSCRIBE_SLOT}", 'click_urls': None, 'open_url': None}
+        if issue_id is not None:
+            links['click_urls'] = [f"{self.base_url}/c/{TOKEN_SLOT}/{issue_id}/{position}"
+                                   for position in range(len(articles))]
+            links['open_url'] = f"{self.base_url}/o/{TOKEN_SLOT}/{issue_id}.gif"
+        with RENDER_SECONDS.time(template='email_template.html'):
+            return {
+                'html_named': render_template('email_template.html', articles=articles,
+                                              subscriber_name=NAME_SLOT, **links),
+                'html_anonymous': render_template('email_template.html', articles=articles,
+                                                  subscriber_name=None, **links),
+                'text_named': self._generate_text_content(articles, NAME_SLOT, links['unsubscribe_url'],
+                                                          links['click_urls']),
+                'text_anonymous': self._generate_text_content(articles, None, links['unsubscribe_url'],
+                                                              links['click_urls']),
+            }
+    
+    def render_digest(self, articles, issue_id=None):
+        """Render the article-heavy HTML and text bodies once for every recipient of a digest"""
+        return RenderedDigest(**self.render_bodies(articles, issue_id))
+    
+    def send_newsletter(self, to_email, subject, articles, subscriber_name=None, token=''):
         """Send newsletter email to a subscriber"""
+        self.send_digest(to_email, subject, self.render_digest(articles), subscriber_name, token)
+    
+    def send_digest(self, to_email, subject, digest, subscriber_name=None, token=''):
+        """Send a pre-rendered digest, splicing in only the recipient's name and link token"""
         try:
             # Create message
             msg = MIMEMultipart('alternative')
             msg['Subject'] = subject
             msg['From'] = f"{self.from_name} <{self.from_email}>"
             msg['To'] = to_email
+            msg['List-Unsubscribe'] = f"<{self.base_url}/{unsubscribe_path(to_email, token)}>"
+            if token:
+                # One-click unsubscribe from the mail client itself (RFC 8058); the old route is GET only
+                msg['List-Unsubscribe-Post'] = 'List-Unsubscribe=One-Click'
             
-            # Generate HTML content
-            html_content = render_template('email_template.html', 
-                                         articles=articles, 
-                                         subscriber_name=subscriber_name,
-                                         unsubscribe_url=f"http://localhost:5000/unsubscribe/{to_email}")
-            
-            # Generate plain text content
-            text_content = self._generate_text_content(articles, subscriber_name, to_email)
+            html_content, text_content = digest.personalise(to_email, subscriber_name, token)
             
             # Create MIMEText objects
             text_part = MIMEText(text_content, 'plain')
@@ -40,19 +161,16 @@ class EmailService:
             msg.attach(text_part)
             msg.attach(html_part)
             
-            # Send email
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.smtp_username, self.smtp_password)
-                server.send_message(msg)
+            # Send email over a pooled connection
+            self.pool.send_message(msg)
             
-            logging.info(f"Newsletter sent successfully to {to_email}")
+            logging.debug(f"Newsletter sent successfully to {to_email}")
             
         except Exception as e:
             logging.error(f"Failed to send newsletter to {to_email}: {str(e)}")
             raise e
     
-    def _generate_text_content(self, articles, subscriber_name, email):
+    def _generate_text_content(self, articles, subscriber_name, unsubscribe_url, click_urls=None):
         """Generate plain text version of the newsletter"""
         greeting = f"Hello {subscriber_name}!\n\n" if subscriber_name else "Hello!\n\n"
         
@@ -60,15 +178,16 @@ class EmailService:
         content += "Here's your curated news digest:\n\n"
         
         for i, article in enumerate(articles, 1):
+            url = click_urls[i - 1] if click_urls else article['url']
             content += f"{i}. {article['title']}\n"
             content += f"   Topic: {article['topic']}\n"
             content += f"   Source: {article['source']}\n"
             content += f"   Published: {article['published_date']}\n"
             content += f"   {article['description']}\n"
-            content += f"   Read more: {article['url']}\n\n"
+            content += f"   Read more: {url}\n\n"
         
         content += "---\n"
-        content += f"To unsubscribe, visit: http://localhost:5000/unsubscribe/{email}\n"
+        content += f"To unsubscribe, visit: {unsubscribe_url}\n"
         content += "Thanks for reading!\n"
         
         return content
@@ -77,8 +196,10 @@ class EmailService:
         """Test SMTP connection"""
         try:
             with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.smtp_username, self.smtp_password)
+                if self.use_tls:
+                    server.starttls()
+                if self.smtp_username:
+                    server.login(self.smtp_username, self.smtp_password)
             return True
         except Exception as e:
             logging.error(f"SMTP connection test failed: {str(e)}")
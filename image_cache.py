@@ -0,0 +1,186 @@
+"""
+Local, content-addressed cache of article images.
+
+Each article image is fetched once (size-capped, with timeouts) after
+ingestion, stored under the sha256 of its bytes, and, when Pillow is
+installed, downscaled to a few fixed widths. Templates link to
+/img/<hash>/<width>, which serves the files with year-long immutable
+cache headers, so newsletters never hotlink slow, huge or vanished
+third-party images.
+"""
+
+import io
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+import requests
+from sqlalchemy import update
+
+try:
+    from PIL import Image
+except ImportError:  # A declared dependency, but without it originals are served at every width
+    Image = None
+    logging.warning("Pillow is not installed: article images will be served at full size")
+
+IMAGE_WIDTHS = tuple(sorted(int(width) for width in os.environ.get('IMAGE_WIDTHS', '320,640').split(',')))
+# Width used for article images in digests and the preview
+DIGEST_IMAGE_WIDTH = int(os.environ.get('DIGEST_IMAGE_WIDTH', str(IMAGE_WIDTHS[-1])))
+IMAGE_MAX_BYTES = int(os.environ.get('IMAGE_MAX_BYTES', str(8 * 1024 * 1024)))
+IMAGE_FETCH_TIMEOUT = (3.05, float(os.environ.get('IMAGE_FETCH_TIMEOUT', '10')))
+IMAGE_CACHE_BATCH = int(os.environ.get('IMAGE_CACHE_BATCH', '200'))
+IMAGE_MAX_AGE = 365 * 24 * 3600
+
+# Marks an article whose image couldn't be fetched, so it isn't retried every pass
+FAILED = ''
+
+_MAGIC = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def cache_dir():
+    from app import app
+    return os.environ.get('IMAGE_CACHE_DIR') or os.path.join(app.instance_path, 'image_cache')
+
+
+def _session_for_images():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers['User-Agent'] = 'SevenArts image cache'
+        return _session
+
+
+def sniff_mimetype(data):
+    """Image type from magic bytes, or None if it isn't an image we serve"""
+    for magic, mimetype in _MAGIC:
+        if data.startswith(magic):
+            return mimetype
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def _entry_dir(digest):
+    return os.path.join(cache_dir(), digest[:2], digest)
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as tmp:
+        tmp.write(data)
+    os.replace(tmp_path, path)
+
+
+def _resize(data, width):
+    """JPEG bytes of the image scaled down to `width`, or None if it's already narrower"""
+    with Image.open(io.BytesIO(data)) as image:
+        if image.width <= width:
+            return None
+        image.thumbnail((width, width * 10))
+        if image.mode not in ('RGB', 'L'):
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image.convert('RGBA'), mask=image.convert('RGBA').split()[-1])
+            image = background
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=82, optimize=True, progressive=True)
+        return output.getvalue()
+
+
+def store_image(data):
+    """Store image bytes and their downscaled widths; returns the content hash"""
+    digest = hashlib.sha256(data).hexdigest()
+    directory = _entry_dir(digest)
+    if os.path.exists(os.path.join(directory, 'original')):
+        return digest
+    if Image is not None:
+        for width in IMAGE_WIDTHS:
+            try:
+                resized = _resize(data, width)
+            except Exception as e:
+                logging.warning(f"Could not downscale image {digest} to {width}px: {str(e)}")
+                break
+            if resized is not None:
+                _write_atomic(os.path.join(directory, f'{width}.jpg'), resized)
+    # Written last: its presence means the entry is complete
+    _write_atomic(os.path.join(directory, 'original'), data)
+    return digest
+
+
+def fetch_image(url):
+    """Download an image, refusing anything that isn't one or is too large"""
+    response = _session_for_images().get(url, timeout=IMAGE_FETCH_TIMEOUT, stream=True)
+    try:
+        response.raise_for_status()
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > IMAGE_MAX_BYTES:
+            raise ValueError(f'image is {length} bytes')
+        chunks, size = [], 0
+        for chunk in response.iter_content(64 * 1024):
+            size += len(chunk)
+            if size > IMAGE_MAX_BYTES:
+                raise ValueError(f'image exceeds {IMAGE_MAX_BYTES} bytes')
+            chunks.append(chunk)
+    finally:
+        response.close()
+    data = b''.join(chunks)
+    if sniff_mimetype(data) is None:
+        raise ValueError('not a JPEG, PNG, GIF or WebP image')
+    return data
+
+
+def cached_file(digest, width):
+    """(path, mimetype) to serve for a cached image at `width`, or None"""
+    directory = _entry_dir(digest)
+    resized = os.path.join(directory, f'{width}.jpg')
+    if os.path.exists(resized):
+        return resized, 'image/jpeg'
+    original = os.path.join(directory, 'original')
+    if not os.path.exists(original):
+        return None
+    # Narrower than `width` already, or no Pillow to shrink it
+    with open(original, 'rb') as f:
+        return original, sniff_mimetype(f.read(16)) or 'application/octet-stream'
+
+
+def proxy_url(digest, width=None):
+    """Absolute URL of a cached image, for emails as well as pages"""
+    base_url = os.environ.get('PUBLIC_BASE_URL', 'http://localhost:5000').rstrip('/')
+    return f'{base_url}/img/{digest}/{width or DIGEST_IMAGE_WIDTH}'
+
+
+def cache_article_images(executor, limit=IMAGE_CACHE_BATCH):
+    """Fetch and store images for stored articles that don't have one cached yet"""
+    from app import db
+    from models import Article
+
+    pending = db.session.query(Article.id, Article.image_url).filter(
+        Article.image_hash.is_(None), Article.image_url.isnot(None), Article.image_url != ''
+    ).order_by(Article.published_at.desc()).limit(limit).all()
+    if not pending:
+        return 0
+
+    def fetch(row):
+        try:
+            return row.id, store_image(fetch_image(row.image_url))
+        except Exception as e:
+            logging.info(f"Could not cache image {row.image_url}: {str(e)}")
+            return row.id, FAILED
+
+    results = list(executor.map(fetch, pending))
+    db.session.execute(update(Article), [{'id': article_id, 'image_hash': digest} for article_id, digest in results])
+    db.session.commit()
+
+    cached = sum(1 for _, digest in results if digest)
+    logging.info(f"Cached {cached} of {len(results)} article images")
+    return cached
@@ -0,0 +1,63 @@
+"""
+Database-backed leases for coordinating work across processes and hosts.
+
+A lease is a named row with a holder and an expiry. Taking it is a single
+conditional UPDATE (or an INSERT for a new name), so exactly one contender
+wins even when several race; a holder that dies simply lets it expire.
+"""
+
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import insert, update, delete, or_
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import Lease
+
+
+def node_id():
+    """Identity of this process in lease rows; override with NODE_ID"""
+    return os.environ.get('NODE_ID') or f'{socket.gethostname()}:{os.getpid()}'
+
+
+def acquire(name, ttl_seconds, holder=None):
+    """Take or renew the lease `name` for `ttl_seconds`; False if someone else holds it"""
+    holder = holder or node_id()
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl_seconds)
+
+    renewed = db.session.execute(
+        update(Lease).where(Lease.name == name, or_(Lease.holder == holder, Lease.expires_at <= now))
+        .values(holder=holder, expires_at=expires_at)
+    ).rowcount
+    if not renewed:
+        try:
+            db.session.execute(insert(Lease).values(name=name, holder=holder, expires_at=expires_at))
+        except IntegrityError:
+            # Held, unexpired, by another node
+            db.session.rollback()
+            return False
+    db.session.commit()
+    return True
+
+
+def claim(name, ttl_seconds):
+    """Take `name` only if nobody holds it, this node included; for run-once-per-period work
+
+    Returns the one-off holder, to renew the lease with, or None.
+    """
+    holder = f'{node_id()}:{uuid.uuid4().hex[:8]}'
+    return holder if acquire(name, ttl_seconds, holder=holder) else None
+
+
+def release(name, holder=None):
+    """Give up a lease early, if we still hold it"""
+    db.session.execute(delete(Lease).where(Lease.name == name, Lease.holder == (holder or node_id())))
+    db.session.commit()
+
+
+def prune_expired():
+    """Drop leases nobody holds any more, such as past days' digest leases"""
+    db.session.execute(delete(Lease).where(Lease.expires_at <= datetime.utcnow()))
+    db.session.commit()
@@ -0,0 +1,328 @@
+import os
+import smtplib
+import logging
+import threading
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, and_, or_, func, case
+from app import db
+from models import DigestRun, NewsletterIssue, NewsletterSent, Subscriber
+from delivery import DeliveryEngine
+from dashboard import invalidate_dashboard
+from metrics import DB_COMMIT_SECONDS, DELIVERIES
+from bulk import copy_insert, is_postgresql
+from snapshots import create_issues
+from email_service import RenderedDigest
+from tracking import subscriber_token
+from bounces import Bounce, classify_smtp, record_bounces
+
+MAX_ATTEMPTS = int(os.environ.get('MAIL_QUEUE_MAX_ATTEMPTS', '5'))
+RETRY_BASE_SECONDS = int(os.environ.get('MAIL_QUEUE_RETRY_BASE_SECONDS', '60'))
+BATCH_SIZE = int(os.environ.get('MAIL_QUEUE_BATCH_SIZE', '500'))
+ENQUEUE_CHUNK_SIZE = int(os.environ.get('MAIL_QUEUE_ENQUEUE_CHUNK_SIZE', '5000'))
+# How many delivery outcomes to record per commit. A message handed to the
+# relay can't be recorded in the same step, so if the process dies mid-run,
+# at most this many plus the sends in flight (SMTP_CONCURRENCY) can go out twice
+COMMIT_EVERY = int(os.environ.get('MAIL_QUEUE_COMMIT_EVERY', '10'))
+# How long a drain holds the deliveries it claimed; renewed on every commit,
+# so only the claims of a drain that died ever run out
+CLAIM_SECONDS = int(os.environ.get('MAIL_QUEUE_CLAIM_SECONDS', '600'))
+
+DrainResult = namedtuple('DrainResult', 'sent failed retrying')
+
+# Only one drain per process at a time, so a manual send and the scheduled
+# drain share the SMTP pool instead of racing for it; claims in the database
+# keep drains in different processes apart
+_drain_lock = threading.Lock()
+
+
+def create_run(subject):
+    """Record a run before it is planned, so its progress can be followed from the start"""
+    run = DigestRun(subject=subject, status='planning')
+    db.session.add(run)
+    db.session.commit()
+    return run
+
+
+def fail_run(run, reason):
+    """Close a run that never got as far as queueing deliveries"""
+    run.status = 'failed'
+    run.last_error = reason[:500]
+    run.completed_at = datetime.utcnow()
+    db.session.commit()
+
+
+def enqueue_run(plans, subject, run=None, edition=None):
+    """Persist a digest run: one issue per planned digest and one pending delivery per recipient
+
+    Deliveries are bulk inserted and committed in chunks, so a failure part way
+    through keeps everything queued before it. Pass `run` to fill in one made
+    by create_run. New issues are snapshotted under `edition` so later delivery
+    slots that day can reuse them; plans that already reuse one add deliveries only.
+    """
+    if run is None:
+        run = DigestRun(subject=subject)
+        db.session.add(run)
+    run.status = 'queued'
+    run.queued_at = datetime.utcnow()
+    db.session.flush()
+
+    issues = create_issues(plans, subject, edition, run.id)
+
+    queued = 0
+    for issue, subscriber_ids in issues:
+        for start in range(0, len(subscriber_ids), ENQUEUE_CHUNK_SIZE):
+            copy_insert(NewsletterSent, [
+                {'subscriber_id': subscriber_id, 'run_id': run.id, 'issue_id': issue.id,
+                 'status': 'pending', 'attempts': 0}
+                for subscriber_id in subscriber_ids[start:start + ENQUEUE_CHUNK_SIZE]
+            ])
+            with DB_COMMIT_SECONDS.time(operation='enqueue'):
+                db.session.commit()
+        queued += len(subscriber_ids)
+
+    invalidate_dashboard()
+    logging.info(f"Queued digest run {run.id}: {queued} deliveries across {len(issues)} issues")
+    return run
+
+
+def not_queued_in(edition):
+    """Filter on Subscriber: those with no delivery of an issue from `edition` yet"""
+    return Subscriber.id.notin_(
+        select(NewsletterSent.subscriber_id).join(NewsletterIssue, NewsletterIssue.id == NewsletterSent.issue_id)
+        .where(NewsletterIssue.edition == edition))
+
+
+def run_progress(run_id):
+    """Delivery counts and a naive ETA for one run, or None if there's no such run"""
+    run = db.session.get(DigestRun, run_id)
+    if run is None:
+        return None
+
+    counts = {status: (total, retried) for status, total, retried in db.session.query(
+        NewsletterSent.status, func.count(), func.sum(case((NewsletterSent.attempts > 0, 1), else_=0))
+    ).filter(NewsletterSent.run_id == run_id).group_by(NewsletterSent.status)}
+    sent = counts.get('sent', (0, 0))[0]
+    failed = counts.get('failed', (0, 0))[0]
+    skipped = counts.get('skipped', (0, 0))[0]
+    pending, retrying = counts.get('pending', (0, 0))
+    retrying = int(retrying or 0)
+    # Claimed by a drain and being sent right now
+    pending += counts.get('sending', (0, 0))[0]
+
+    # Extrapolate from the rate so far; retries waiting on backoff aren't counted
+    eta_seconds = None
+    done = sent + failed + skipped
+    if run.status == 'queued' and run.queued_at and done:
+        rate = done / max((datetime.utcnow() - run.queued_at).total_seconds(), 0.001)
+        eta_seconds = round((pending - retrying) / rate, 1)
+
+    return {
+        'run_id': run.id,
+        'status': run.status,
+        'error': run.last_error,
+        'total': sent + failed + skipped + pending,
+        'sent': sent,
+        'failed': failed,
+        'skipped': skipped,
+        'pending': pending,
+        'retrying': retrying,
+        'eta_seconds': eta_seconds,
+        'created_at': run.created_at.isoformat() if run.created_at else None,
+        'completed_at': run.completed_at.isoformat() if run.completed_at else None,
+    }
+
+
+def is_transient(error):
+    """Whether a failed send is worth retrying later"""
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    # Timeouts, refused connections and other socket errors
+    return isinstance(error, OSError)
+
+
+def retry_delay(attempts):
+    """Exponential backoff before the next attempt"""
+    return timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+
+
+def _claimable(now):
+    """Deliveries a drain may take: pending ones whose retry time has come, and expired claims"""
+    return or_(
+        and_(NewsletterSent.status == 'pending',
+             or_(NewsletterSent.next_attempt_at.is_(None), NewsletterSent.next_attempt_at <= now)),
+        # Claimed by a drain that died before recording an outcome
+        and_(NewsletterSent.status == 'sending', NewsletterSent.next_attempt_at <= now)
+    )
+
+
+def _claim_batch(run_id, now, shard=None):
+    """Claim the next due deliveries, oldest first, and return them; None once nothing is due
+
+    The claim is one conditional UPDATE that marks the rows 'sending' under a
+    fresh claim ID, so two drains, in one process or on different hosts,
+    never get the same row. On PostgreSQL the candidates are picked FOR
+    UPDATE SKIP LOCKED, so concurrent drains take different rows instead of
+    queueing behind each other. The result can be empty when another drain
+    claimed every candidate first. `shard` is an (index, count) pair
+    selecting subscribers whose ID modulo count equals index.
+    """
+    candidates = db.session.query(NewsletterSent.id).filter(_claimable(now))
+    if run_id is not None:
+        candidates = candidates.filter(NewsletterSent.run_id == run_id)
+    if shard is not None:
+        index, count = shard
+        candidates = candidates.filter(NewsletterSent.subscriber_id % count == index)
+    candidates = candidates.order_by(NewsletterSent.id).limit(BATCH_SIZE)
+    if is_postgresql():
+        candidates = candidates.with_for_update(skip_locked=True)
+    ids = [row.id for row in candidates]
+    if not ids:
+        db.session.rollback()
+        return None
+
+    claim = uuid.uuid4().hex
+    db.session.execute(update(NewsletterSent).where(NewsletterSent.id.in_(ids), _claimable(now)).values(
+        status='sending', claimed_by=claim, next_attempt_at=now + timedelta(seconds=CLAIM_SECONDS)
+    ).execution_options(synchronize_session=False))
+    with DB_COMMIT_SECONDS.time(operation='claim_deliveries'):
+        db.session.commit()
+
+    return db.session.query(
+        NewsletterSent.id, NewsletterSent.subscriber_id, NewsletterSent.issue_id, NewsletterSent.attempts,
+        NewsletterSent.claimed_by, Subscriber.email, Subscriber.name, Subscriber.active
+    ).join(Subscriber, NewsletterSent.subscriber_id == Subscriber.id).filter(
+        NewsletterSent.id.in_(ids), NewsletterSent.claimed_by == claim
+    ).order_by(NewsletterSent.id).all()
+
+
+def _outcome(row, error, now):
+    """Row update for one finished delivery"""
+    if error is None:
+        return {'id': row.id, 'status': 'sent', 'sent_at': now, 'attempts': row.attempts + 1,
+                'next_attempt_at': None, 'last_error': None}
+
+    attempts = row.attempts + 1
+    values = {'id': row.id, 'attempts': attempts, 'last_error': str(error)[:500]}
+    if is_transient(error) and attempts < MAX_ATTEMPTS:
+        values.update(status='pending', next_attempt_at=now + retry_delay(attempts))
+    else:
+        values.update(status='failed', next_attempt_at=None)
+    return values
+
+
+def _skipped(row):
+    """Row update for a delivery whose subscriber unsubscribed or bounced out since it was queued"""
+    return {'id': row.id, 'status': 'skipped', 'next_attempt_at': None, 'last_error': 'Subscriber is no longer active'}
+
+
+def _record(updates, bounces, claim):
+    if updates:
+        db.session.execute(update(NewsletterSent), updates)
+        record_bounces(bounces, 'smtp')
+        bounces.clear()
+        # Still working through this claim, so keep the rest of it ours
+        db.session.execute(update(NewsletterSent).where(
+            NewsletterSent.status == 'sending', NewsletterSent.claimed_by == claim
+        ).values(next_attempt_at=datetime.utcnow() + timedelta(seconds=CLAIM_SECONDS)
+                 ).execution_options(synchronize_session=False))
+        with DB_COMMIT_SECONDS.time(operation='record_outcomes'):
+            db.session.commit()
+        updates.clear()
+        invalidate_dashboard()
+
+
+def _complete_runs():
+    """Mark runs with nothing left pending as completed"""
+    pending_runs = db.session.query(NewsletterSent.run_id).filter(
+        NewsletterSent.status.in_(('pending', 'sending')), NewsletterSent.run_id.isnot(None)
+    ).distinct()
+    DigestRun.query.filter(
+        DigestRun.status == 'queued', ~DigestRun.id.in_(pending_runs)
+    ).update({'status': 'completed', 'completed_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+
+
+def drain(email_service, run_id=None, shard=None, heartbeat=None):
+    """Send every due pending delivery (optionally for one run or shard), recording each outcome
+
+    Each batch is claimed in the database first, so concurrent drains
+    never send the same delivery, and outcomes are committed every
+    COMMIT_EVERY sends. Safe to call again after a crash: deliveries whose
+    outcome wasn't recorded are taken up again once their claim expires,
+    so at most COMMIT_EVERY plus the in-flight sends go out twice.
+    `heartbeat` is called before each batch, e.g. to renew a lease; if it
+    returns False the drain stops early.
+    """
+    with _drain_lock:
+        engine = DeliveryEngine(email_service)
+        digests = {}
+        sent = failed = retrying = skipped = 0
+
+        def send(job):
+            row, (subject, digest) = job
+            email_service.send_digest(row.email, subject, digest, row.name, subscriber_token(row.subscriber_id))
+
+        while True:
+            if heartbeat is not None and heartbeat() is False:
+                logging.warning("Stopping mail queue drain early: heartbeat check failed")
+                break
+            rows = _claim_batch(run_id, datetime.utcnow(), shard)
+            if rows is None:
+                break
+            if not rows:
+                # Another drain claimed these first; there may be more behind them
+                continue
+            claim = rows[0].claimed_by
+
+            updates = []
+            bounces = []
+            # Render each issue once, however many rows share it
+            jobs = []
+            for row in rows:
+                if not row.active:
+                    updates.append(_skipped(row))
+                    continue
+                if row.issue_id not in digests:
+                    issue = db.session.get(NewsletterIssue, row.issue_id)
+                    # Issues from before snapshots existed are rendered here instead
+                    digest = RenderedDigest.from_issue(issue) or email_service.render_digest(issue.articles, issue.id)
+                    digests[row.issue_id] = (issue.subject, digest)
+                jobs.append((row, digests[row.issue_id]))
+
+            if updates:
+                skipped += len(updates)
+                DELIVERIES.inc(len(updates), status='skipped')
+            for (row, _), error in engine.deliver(jobs, send):
+                values = _outcome(row, error, datetime.utcnow())
+                DELIVERIES.inc(status=values['status'] if values['status'] != 'pending' else 'retrying')
+                if values['status'] == 'sent':
+                    sent += 1
+                elif values['status'] == 'failed':
+                    failed += 1
+                    logging.error(f"Giving up on newsletter to {row.email}: {values['last_error']}")
+                    # Counted once per delivery, when it's given up on, however many attempts it took
+                    kind = classify_smtp(error)
+                    if kind is not None:
+                        bounces.append(Bounce(row.subscriber_id, kind, row.issue_id))
+                else:
+                    retrying += 1
+                    logging.warning(f"Will retry newsletter to {row.email} (attempt {values['attempts']}): "
+                                    f"{values['last_error']}")
+
+                updates.append(values)
+                if len(updates) >= COMMIT_EVERY:
+                    _record(updates, bounces, claim)
+            _record(updates, bounces, claim)
+
+        _complete_runs()
+        if skipped:
+            logging.info(f"Skipped {skipped} queued deliveries to subscribers who are no longer active")
+        return DrainResult(sent, failed, retrying)
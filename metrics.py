@@ -0,0 +1,141 @@
+"""
+Low-overhead in-process counters and histograms with Prometheus text exposition.
+
+Each metric keeps a dict of label values -> series guarded by one lock, so
+recording is a dict lookup and a few additions. Values are per process;
+under several gunicorn workers each worker reports its own.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond renders to slow upstream calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = []
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    """Monotonically increasing count, optionally split by labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # An unlabelled counter reports 0 before its first increment
+        self._values = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f'{self.name}_total{_format_labels(self.labelnames, key)} {value}'
+
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of a block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, key, ("le", bound))} {cumulative}'
+            yield f'{self.name}_bucket{_format_labels(self.labelnames, key, ("le", "+Inf"))} {series[-1]}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}'
+
+
+def render_prometheus():
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+# Hot-path metrics shared across the app
+NEWSAPI_REQUEST_SECONDS = Histogram(
+    'sevenarts_newsapi_request_seconds', 'NewsAPI request latency', ['outcome'])
+NEWS_CACHE_LOOKUPS = Counter(
+    'sevenarts_news_cache_lookups', 'Article cache lookups by result', ['result'])
+RENDER_SECONDS = Histogram(
+    'sevenarts_render_seconds', 'Template rendering time', ['template'])
+SMTP_SECONDS = Histogram(
+    'sevenarts_smtp_seconds', 'SMTP latency by stage', ['stage'])
+SMTP_MESSAGES = Counter(
+    'sevenarts_smtp_messages', 'Messages handed to the SMTP relay by outcome', ['outcome'])
+SMTP_RECONNECTS = Counter(
+    'sevenarts_smtp_reconnects', 'Pooled SMTP sessions reopened after the server dropped them')
+DB_COMMIT_SECONDS = Histogram(
+    'sevenarts_db_commit_seconds', 'Database commit latency', ['operation'])
+DELIVERIES = Counter(
+    'sevenarts_deliveries', 'Queued newsletter deliveries by final status', ['status'])
+NEWSAPI_RETRIES = Counter(
+    'sevenarts_newsapi_retries', 'NewsAPI requests retried after a transient failure')
+NEWSAPI_REJECTED = Counter(
+    'sevenarts_newsapi_rejected', 'NewsAPI requests refused locally or rate limited upstream', ['reason'])
+ARCHIVE_SEARCH_SECONDS = Histogram(
+    'sevenarts_archive_search_seconds', 'Archive search latency by index used', ['mode'])
+TRACKING_EVENTS = Counter(
+    'sevenarts_tracking_events', 'Reader events buffered for the event log by kind', ['kind'])
+BOUNCES = Counter(
+    'sevenarts_bounces', 'Bounces recorded by classification and where they were reported', ['kind', 'source'])
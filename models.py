@@ -1,37 +1,264 @@
 from app import db
 from datetime import datetime
-from sqlalchemy import Text, JSON
+from sqlalchemy import Text, JSON, DDL, event, func, exists, select, type_coerce
+from sqlalchemy.dialects.postgresql import JSONB
+import image_cache
+
+# JSONB on PostgreSQL, so JSON columns can be indexed and queried with @>
+JSONType = JSON().with_variant(JSONB(), 'postgresql')
 
 class Subscriber(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     name = db.Column(db.String(100), nullable=True)
-    art_forms = db.Column(JSON, default=list)  # List of preferred art forms
-    active = db.Column(db.Boolean, default=True)
+    art_forms = db.Column(JSONType, default=list)  # List of preferred art forms
+    active = db.Column(db.Boolean, default=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    delivery_hour = db.Column(db.Integer, nullable=True)  # Local hour 0-23; None means delivery_slots.DEFAULT_DELIVERY_HOUR
+    timezone = db.Column(db.String(64), nullable=True)  # IANA name; None means delivery_slots.DEFAULT_TIMEZONE
+    # Bounce counters, see bounces.py; None means none yet
+    hard_bounces = db.Column(db.Integer, default=0, nullable=True)
+    soft_bounces = db.Column(db.Integer, default=0, nullable=True)  # Since the last gap of SOFT_BOUNCE_RESET_DAYS
+    last_bounce_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        # Serves "who likes X" containment queries; PostgreSQL only
+        db.Index('ix_subscriber_art_forms_gin', 'art_forms', postgresql_using='gin',
+                 postgresql_ops={'art_forms': 'jsonb_path_ops'}).ddl_if(dialect='postgresql'),
+    )
     
     def __repr__(self):
         return f'<Subscriber {self.email}>'
+    
+    @staticmethod
+    def likes(art_form):
+        """Filter for subscribers whose art_forms include `art_form`
+        
+        A JSONB containment test on PostgreSQL, which the GIN index serves;
+        json_each elsewhere.
+        """
+        if db.engine.dialect.name == 'postgresql':
+            return type_coerce(Subscriber.art_forms, JSONB).contains([art_form])
+        items = func.json_each(Subscriber.art_forms).table_valued('value')
+        return exists(select(1).select_from(items).where(items.c.value == art_form))
+    
+    @staticmethod
+    def iter_active(batch_size=1000, where=None):
+        """Stream active subscribers as (id, email, name, art_forms) rows, one keyset page at a time
+        
+        `where` narrows them further, e.g. to one delivery slot.
+        """
+        last_id = 0
+        while True:
+            query = db.session.query(
+                Subscriber.id, Subscriber.email, Subscriber.name, Subscriber.art_forms
+            ).filter_by(active=True).filter(Subscriber.id > last_id)
+            if where is not None:
+                query = query.filter(where)
+            rows = query.order_by(Subscriber.id).limit(batch_size).all()
+            
+            if not rows:
+                return
+            yield from rows
+            last_id = rows[-1].id
+
+class DigestRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(200))
+    status = db.Column(db.String(50), default='queued')  # planning, queued, completed, failed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    queued_at = db.Column(db.DateTime, nullable=True)  # When its deliveries were queued; the base for send-rate ETAs
+    completed_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.String(500), nullable=True)  # Why a run never got as far as queueing
+    
+    def __repr__(self):
+        return f'<DigestRun {self.id} {self.status}>'
+
+class NewsletterIssue(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('digest_run.id'), nullable=True)
+    subject = db.Column(db.String(200))
+    articles = db.Column(JSONType)  # The cultural articles in this digest, stored once for all its recipients
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    edition = db.Column(db.Date, nullable=True)  # UTC day whose delivery slots share this issue; None for manual sends
+    signature = db.Column(db.String(1000), nullable=True)  # '|'-joined preference signature it was planned for
+    # Immutable snapshot of the rendered bodies, with recipient placeholders; see snapshots.py
+    html_named = db.Column(Text, nullable=True)
+    html_anonymous = db.Column(Text, nullable=True)
+    text_named = db.Column(Text, nullable=True)
+    text_anonymous = db.Column(Text, nullable=True)
+    rendered_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_newsletter_issue_edition', 'edition', 'signature'),
+    )
+    
+    run = db.relationship('DigestRun', backref=db.backref('issues', lazy=True))
+    
+    def __repr__(self):
+        return f'<NewsletterIssue {self.id}>'
 
 class NewsletterSent(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     subscriber_id = db.Column(db.Integer, db.ForeignKey('subscriber.id'), nullable=False)
-    articles = db.Column(JSON)  # Store the cultural articles that were sent
-    sent_at = db.Column(db.DateTime, default=datetime.utcnow)
-    subject = db.Column(db.String(200))
-    status = db.Column(db.String(50), default='pending')  # pending, sent, failed
+    run_id = db.Column(db.Integer, db.ForeignKey('digest_run.id'), nullable=True)
+    issue_id = db.Column(db.Integer, db.ForeignKey('newsletter_issue.id'), nullable=True)
+    sent_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    status = db.Column(db.String(50), default='pending')  # pending, sending (claimed), sent, failed, skipped (subscriber went inactive)
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=True)  # Earliest retry time for a pending send; claim expiry while sending
+    claimed_by = db.Column(db.String(32), nullable=True)  # Claim ID of the drain that last took it, see mail_queue
+    last_error = db.Column(db.String(500), nullable=True)
     
     subscriber = db.relationship('Subscriber', backref=db.backref('newsletters', lazy=True))
+    run = db.relationship('DigestRun', backref=db.backref('deliveries', lazy=True))
+    issue = db.relationship('NewsletterIssue', backref=db.backref('deliveries', lazy=True))
+    
+    __table_args__ = (
+        db.Index('ix_newsletter_sent_status_next_attempt', 'status', 'next_attempt_at'),
+        db.Index('ix_newsletter_sent_run_status', 'run_id', 'status'),
+    )
     
     def __repr__(self):
         return f'<NewsletterSent {self.id} for {self.subscriber.email}>'
 
+class DeliveryEvent(db.Model):
+    """Append-only log of what readers and their mail servers did with digests
+
+    Written in batches: reader events by tracking.EventLog, bounces by bounces.record_bounces.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'open', 'click', 'unsubscribe', 'hard_bounce' or 'soft_bounce'
+    # No foreign keys: one stray row must never fail a whole batch
+    subscriber_id = db.Column(db.Integer, nullable=False, index=True)
+    issue_id = db.Column(db.Integer, nullable=True)  # NewsletterIssue.id for opens and clicks
+    link = db.Column(db.Integer, nullable=True)  # Position of the clicked article in the issue
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_delivery_event_issue_kind', 'issue_id', 'kind'),
+    )
+    
+    def __repr__(self):
+        return f'<DeliveryEvent {self.kind} by {self.subscriber_id}>'
+
 class ArtForm(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
-    keywords = db.Column(JSON, default=list)  # Keywords for filtering cultural articles
+    keywords = db.Column(JSONType, default=list)  # Keywords for filtering cultural articles
     active = db.Column(db.Boolean, default=True)
     description = db.Column(db.String(200), nullable=True)  # Description of the art form
     
     def __repr__(self):
         return f'<ArtForm {self.name}>'
+
+class Article(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    url = db.Column(db.String(1000), unique=True, nullable=False)
+    content_hash = db.Column(db.String(64), index=True, nullable=False)  # sha256 of normalised title + description
+    title = db.Column(db.String(500), nullable=False)
+    description = db.Column(Text)
+    source = db.Column(db.String(200))
+    image_url = db.Column(db.String(1000))
+    image_hash = db.Column(db.String(64), nullable=True)  # Content hash in the local image cache; '' if the fetch failed
+    published_at = db.Column(db.DateTime, index=True)
+    fetched_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_sent_at = db.Column(db.DateTime, nullable=True)  # When this article last went out in a digest
+    
+    art_forms = db.relationship('ArticleArtForm', backref='article', lazy=True)
+    
+    def as_digest_article(self, art_form):
+        """Same shape as NewsService._format_article, for templates and issues"""
+        published_date = self.published_at.strftime('%B %d, %Y') if self.published_at else 'Cultural Discovery'
+        return {
+            'title': self.title,
+            'description': self.description,
+            'url': self.url,
+            'source': self.source or 'Cultural Source',
+            'published_date': published_date,
+            'art_form': art_form,
+            'topic': art_form,  # Keep for backward compatibility
+            # Only ever the local copy, so digests don't hotlink third-party images
+            'image_url': image_cache.proxy_url(self.image_hash) if self.image_hash else ''
+        }
+    
+    def __repr__(self):
+        return f'<Article {self.url}>'
+
+class ArticleArtForm(db.Model):
+    article_id = db.Column(db.Integer, db.ForeignKey('article.id'), primary_key=True)
+    art_form = db.Column(db.String(100), primary_key=True, index=True)
+    
+    def __repr__(self):
+        return f'<ArticleArtForm {self.article_id} {self.art_form}>'
+
+class SchemaVersion(db.Model):
+    version = db.Column(db.Integer, primary_key=True)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SchemaVersion {self.version}>'
+
+class Lease(db.Model):
+    name = db.Column(db.String(200), primary_key=True)
+    holder = db.Column(db.String(200), nullable=False)  # Node that owns the lease, see leases.node_id
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<Lease {self.name} held by {self.holder}>'
+
+class ArchiveDocument(db.Model):
+    """One searchable archive entry: an ingested article or a sent newsletter issue
+    
+    The inverted index lives beside it: an external-content FTS5 table kept in
+    step by triggers on SQLite, a generated tsvector column with a GIN index on
+    PostgreSQL. Both are created with the table, see the DDL below.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'article' or 'issue'
+    ref_id = db.Column(db.Integer, nullable=False)  # Article.id or NewsletterIssue.id
+    url = db.Column(db.String(1000))
+    title = db.Column(Text)  # An issue's article titles
+    body = db.Column(Text)  # Description, or an issue's article descriptions
+    source = db.Column(db.String(500))
+    art_forms = db.Column(db.String(500))  # '; '-separated
+    published_at = db.Column(db.DateTime, index=True)
+    
+    __table_args__ = (
+        db.Index('ix_archive_document_ref', 'kind', 'ref_id', unique=True),
+    )
+    
+    def __repr__(self):
+        return f'<ArchiveDocument {self.kind} {self.ref_id}>'
+
+_ARCHIVE_FTS_COLUMNS = 'title, body, source, art_forms'
+
+for _statement in (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS archive_fts USING fts5("
+    f"{_ARCHIVE_FTS_COLUMNS}, content='archive_document', content_rowid='id', "
+    "tokenize='porter unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER archive_document_ai AFTER INSERT ON archive_document BEGIN "
+    f"INSERT INTO archive_fts(rowid, {_ARCHIVE_FTS_COLUMNS}) "
+    "VALUES (new.id, new.title, new.body, new.source, new.art_forms); END",
+    "CREATE TRIGGER archive_document_ad AFTER DELETE ON archive_document BEGIN "
+    f"INSERT INTO archive_fts(archive_fts, rowid, {_ARCHIVE_FTS_COLUMNS}) "
+    "VALUES ('delete', old.id, old.title, old.body, old.source, old.art_forms); END",
+    "CREATE TRIGGER archive_document_au AFTER UPDATE ON archive_document BEGIN "
+    f"INSERT INTO archive_fts(archive_fts, rowid, {_ARCHIVE_FTS_COLUMNS}) "
+    "VALUES ('delete', old.id, old.title, old.body, old.source, old.art_forms); "
+    f"INSERT INTO archive_fts(rowid, {_ARCHIVE_FTS_COLUMNS}) "
+    "VALUES (new.id, new.title, new.body, new.source, new.art_forms); END",
+):
+    event.listen(ArchiveDocument.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+event.listen(ArchiveDocument.__table__, 'before_drop',
+             DDL("DROP TABLE IF EXISTS archive_fts").execute_if(dialect='sqlite'))
+
+for _statement in (
+    "ALTER TABLE archive_document ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(art_forms, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(body, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(source, '')), 'C')) STORED",
+    "CREATE INDEX ix_archive_document_search ON archive_document USING gin (search_vector)",
+):
+    event.listen(ArchiveDocument.__table__, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
@@ -1,45 +1,127 @@
-import requests
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import logging
+from cache import TTLCache
+from metrics import NEWS_CACHE_LOOKUPS
+from newsapi_client import get_client, NewsAPIError
+
+# One article cache and fetch pool per upstream and key, shared like the
+# client by every NewsService in the process, so a job that builds its own
+# NewsService still hits what earlier jobs and requests fetched
+_shared = {}
+_shared_lock = threading.Lock()
+
+def _shared_state(base_url, api_key, max_workers):
+    with _shared_lock:
+        key = (base_url, api_key)
+        if key not in _shared:
+            cache = TTLCache(maxsize=int(os.environ.get('NEWS_CACHE_SIZE', '256')),
+                             ttl=int(os.environ.get('NEWS_CACHE_TTL', '900')),
+                             stale_ttl=int(os.environ.get('NEWS_CACHE_STALE_TTL', '3600')))
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='newsapi')
+            _shared[key] = (cache, executor)
+        return _shared[key]
 
 class NewsService:
     def __init__(self):
         self.api_key = os.environ.get('NEWS_API_KEY', 'demo_key')
-        self.base_url = 'https://newsapi.org/v2'
+        self.base_url = os.environ.get('NEWS_API_BASE_URL', 'https://newsapi.org/v2').rstrip('/')
+        self.max_workers = int(os.environ.get('NEWS_API_CONCURRENCY', '7'))
+        # (connect, read) timeouts so a hung upstream can't stall a digest
+        self.timeout = (float(os.environ.get('NEWS_API_CONNECT_TIMEOUT', '3.05')),
+                        float(os.environ.get('NEWS_API_READ_TIMEOUT', '10')))
+        
+        # Retries, circuit breaker and quota pacing, shared across instances
+        self.client = get_client(self.base_url, self.api_key, self.max_workers, self.timeout)
+        self.session = self.client.session
+        
+        self.cache, self.executor = _shared_state(self.base_url, self.api_key, self.max_workers)
         
     def get_articles_by_art_form(self, art_form_name, keywords=None, limit=5):
-        """Fetch articles for a specific art form"""
-        try:
-            # Use keywords if provided, otherwise use art form name
-            query = ' OR '.join(keywords) if keywords else art_form_name
-            
-            # Remove date restrictions for more interesting, diverse content
-            params = {
-                'q': query,
-                'apiKey': self.api_key,
-                'language': 'en',
-                'sortBy': 'relevancy',  # Changed to relevancy for better cultural content
-                'pageSize': limit * 2  # Get more results to filter better
-            }
-            
-            response = requests.get(f'{self.base_url}/everything', params=params)
-            response.raise_for_status()
-            
-            data = response.json()
-            articles = data.get('articles', [])
-            
-            # Filter and format articles
-            formatted_articles = []
-            for article in articles:
-                if self._is_quality_article(article):
-                    formatted_articles.append(self._format_article(article, art_form_name))
-            
-            return formatted_articles[:limit]
-            
-        except Exception as e:
-            logging.error(f"Error fetching articles for art form {art_form_name}: {str(e)}")
-            return []
+        """Fetch articles for a specific art form
+        
+        A stale cached result is served without waiting on NewsAPI; with nothing
+        cached, NewsAPIError (including quota and open-circuit errors) propagates.
+        """
+        # Use keywords if provided, otherwise use art form name
+        query = ' OR '.join(keywords) if keywords else art_form_name
+        
+        # Remove date restrictions for more interesting, diverse content
+        params = {
+            'q': query,
+            'language': 'en',
+            'sortBy': 'relevancy',  # Changed to relevancy for better cultural content
+            'pageSize': limit * 2  # Get more results to filter better
+        }
+        
+        cache_key = ('everything', art_form_name, limit) + tuple(sorted(params.items()))
+        missed = []
+        
+        def load():
+            missed.append(True)
+            return self._fetch_articles(art_form_name, params, limit)
+        
+        articles = self.cache.get_or_load(cache_key, load)
+        NEWS_CACHE_LOOKUPS.inc(result='miss' if missed else 'hit')
+        return articles
+    
+    def _fetch_articles(self, art_form_name, params, limit):
+        """Query NewsAPI and return formatted quality articles"""
+        articles = self.search_everything(params)
+        
+        # Filter and format articles
+        formatted_articles = []
+        for article in articles:
+            if self._is_quality_article(article):
+                formatted_articles.append(self._format_article(article, art_form_name))
+        
+        return formatted_articles[:limit]
+    
+    def search_everything(self, params):
+        """Raw NewsAPI /everything results for `params`, uncached"""
+        return self.client.get('everything', params).get('articles', [])
+    
+    def get_articles_for_art_forms(self, art_forms, limit=1):
+        """Articles for several (name, keywords) pairs, keyed by art form name
+        
+        Reads the local article store first; only art forms it has nothing
+        for are fetched from NewsAPI, concurrently. An art form whose fetch
+        fails comes back empty, but if every fetch fails and nothing was found
+        the error is raised, so an exhausted quota can't pass for a quiet news day.
+        """
+        from article_store import latest_articles
+        
+        art_forms = list(art_forms)
+        found = {name: latest_articles(name, limit) for name, _ in art_forms}
+        
+        def fetch(form):
+            try:
+                return form[0], self.get_articles_by_art_form(form[0], form[1], limit), None
+            except NewsAPIError as e:
+                logging.error(f"Error fetching articles for art form {form[0]}: {str(e)}")
+                return form[0], [], e
+        
+        missing = [form for form in art_forms if not found[form[0]]]
+        errors = []
+        for name, articles, error in self.executor.map(fetch, missing):
+            found[name] = articles
+            if error is not None:
+                errors.append(error)
+        
+        if errors and not any(found.values()):
+            raise errors[0]
+        
+        return {name: found[name] for name, _ in art_forms}
+    
+    def _fetch_for_art_forms(self, art_forms):
+        """Fetch one article per (name, keywords) pair, issuing the queries concurrently"""
+        curated_articles = []
+        for articles in self.get_articles_for_art_forms(art_forms, 1).values():
+            if articles:
+                curated_articles.extend(articles)
+        return curated_articles
     
     def get_curated_articles(self):
         """Get curated articles from different art forms"""
@@ -51,25 +133,14 @@ class NewsService:
             
             if not art_forms:
                 # The seven classic art forms if none configured
-                default_art_forms = [
-                    {'name': 'Architecture', 'keywords': ['architecture', 'building design', 'urban planning', 'architectural']},
-                    {'name': 'Sculpture', 'keywords': ['sculpture', 'sculptural', 'installation art', 'public art']},
-                    {'name': 'Painting', 'keywords': ['painting', 'visual art', 'contemporary art', 'fine art']},
-                    {'name': 'Music', 'keywords': ['music', 'classical music', 'contemporary music', 'composer']},
-                    {'name': 'Poetry', 'keywords': ['poetry', 'literature', 'poet', 'literary']},
-                    {'name': 'Dance', 'keywords': ['dance', 'ballet', 'contemporary dance', 'choreography']},
-                    {'name': 'Theater', 'keywords': ['theater', 'theatre', 'drama', 'performance art']}
-                ]
+                from schema import DEFAULT_ART_FORMS as default_art_forms
                 
-                curated_articles = []
                 # Select 3 random art forms for variety
                 import random
                 selected_forms = random.sample(default_art_forms, 3)
                 
-                for art_form_data in selected_forms:
-                    articles = self.get_articles_by_art_form(art_form_data['name'], art_form_data['keywords'], 1)
-                    if articles:
-                        curated_articles.extend(articles)
+                curated_articles = self._fetch_for_art_forms(
+                    [(art_form_data['name'], art_form_data['keywords']) for art_form_data in selected_forms])
                 
                 return curated_articles[:3]
             
@@ -77,11 +148,8 @@ class NewsService:
             import random
             selected_art_forms = random.sample(list(art_forms), min(3, len(art_forms)))
             
-            curated_articles = []
-            for art_form in selected_art_forms:
-                articles = self.get_articles_by_art_form(art_form.name, art_form.keywords, 1)
-                if articles:
-                    curated_articles.extend(articles)
+            curated_articles = self._fetch_for_art_forms(
+                [(art_form.name, art_form.keywords) for art_form in selected_art_forms])
             
             return curated_articles[:3]
     
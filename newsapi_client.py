@@ -0,0 +1,337 @@
+"""
+Resilient HTTP client for NewsAPI.
+
+Every request has connect and read timeouts. Connection errors, timeouts
+and 5xx responses are retried with full-jitter backoff, but only while the
+retry budget allows, so retries can't multiply the load on a struggling
+upstream. Consecutive failures open a circuit breaker that fails fast until
+a probe request succeeds. Rate-limit headers and 429 responses feed a quota
+tracker that spreads requests over what is left of the quota window and
+refuses them, loudly, once it's spent.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import NEWSAPI_REQUEST_SECONDS, NEWSAPI_RETRIES, NEWSAPI_REJECTED
+
+MAX_RETRIES = int(os.environ.get('NEWS_API_MAX_RETRIES', '2'))
+RETRY_BASE_SECONDS = float(os.environ.get('NEWS_API_RETRY_BASE_SECONDS', '0.5'))
+RETRY_MAX_SECONDS = float(os.environ.get('NEWS_API_RETRY_MAX_SECONDS', '8'))
+# Retries may add at most this fraction on top of first attempts
+RETRY_BUDGET_RATIO = float(os.environ.get('NEWS_API_RETRY_BUDGET', '0.2'))
+BREAKER_FAILURES = int(os.environ.get('NEWS_API_BREAKER_FAILURES', '5'))
+BREAKER_RESET_SECONDS = float(os.environ.get('NEWS_API_BREAKER_RESET_SECONDS', '60'))
+# Requests per rolling day when the upstream sends no rate-limit headers; 0 means unknown
+DAILY_QUOTA = int(os.environ.get('NEWS_API_DAILY_QUOTA', '0'))
+QUOTA_BURST = int(os.environ.get('NEWS_API_QUOTA_BURST', '10'))
+# Longest a request will sleep for pacing before giving up with QuotaExceededError
+MAX_PACING_WAIT = float(os.environ.get('NEWS_API_MAX_PACING_WAIT', '5'))
+
+
+class NewsAPIError(Exception):
+    """A NewsAPI request failed; `code` is NewsAPI's error code when it sent one"""
+
+    def __init__(self, message, code=None, status=None):
+        super().__init__(message)
+        self.code = code
+        self.status = status
+
+    @property
+    def transient(self):
+        return self.status is None or self.status >= 500
+
+
+class CircuitOpenError(NewsAPIError):
+    """Failing fast because NewsAPI has been failing"""
+
+
+class QuotaExceededError(NewsAPIError):
+    """The request quota is spent, or pacing would wait too long"""
+
+    def __init__(self, message, retry_at=None):
+        super().__init__(message, code='rateLimited', status=429)
+        self.retry_at = retry_at
+
+
+def _parse_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_reset(value):
+    """X-RateLimit-Reset as an epoch timestamp; accepts epoch seconds or seconds from now"""
+    reset = _parse_int(value)
+    if reset is None:
+        return None
+    return float(reset) if reset > 1_000_000_000 else time.time() + reset
+
+
+def _parse_retry_after(value):
+    """Retry-After (seconds or an HTTP date) as an epoch timestamp"""
+    if not value:
+        return None
+    seconds = _parse_int(value)
+    if seconds is not None:
+        return time.time() + seconds
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _format_epoch(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d %H:%M UTC')
+
+
+class CircuitBreaker:
+    """Open after `failure_threshold` consecutive failures; let one probe through after `reset_timeout`"""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                return 'open'
+            return 'half-open'
+
+    def before_request(self):
+        """Raise CircuitOpenError unless a request may go out now"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError(f"NewsAPI circuit open after {self._failures} consecutive failures")
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logging.info("NewsAPI circuit closed")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logging.warning(f"NewsAPI circuit opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """Each request earns `ratio` of a retry; a retry spends a whole one"""
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, floor=3):
+        self.ratio = ratio
+        self.capacity = max(floor, 10)
+        self._tokens = float(floor)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class QuotaTracker:
+    """Spread the remaining request quota evenly until it resets
+
+    The remaining count and reset time come from X-RateLimit-* headers when
+    the upstream sends them, otherwise from DAILY_QUOTA counted locally. A
+    429 blocks requests until its Retry-After (or the reset time) passes.
+    """
+
+    def __init__(self, daily_quota=DAILY_QUOTA, burst=QUOTA_BURST, max_wait=MAX_PACING_WAIT):
+        self.daily_quota = daily_quota
+        self.burst = burst
+        self.max_wait = max_wait
+        self._remaining = daily_quota or None
+        self._reset_at = time.time() + 86400 if daily_quota else None
+        self._blocked_until = None
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for the next paced request slot; raise QuotaExceededError if there won't be one soon"""
+        while True:
+            with self._lock:
+                now = time.time()
+                if self._blocked_until is not None:
+                    if now < self._blocked_until:
+                        raise QuotaExceededError(
+                            f"NewsAPI rate limited until {_format_epoch(self._blocked_until)}",
+                            retry_at=self._blocked_until)
+                    self._blocked_until = None
+                if self._reset_at is not None and now >= self._reset_at:
+                    self._remaining = self.daily_quota or None
+                    self._reset_at = now + 86400 if self.daily_quota else None
+                if self._remaining is None:
+                    return
+                if self._remaining <= 0:
+                    raise QuotaExceededError(
+                        f"NewsAPI quota spent until {_format_epoch(self._reset_at)}", retry_at=self._reset_at)
+
+                rate = self._remaining / max(self._reset_at - now, 1)
+                monotonic = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (monotonic - self._updated) * rate)
+                self._updated = monotonic
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self._remaining -= 1
+                    return
+                wait_for = (1 - self._tokens) / rate
+                if wait_for > self.max_wait:
+                    raise QuotaExceededError(
+                        f"NewsAPI quota pacing: next request allowed in {wait_for:.0f}s", retry_at=now + wait_for)
+            time.sleep(wait_for)
+
+    def update(self, headers, status):
+        """Learn the quota from a response"""
+        remaining = _parse_int(headers.get('X-RateLimit-Remaining'))
+        reset_at = _parse_reset(headers.get('X-RateLimit-Reset'))
+        with self._lock:
+            if remaining is not None:
+                self._remaining = remaining
+            if reset_at is not None:
+                self._reset_at = reset_at
+            if remaining is not None and self._reset_at is None:
+                # Assume NewsAPI's rolling day when only the remaining count is known
+                self._reset_at = time.time() + 86400
+            if status == 429:
+                self._blocked_until = (_parse_retry_after(headers.get('Retry-After'))
+                                       or self._reset_at or time.time() + 3600)
+
+
+class NewsAPIClient:
+    """GET NewsAPI endpoints through timeouts, budgeted retries, a circuit breaker and quota pacing"""
+
+    def __init__(self, base_url, api_key, pool_size=7, timeout=(3.05, 10)):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+        self.breaker = CircuitBreaker()
+        self.retry_budget = RetryBudget()
+        self.quota = QuotaTracker()
+
+        # Keep-alive session shared by every query
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, path, params):
+        """Decoded JSON for a successful request; raises NewsAPIError (or a subclass) otherwise"""
+        try:
+            self.quota.acquire()
+            self.breaker.before_request()
+        except (QuotaExceededError, CircuitOpenError) as e:
+            NEWSAPI_REJECTED.inc(reason='quota' if isinstance(e, QuotaExceededError) else 'circuit_open')
+            raise
+        self.retry_budget.deposit()
+
+        healthy = False
+        try:
+            data = self._get_with_retries(path, params)
+            healthy = True
+            return data
+        except NewsAPIError as e:
+            # A 4xx means the upstream is up and answering, unless it only stopped
+            # a retry after the last attempt had failed
+            failed_attempt = e.__cause__ if isinstance(e.__cause__, NewsAPIError) else e
+            healthy = not failed_attempt.transient
+            raise
+        finally:
+            if healthy:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+    def _get_with_retries(self, path, params):
+        attempt = 0
+        while True:
+            try:
+                return self._get_once(path, params)
+            except NewsAPIError as e:
+                if not e.transient or attempt >= MAX_RETRIES or not self.retry_budget.withdraw():
+                    raise
+                attempt += 1
+                NEWSAPI_RETRIES.inc()
+                delay = random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+                logging.warning(f"Retrying NewsAPI {path} in {delay:.2f}s (attempt {attempt + 1}): {str(e)}")
+                time.sleep(delay)
+                try:
+                    self.quota.acquire()
+                except QuotaExceededError as quota_error:
+                    raise quota_error from e
+
+    def _get_once(self, path, params):
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            response = self.session.get(f'{self.base_url}/{path.lstrip("/")}',
+                                        params=dict(params, apiKey=self.api_key),
+                                        timeout=self.timeout)
+            outcome = str(response.status_code)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise NewsAPIError(f"NewsAPI request failed: {str(e)}") from e
+        finally:
+            NEWSAPI_REQUEST_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+
+        self.quota.update(response.headers, response.status_code)
+        if response.status_code < 400:
+            return response.json()
+
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        code = body.get('code')
+        message = body.get('message') or response.reason or f'HTTP {response.status_code}'
+        if response.status_code == 429:
+            NEWSAPI_REJECTED.inc(reason='rate_limited')
+            retry_at = _parse_retry_after(response.headers.get('Retry-After'))
+            raise QuotaExceededError(f"NewsAPI rate limited ({code or 429}): {message}", retry_at=retry_at)
+        raise NewsAPIError(f"NewsAPI error {response.status_code} ({code or 'unknown'}): {message}",
+                           code=code, status=response.status_code)
+
+
+# One client per upstream and key, so breaker, retry budget and quota state
+# are shared by every NewsService in the process
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url, api_key, pool_size=7, timeout=(3.05, 10)):
+    with _clients_lock:
+        key = (base_url.rstrip('/'), api_key)
+        if key not in _clients:
+            _clients[key] = NewsAPIClient(base_url, api_key, pool_size, timeout)
+        return _clients[key]
@@ -1,65 +1,183 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify
+from flask import render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, send_file, abort
+from email_validator import EmailNotValidError
 from app import app, db
-from models import Subscriber, NewsletterSent, ArtForm
+from models import Subscriber, ArtForm, NewsletterIssue
 from news_service import NewsService
-from email_service import EmailService
+from delivery import DIGEST_SUBJECT
+from email_service import RenderedDigest
+from mail_queue import create_run, run_progress
+from scheduler import submit_manual_send
+from dashboard import get_dashboard, invalidate_dashboard
+from metrics import render_prometheus
+from classifier import get_classifier
+import subscriber_io
+import image_cache
+import archive
+import delivery_slots
+import snapshots
+import tracking
 import logging
 
 news_service = NewsService()
-email_service = EmailService()
 
 @app.route('/')
 def index():
-    subscribers_count = Subscriber.query.filter_by(active=True).count()
-    recent_newsletters = NewsletterSent.query.order_by(NewsletterSent.sent_at.desc()).limit(5).all()
-    art_forms = ArtForm.query.filter_by(active=True).all()
-    
-    return render_template('index.html', 
-                         subscribers_count=subscribers_count,
-                         recent_newsletters=recent_newsletters,
-                         art_forms=art_forms)
+    return render_template('index.html', active_run=request.args.get('run', type=int),
+                           default_delivery_hour=delivery_slots.DEFAULT_DELIVERY_HOUR,
+                           default_timezone=delivery_slots.DEFAULT_TIMEZONE,
+                           common_timezones=delivery_slots.COMMON_TIMEZONES, **get_dashboard())
 
 @app.route('/subscribe', methods=['POST'])
 def subscribe():
     email = request.form.get('email')
     name = request.form.get('name', '')
     selected_art_forms = request.form.getlist('art_forms')
+    delivery_hour = request.form.get('delivery_hour', type=int)
+    timezone = request.form.get('timezone', '').strip() or None
     
     if not email:
         flash('Come on, gorgeous - we need your email to deliver the goods!', 'error')
         return redirect(url_for('index'))
+    try:
+        email = subscriber_io.normalize_email(email)
+    except EmailNotValidError as e:
+        flash(f'That email doesn\'t look right, darling: {e}', 'error')
+        return redirect(url_for('index'))
+    
+    if delivery_hour is not None and not 0 <= delivery_hour <= 23:
+        flash('Pick a delivery hour between 0 and 23, darling.', 'error')
+        return redirect(url_for('index'))
+    if timezone is not None and delivery_slots.get_zone(timezone) is None:
+        flash(f'We don\'t know the time zone "{timezone}". Try one like Europe/Madrid.', 'error')
+        return redirect(url_for('index'))
     
     # Check if subscriber already exists
     existing_subscriber = Subscriber.query.filter_by(email=email).first()
     if existing_subscriber:
         existing_subscriber.art_forms = selected_art_forms
+        existing_subscriber.delivery_hour = delivery_hour
+        existing_subscriber.timezone = timezone
         existing_subscriber.active = True
         flash('Look who\'s back for more! Your artistic cravings have been updated.', 'success')
     else:
-        subscriber = Subscriber(email=email, name=name, art_forms=selected_art_forms)
+        subscriber = Subscriber(email=email, name=name, art_forms=selected_art_forms,
+                                delivery_hour=delivery_hour, timezone=timezone)
         db.session.add(subscriber)
         flash('Welcome to the dark side, culture vulture! Your artistic addiction starts now.', 'success')
     
     db.session.commit()
+    invalidate_dashboard()
     return redirect(url_for('index'))
 
 @app.route('/unsubscribe/<email>')
 def unsubscribe(email):
-    subscriber = Subscriber.query.filter_by(email=email).first()
+    try:
+        subscriber = Subscriber.query.filter_by(email=subscriber_io.normalize_email(email)).first()
+    except EmailNotValidError:
+        subscriber = None
     if subscriber:
         subscriber.active = False
         db.session.commit()
+        invalidate_dashboard()
         flash('Unsubscribed successfully!', 'info')
     else:
         flash('Email not found!', 'error')
     
     return redirect(url_for('index'))
 
+# Digest links: the token is checked without a database read and the event
+# only buffered, so bursts after a big send stay cheap; see tracking.py
+_PIXEL = bytes.fromhex('47494638396101000100800000000000ffffff21f90401000000002c00000000010001000002024401003b')
+
+@app.route('/u/<token>', methods=['GET', 'POST'])
+def unsubscribe_token(token):
+    subscriber_id = tracking.read_token(token)
+    if request.method == 'POST' and request.form.get('List-Unsubscribe') == 'One-Click':
+        # One-click unsubscribe posted by the mail client (RFC 8058)
+        if subscriber_id is None:
+            return '', 400
+        tracking.event_log.record('unsubscribe', subscriber_id)
+        return '', 204
+    if subscriber_id is None:
+        flash('That unsubscribe link is not valid.', 'error')
+        return redirect(url_for('index'))
+    if request.method == 'GET':
+        # Link scanners and prefetchers follow GETs, so only the confirmation form unsubscribes
+        return render_template('unsubscribe_confirm.html', token=token)
+    tracking.event_log.record('unsubscribe', subscriber_id)
+    return render_template('unsubscribed.html')
+
+@app.route('/o/<token>/<int:issue_id>.gif')
+def track_open(token, issue_id):
+    subscriber_id = tracking.read_token(token)
+    if subscriber_id is not None:
+        tracking.event_log.record('open', subscriber_id, issue_id)
+    return Response(_PIXEL, mimetype='image/gif', headers={'Cache-Control': 'no-store, private'})
+
+@app.route('/c/<token>/<int:issue_id>/<int:link>')
+def track_click(token, issue_id, link):
+    links = tracking.issue_links(issue_id)
+    if links is None or link >= len(links) or not links[link]:
+        abort(404)
+    # A bad token still gets the reader to the article, just unrecorded
+    subscriber_id = tracking.read_token(token)
+    if subscriber_id is not None:
+        tracking.event_log.record('click', subscriber_id, issue_id, link)
+    return redirect(links[link])
+
+@app.route('/subscribers/import', methods=['POST'])
+def import_subscribers():
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    filename = upload.filename if upload else ''
+    fmt = request.args.get('format') or request.form.get('format') or (
+        'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson')) or 'ndjson' in (request.mimetype or '') else 'csv')
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    
+    if fmt not in ('csv', 'jsonl'):
+        if wants_json:
+            return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+        flash(f'Unsupported import format: {fmt}', 'error')
+        return redirect(url_for('settings'))
+    
+    try:
+        result = subscriber_io.import_subscribers(stream, fmt)
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error importing subscribers: {str(e)}")
+        if wants_json:
+            return jsonify({'error': str(e)}), 500
+        flash(f'Error importing subscribers: {str(e)}', 'error')
+        return redirect(url_for('settings'))
+    
+    invalidate_dashboard()
+    if wants_json:
+        return jsonify(result._asdict())
+    flash(f'Imported {result.imported} culture vultures from {result.rows} rows.', 'success')
+    if result.invalid:
+        flash(f'{result.invalid} rows were skipped for invalid data.', 'warning')
+    return redirect(url_for('settings'))
+
+@app.route('/subscribers/export')
+def export_subscribers():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+    active_only = request.args.get('all') is None
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(subscriber_io.export_subscribers(fmt, active_only)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=sevenarts-subscribers.{fmt}'}
+    )
+
 @app.route('/settings')
 def settings():
     subscribers = Subscriber.query.filter_by(active=True).all()
     art_forms = ArtForm.query.all()
-    return render_template('settings.html', subscribers=subscribers, art_forms=art_forms)
+    return render_template('settings.html', subscribers=subscribers, art_forms=art_forms,
+                           default_delivery_hour=delivery_slots.DEFAULT_DELIVERY_HOUR,
+                           default_timezone=delivery_slots.DEFAULT_TIMEZONE)
 
 @app.route('/add_art_form', methods=['POST'])
 def add_art_form():
@@ -75,6 +193,8 @@ def add_art_form():
     art_form = ArtForm(name=name, description=description, keywords=keywords)
     db.session.add(art_form)
     db.session.commit()
+    get_classifier().add(art_form.name, art_form.keywords)
+    invalidate_dashboard()
     flash('Art form added beautifully!', 'success')
     
     return redirect(url_for('settings'))
@@ -84,64 +204,57 @@ def delete_art_form(art_form_id):
     art_form = ArtForm.query.get_or_404(art_form_id)
     art_form.active = False
     db.session.commit()
+    get_classifier().remove(art_form.name)
+    invalidate_dashboard()
     flash('Art form removed from collection!', 'info')
     return redirect(url_for('settings'))
 
 @app.route('/send_newsletter', methods=['POST'])
 def send_newsletter():
+    # Plan and deliver in the background so neither the browser nor the worker waits on the send
     try:
-        # Get all active subscribers
-        subscribers = Subscriber.query.filter_by(active=True).all()
-        
-        if not subscribers:
-            flash('No active subscribers found!', 'warning')
-            return redirect(url_for('index'))
-        
-        # Get articles for newsletter
-        articles = news_service.get_curated_articles()
-        
-        if not articles:
-            flash('No articles found for newsletter!', 'error')
-            return redirect(url_for('index'))
-        
-        success_count = 0
-        for subscriber in subscribers:
-            try:
-                # Send email
-                subject = f"🔥 Your SevenArts Fix - Artistic Overload Incoming"
-                email_service.send_newsletter(subscriber.email, subject, articles, subscriber.name)
-                
-                # Record the sent newsletter
-                newsletter = NewsletterSent(
-                    subscriber_id=subscriber.id,
-                    articles=articles,
-                    subject=subject,
-                    status='sent'
-                )
-                db.session.add(newsletter)
-                success_count += 1
-                
-            except Exception as e:
-                logging.error(f"Failed to send newsletter to {subscriber.email}: {str(e)}")
-                newsletter = NewsletterSent(
-                    subscriber_id=subscriber.id,
-                    articles=articles,
-                    subject=subject,
-                    status='failed'
-                )
-                db.session.add(newsletter)
-        
-        db.session.commit()
-        flash(f'Artistic bombs dropped to {success_count} hungry culture vultures!', 'success')
-        
+        run = create_run(DIGEST_SUBJECT)
+        job_id = submit_manual_send(run.id)
     except Exception as e:
         logging.error(f"Error sending newsletter: {str(e)}")
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'error': str(e)}), 500
         flash(f'Error sending newsletter: {str(e)}', 'error')
+        return redirect(url_for('index'))
     
-    return redirect(url_for('index'))
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({
+            'run_id': run.id,
+            'job_id': job_id,
+            'progress_url': url_for('send_progress', run_id=run.id)
+        }), 202
+    
+    flash('Artistic bombs are on their way to our hungry culture vultures!', 'success')
+    return redirect(url_for('index', run=run.id))
+
+@app.route('/send_newsletter/<int:run_id>/progress')
+def send_progress(run_id):
+    progress = run_progress(run_id)
+    if progress is None:
+        return jsonify({'error': 'No such newsletter run'}), 404
+    return jsonify(progress)
 
 @app.route('/preview_newsletter')
 def preview_newsletter():
+    # A stored snapshot is exactly what will be sent, and needs no NewsAPI call
+    issues = snapshots.preview_issues()
+    issue_id = request.args.get('issue', type=int)
+    issue = NewsletterIssue.query.get_or_404(issue_id) if issue_id else (issues[0] if issues else None)
+    if issue is not None:
+        digest = RenderedDigest.from_issue(issue)
+        if digest is None:
+            # Sent before snapshots existed: only its articles were kept
+            return render_template('newsletter.html', articles=issue.articles or [])
+        # Not a real token, so the preview's links and pixel log nothing
+        html, _ = digest.personalise('reader@example.com', token='preview')
+        return render_template('newsletter.html', articles=issue.articles, snapshot=issue,
+                               snapshot_html=html, snapshots=issues)
+    
     try:
         articles = news_service.get_curated_articles()
         return render_template('newsletter.html', articles=articles)
@@ -157,3 +270,61 @@ def test_news():
         return jsonify({"success": True, "articles": articles})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
+
+def _archive_page():
+    return archive.search(
+        request.args.get('q', ''),
+        kind=request.args.get('kind'),
+        page=request.args.get('page', 1, type=int),
+        per_page=request.args.get('per_page', archive.ARCHIVE_PAGE_SIZE, type=int)
+    )
+
+def _archive_link(result):
+    if result['kind'] == 'issue':
+        return url_for('archive_issue', issue_id=result['ref_id'])
+    return result['url']
+
+@app.route('/archive')
+def archive_search():
+    results = _archive_page()
+    return render_template('archive.html', results=results, link_for=_archive_link)
+
+@app.route('/api/archive')
+def archive_api():
+    results = _archive_page()
+    return jsonify({
+        'query': results.query,
+        'kind': results.kind,
+        'page': results.page,
+        'per_page': results.per_page,
+        'total': results.total,
+        'took_ms': results.took_ms,
+        'results': [
+            dict(result, link=_archive_link(result), snippet=str(result['snippet']),
+                 published_at=result['published_at'].isoformat() if result['published_at'] else None)
+            for result in results.results
+        ]
+    })
+
+@app.route('/archive/issue/<int:issue_id>')
+def archive_issue(issue_id):
+    issue = NewsletterIssue.query.get_or_404(issue_id)
+    return render_template('newsletter.html', articles=issue.articles or [])
+
+@app.route('/img/<digest>/<int:width>')
+def cached_image(digest, width):
+    # Content-addressed, so a URL's bytes never change
+    if len(digest) != 64 or not all(c in '0123456789abcdef' for c in digest) or width not in image_cache.IMAGE_WIDTHS:
+        abort(404)
+    found = image_cache.cached_file(digest, width)
+    if found is None:
+        abort(404)
+    path, mimetype = found
+    response = send_file(path, mimetype=mimetype, max_age=image_cache.IMAGE_MAX_AGE, etag=digest, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
@@ -1,65 +1,354 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.triggers.date import DateTrigger
+from datetime import datetime, timedelta
 import logging
+import os
 import atexit
 from flask import current_app
+from delivery_slots import SLOT_MINUTES
 
-def send_scheduled_newsletter():
-    """Function to send scheduled cultural digest"""
+# 'local' runs every job in every process that starts the scheduler. 'distributed'
+# still schedules every job on every node, in memory, but takes a lease in the
+# database before each digest slot, ingestion pass and shard drain, so several
+# workers or hosts can run it safely
+DISTRIBUTED = os.environ.get('SCHEDULER_MODE', 'local').lower() == 'distributed'
+# Deliveries are split by subscriber_id % SHARD_COUNT; each node drains its own
+# SHARD_INDEX first, then any other shard nobody is draining
+SHARD_COUNT = max(1, int(os.environ.get('SHARD_COUNT', '1')))
+SHARD_INDEX = int(os.environ.get('SHARD_INDEX', '0')) % SHARD_COUNT
+DRAIN_LEASE_SECONDS = int(os.environ.get('DRAIN_LEASE_SECONDS', '300'))
+INGEST_INTERVAL_MINUTES = int(os.environ.get('INGEST_INTERVAL_MINUTES', '60'))
+BOUNCE_POLL_MINUTES = int(os.environ.get('BOUNCE_POLL_MINUTES', '15'))
+# Held while a node plans and queues a slot. If the node dies first, the lease
+# runs out and a later tick retries the slot
+SLOT_CLAIM_SECONDS = SLOT_MINUTES * 60 + 60
+# Held once a slot is queued, past the ticks that would retry it
+SLOT_DONE_SECONDS = SLOT_MINUTES * 60 * 4
+# Earlier slots each tick retries if their node died (distributed mode)
+SLOT_RETRY_SLOTS = 2
+
+# One scheduler per process; manual sends run on its executor alongside the periodic jobs.
+# Its jobs stay in memory even in distributed mode: APScheduler 3 can't share a job store
+# between schedulers, so nodes coordinate through leases instead
+scheduler = BackgroundScheduler()
+
+def _ensure_started():
+    if not scheduler.running:
+        scheduler.start()
+        # Shut down the scheduler when exiting the app
+        atexit.register(lambda: scheduler.running and scheduler.shutdown())
+
+def _claim(name, ttl_seconds):
+    """Whether this node should run the once-per-period job guarded by lease `name`; always True in local mode
+
+    In distributed mode the truthy result is the lease holder, for renewing it.
+    """
+    if not DISTRIBUTED:
+        return True
+    from leases import claim
+    return claim(name, ttl_seconds)
+
+def _drain(email_service, run_id=None):
+    """Drain the mail queue, one leased shard at a time in distributed mode"""
+    from app import db
+    from mail_queue import drain, DrainResult
+    
+    if not DISTRIBUTED:
+        return drain(email_service, run_id)
+    
+    from leases import acquire, release
+    total = DrainResult(0, 0, 0)
+    for offset in range(SHARD_COUNT):
+        index = (SHARD_INDEX + offset) % SHARD_COUNT
+        name = f'mail_queue_shard:{index}/{SHARD_COUNT}'
+        if not acquire(name, DRAIN_LEASE_SECONDS):
+            continue
+        try:
+            result = drain(email_service, run_id, shard=(index, SHARD_COUNT),
+                           heartbeat=lambda: acquire(name, DRAIN_LEASE_SECONDS))
+        finally:
+            db.session.rollback()
+            release(name)
+        total = DrainResult(*(a + b for a, b in zip(total, result)))
+    return total
+
+def _send_digest(run_id=None, where=None, edition=None, queued=None):
+    """Plan, queue and deliver one digest run; returns the drain result, or None if nothing was queued
+
+    With `run_id`, fills in a run made by mail_queue.create_run and drains only
+    that run; otherwise drains everything due, including leftovers from an
+    interrupted run. `where` limits the run to some subscribers (a delivery
+    slot); `edition` lets it reuse that day's issues. `queued` is called once
+    the deliveries are queued, before they are sent.
+    """
+    from app import db
+    from models import Subscriber, DigestRun
+    from news_service import NewsService
+    from email_service import EmailService
+    from delivery import DIGEST_SUBJECT
+    from mail_queue import enqueue_run, fail_run
+    from digests import group_by_preferences, plan_digests
+    
+    run = db.session.get(DigestRun, run_id) if run_id is not None else None
+    
+    # Stream active subscribers into an index of preference signature -> subscriber IDs
+    groups = group_by_preferences(Subscriber.iter_active(where=where))
+    
+    if not groups:
+        logging.info("No active culture vultures found")
+        if run is not None:
+            fail_run(run, 'No active subscribers found')
+        return None
+    
+    # Get articles for each distinct set of art form preferences
+    plans = plan_digests(NewsService(), groups, edition)
+    
+    if not plans:
+        logging.error("No cultural articles found for digest")
+        if run is not None:
+            fail_run(run, 'No articles found for newsletter')
+        return None
+    
+    run = enqueue_run(plans, DIGEST_SUBJECT, run, edition)
+    if queued is not None:
+        queued()
+    
+    email_service = EmailService()
+    try:
+        return _drain(email_service, run_id)
+    finally:
+        email_service.close()
+
+def _send_slot(start, retry=False):
+    """Send one delivery slot if this node claims it
+
+    A retry is for a slot whose node died before queueing it, or part way
+    through: it skips subscribers who already have a delivery in the edition.
+    """
+    from sqlalchemy import and_
+    from delivery_slots import due_filter
+    from mail_queue import not_queued_in
+    
+    name = f'digest_slot:{start.isoformat()}'
+    # Every node fires the cron; only the first to claim the slot sends it
+    holder = _claim(name, SLOT_CLAIM_SECONDS)
+    if not holder:
+        if not retry:
+            logging.info(f"The {start:%H:%M} UTC delivery slot has already been claimed")
+        return
+    
+    def done():
+        if DISTRIBUTED:
+            from leases import acquire
+            acquire(name, SLOT_DONE_SECONDS, holder=holder)
+    
+    where = due_filter(start)
+    if where is None:
+        logging.debug(f"Nobody is due in the {start:%H:%M} UTC delivery slot")
+        done()
+        return
+    if retry:
+        logging.warning(f"Retrying the {start:%H:%M} UTC delivery slot, which no node finished queueing")
+        where = and_(where, not_queued_in(start.date()))
+    
+    logging.info(f"Starting cultural digest send for the {start:%H:%M} UTC delivery slot...")
+    # Every slot on the same UTC day shares one edition of each issue
+    result = _send_digest(where=where, edition=start.date(), queued=done)
+    done()
+    
+    if result is not None:
+        logging.info(f"Cultural digest for the {start:%H:%M} UTC slot sent to {result.sent} art lovers "
+                     f"({result.failed} failed, {result.retrying} to retry)")
+
+def send_scheduled_newsletter(start=None):
+    """Send the cultural digest to subscribers whose delivery time falls in this slot"""
     try:
-        from app import app, db
-        from models import Subscriber
+        from app import app
+        from delivery_slots import slot_start
+        
+        with app.app_context():
+            start = start or slot_start()
+            if DISTRIBUTED:
+                from leases import prune_expired
+                prune_expired()
+                # A slot whose lease ran out without being marked done lost its node
+                for back in range(SLOT_RETRY_SLOTS, 0, -1):
+                    _send_slot(start - timedelta(minutes=SLOT_MINUTES * back), retry=True)
+            _send_slot(start)
+            
+    except Exception as e:
+        logging.error(f"Error in scheduled cultural digest send: {str(e)}")
+
+def prebuild_digests():
+    """Snapshot the issues the coming delivery slots will send, ahead of time"""
+    try:
+        from app import app
         from news_service import NewsService
-        from email_service import EmailService
+        from delivery_slots import slot_start
+        from snapshots import prebuild
         
         with app.app_context():
-            logging.info("Starting scheduled cultural digest send...")
+            if not _claim(f'digest_prebuild:{slot_start().isoformat()}', SLOT_MINUTES * 60):
+                return
+            prebuild(NewsService())
             
-            news_service = NewsService()
-            email_service = EmailService()
+    except Exception as e:
+        logging.error(f"Error pre-building digest snapshots: {str(e)}")
+
+def send_manual_newsletter(run_id):
+    """Background half of POST /send_newsletter"""
+    try:
+        from app import app
+        
+        with app.app_context():
+            logging.info(f"Starting manual cultural digest send for run {run_id}...")
+            result = _send_digest(run_id)
             
-            # Get all active subscribers
-            subscribers = Subscriber.query.filter_by(active=True).all()
+            if result is not None:
+                logging.info(f"Manual cultural digest run {run_id} sent to {result.sent} art lovers "
+                             f"({result.failed} failed, {result.retrying} to retry)")
             
-            if not subscribers:
-                logging.info("No active culture vultures found")
-                return
+    except Exception as e:
+        logging.error(f"Error in manual cultural digest send for run {run_id}: {str(e)}")
+        try:
+            from app import app, db
+            from models import DigestRun
+            from mail_queue import fail_run
+            with app.app_context():
+                db.session.rollback()
+                run = db.session.get(DigestRun, run_id)
+                if run is not None and run.status == 'planning':
+                    fail_run(run, str(e))
+        except Exception:
+            logging.exception(f"Could not mark run {run_id} as failed")
+
+def submit_manual_send(run_id):
+    """Queue a manual send on the scheduler's executor; returns the job ID"""
+    _ensure_started()
+    job = scheduler.add_job(
+        func=send_manual_newsletter,
+        trigger=DateTrigger(),
+        args=[run_id],
+        id=f'manual_send_{run_id}',
+        name=f'Manual cultural digest run {run_id}',
+        misfire_grace_time=None
+    )
+    return job.id
+
+def drain_mail_queue():
+    """Resume interrupted runs and retry deliveries whose backoff has elapsed"""
+    try:
+        from app import app
+        from email_service import EmailService
+        
+        with app.app_context():
+            email_service = EmailService()
+            try:
+                result = _drain(email_service)
+            finally:
+                email_service.close()
             
-            # Get articles for cultural digest
-            articles = news_service.get_curated_articles()
+            if any(result):
+                logging.info(f"Mail queue drained: {result.sent} sent, {result.failed} failed, "
+                             f"{result.retrying} to retry")
             
-            if not articles:
-                logging.error("No cultural articles found for digest")
+    except Exception as e:
+        logging.error(f"Error draining mail queue: {str(e)}")
+
+def ingest_articles():
+    """Pull new articles for every active art form into the local store"""
+    try:
+        from app import app
+        from news_service import NewsService
+        from article_store import ingest_all
+        
+        with app.app_context():
+            # Held for most of an interval and never released, so one node ingests per interval
+            if not _claim('article_ingestion', INGEST_INTERVAL_MINUTES * 60 * 0.9):
                 return
+            ingest_all(NewsService())
             
-            success_count = 0
-            for subscriber in subscribers:
-                try:
-                    subject = f"🔥 Your SevenArts Fix - Artistic Overload Incoming"
-                    email_service.send_newsletter(subscriber.email, subject, articles, subscriber.name)
-                    success_count += 1
-                    
-                except Exception as e:
-                    logging.error(f"Failed to send cultural digest to {subscriber.email}: {str(e)}")
-            
-            logging.info(f"Scheduled cultural digest sent to {success_count} art lovers")
+    except Exception as e:
+        logging.error(f"Error ingesting articles: {str(e)}")
+
+def process_bounces():
+    """Apply the bounces waiting in the local bounce mailbox"""
+    try:
+        from app import app
+        from bounces import BOUNCE_MAILBOX, process_mailbox
+        
+        with app.app_context():
+            # The mailbox is shared, so one node reads it per interval
+            if not _claim('bounce_mailbox', BOUNCE_POLL_MINUTES * 60 * 0.9):
+                return
+            process_mailbox(BOUNCE_MAILBOX)
             
     except Exception as e:
-        logging.error(f"Error in scheduled cultural digest send: {str(e)}")
+        logging.error(f"Error processing bounce mailbox: {str(e)}")
 
 def start_scheduler():
     """Start the background scheduler"""
-    scheduler = BackgroundScheduler()
-    
-    # Schedule cultural digest to be sent daily at 8:00 AM
+    # Each slot sends to the subscribers whose chosen local delivery time falls in it,
+    # spreading the day's digest over many small sends instead of one 8:00 burst
     scheduler.add_job(
         func=send_scheduled_newsletter,
-        trigger=CronTrigger(hour=8, minute=0),  # 8:00 AM daily
-        id='daily_cultural_digest',
-        name='Send daily cultural digest',
-        replace_existing=True
+        trigger=CronTrigger(minute=f'*/{SLOT_MINUTES}'),
+        id='cultural_digest_slots',
+        name='Send the cultural digest for each delivery slot',
+        replace_existing=True,
+        coalesce=True,
+        # A late start still belongs to its slot; much later, the next slot has begun
+        misfire_grace_time=SLOT_MINUTES * 60 // 2
     )
     
+    # Build each slot's issues an hour ahead, so sends only load finished snapshots
+    scheduler.add_job(
+        func=prebuild_digests,
+        trigger=CronTrigger(minute=f'*/{SLOT_MINUTES}'),
+        id='digest_prebuild',
+        name='Pre-build upcoming digest snapshots',
+        replace_existing=True,
+        coalesce=True,
+        misfire_grace_time=SLOT_MINUTES * 60 // 2,
+        next_run_time=datetime.now()
+    )
+    
+    # Pick up unfinished runs on startup, then keep retrying failed deliveries on every node
+    scheduler.add_job(
+        func=drain_mail_queue,
+        trigger=IntervalTrigger(seconds=int(os.environ.get('MAIL_QUEUE_POLL_SECONDS', '60'))),
+        id='mail_queue_drain',
+        name='Drain pending newsletter deliveries',
+        replace_existing=True,
+        coalesce=True,
+        next_run_time=datetime.now()
+    )
+    
+    # Keep the article store fresh so digests never wait on NewsAPI
+    scheduler.add_job(
+        func=ingest_articles,
+        trigger=IntervalTrigger(minutes=INGEST_INTERVAL_MINUTES),
+        id='article_ingestion',
+        name='Ingest new cultural articles',
+        replace_existing=True,
+        coalesce=True,
+        next_run_time=datetime.now()
+    )
+    
+    # Read DSNs from the bounce mailbox, when there is one
+    if os.environ.get('BOUNCE_MAILBOX'):
+        scheduler.add_job(
+            func=process_bounces,
+            trigger=IntervalTrigger(minutes=BOUNCE_POLL_MINUTES),
+            id='bounce_processing',
+            name='Process bounce messages',
+            replace_existing=True,
+            coalesce=True,
+            next_run_time=datetime.now()
+        )
+    
     # For testing, you can also add a job that runs every minute
     # scheduler.add_job(
     #     func=send_scheduled_newsletter,
@@ -69,8 +358,5 @@ def start_scheduler():
     #     replace_existing=True
     # )
     
-    scheduler.start()
+    _ensure_started()
     logging.info("SevenArts cultural digest scheduler started")
-    
-    # Shut down the scheduler when exiting the app
-    atexit.register(lambda: scheduler.shutdown())
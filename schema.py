@@ -0,0 +1,243 @@
+"""
+Idempotent, versioned schema bootstrap.
+
+Replaces the old drop-and-recreate on every boot. When the recorded schema
+version matches SCHEMA_VERSION, startup costs a single SELECT. Otherwise one
+process (serialised by an advisory lock on PostgreSQL) creates missing
+tables, adds missing columns and indexes, carries over data from the pre-
+SevenArts `topic` schema the way migrate_to_sevenarts.py did, seeds the
+default art forms if there are none, indexes existing articles and issues
+when the search archive is first created, and records the new version.
+"""
+
+import os
+import time
+import json
+import logging
+from datetime import datetime
+from sqlalchemy import inspect, select, update, delete, text, func
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+from models import SchemaVersion
+
+# Bump whenever models.py gains a table, column or index
+SCHEMA_VERSION = 14
+
+# Arbitrary key for pg_advisory_xact_lock so only one worker migrates at a time
+MIGRATION_LOCK_KEY = 7_041_977
+
+DEFAULT_ART_FORMS = [
+    {
+        'name': 'Architecture',
+        'keywords': ['architecture', 'building design', 'urban planning', 'architectural'],
+        'description': 'The art of designing and constructing buildings'
+    },
+    {
+        'name': 'Sculpture',
+        'keywords': ['sculpture', 'sculptural', 'installation art', 'public art'],
+        'description': 'Three-dimensional art forms and installations'
+    },
+    {
+        'name': 'Painting',
+        'keywords': ['painting', 'visual art', 'contemporary art', 'fine art'],
+        'description': 'Visual art created with pigments and brushes'
+    },
+    {
+        'name': 'Music',
+        'keywords': ['music', 'classical music', 'contemporary music', 'composer'],
+        'description': 'The art of organized sound and rhythm'
+    },
+    {
+        'name': 'Poetry',
+        'keywords': ['poetry', 'literature', 'poet', 'literary'],
+        'description': 'Literary art using language and verse'
+    },
+    {
+        'name': 'Dance',
+        'keywords': ['dance', 'ballet', 'contemporary dance', 'choreography'],
+        'description': 'Movement and choreography as artistic expression'
+    },
+    {
+        'name': 'Theater',
+        'keywords': ['theater', 'theatre', 'drama', 'performance art'],
+        'description': 'Live performance and dramatic arts'
+    }
+]
+
+
+def current_version():
+    """Highest applied schema version, or None on a database that has never been bootstrapped"""
+    try:
+        return db.session.query(func.max(SchemaVersion.version)).scalar()
+    except SQLAlchemyError:
+        db.session.rollback()
+        return None
+
+
+def _add_missing_columns(conn, inspector):
+    """ALTER existing tables to add columns the models have gained (always nullable)"""
+    preparer = conn.dialect.identifier_preparer
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                conn.execute(text(
+                    f"ALTER TABLE {preparer.format_table(table)} "
+                    f"ADD COLUMN {preparer.format_column(column)} {column.type.compile(dialect=conn.dialect)}"
+                ))
+                logging.info(f"Added column {table.name}.{column.name}")
+
+
+def _upgrade_json_columns(conn, inspector):
+    """Convert json columns the models now declare as JSONB (PostgreSQL only)"""
+    if conn.dialect.name != 'postgresql':
+        return
+    preparer = conn.dialect.identifier_preparer
+    for table in db.metadata.sorted_tables:
+        existing = {column['name']: column['type'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            wanted = column.type.compile(dialect=conn.dialect)
+            current = existing.get(column.name)
+            if wanted == 'JSONB' and current is not None and current.compile(dialect=conn.dialect) == 'JSON':
+                name = preparer.format_column(column)
+                conn.execute(text(
+                    f"ALTER TABLE {preparer.format_table(table)} "
+                    f"ALTER COLUMN {name} TYPE JSONB USING {name}::jsonb"
+                ))
+                logging.info(f"Converted {table.name}.{column.name} to JSONB")
+
+
+def _add_missing_indexes(conn, inspector):
+    """Create indexes declared on models that the database doesn't have yet"""
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            # Skip dialect-specific indexes, like GIN, on other databases
+            ddl_if = getattr(index, '_ddl_if', None)
+            if ddl_if is not None and ddl_if.dialect not in (None, conn.dialect.name):
+                continue
+            if index.name not in existing:
+                index.create(conn)
+                logging.info(f"Created index {index.name}")
+
+
+def _migrate_legacy_topics(conn, inspector):
+    """Carry topics and subscriber.topics over from the pre-SevenArts schema"""
+    tables = inspector.get_table_names()
+
+    if 'topic' in tables:
+        for name, keywords, active in conn.execute(text("SELECT name, keywords, active FROM topic")):
+            exists = conn.execute(text("SELECT 1 FROM art_form WHERE name = :name"), {'name': name}).first()
+            if not exists:
+                conn.execute(text(
+                    "INSERT INTO art_form (name, keywords, active, description) "
+                    "VALUES (:name, :keywords, :active, :description)"
+                ), {'name': name, 'keywords': keywords or '[]', 'active': active,
+                    'description': f"Migrated from {name}"})
+        logging.info("Migrated legacy topics to art forms")
+
+    subscriber_columns = {column['name'] for column in inspector.get_columns('subscriber')}
+    if 'topics' in subscriber_columns:
+        conn.execute(text("UPDATE subscriber SET art_forms = topics WHERE art_forms IS NULL"))
+
+
+def _lowercase_emails(conn):
+    """Lowercase stored addresses, as subscriber_io normalises new ones, merging the duplicates this makes
+
+    Of the rows sharing an address the newest, from the latest subscribe or
+    import, is kept; the others' deliveries and events are moved onto it.
+    """
+    from models import DeliveryEvent, NewsletterSent, Subscriber
+    subscriber = Subscriber.__table__
+    address = func.lower(subscriber.c.email)
+    rows = conn.execute(select(subscriber.c.id, address).where(
+        address.in_(select(address).where(subscriber.c.email != address))
+    ).order_by(subscriber.c.id)).all()
+
+    ids_by_address = {}
+    for subscriber_id, email in rows:
+        ids_by_address.setdefault(email, []).append(subscriber_id)
+    merged = 0
+    for email, ids in ids_by_address.items():
+        keep, duplicates = ids[-1], ids[:-1]
+        if duplicates:
+            for table in (NewsletterSent.__table__, DeliveryEvent.__table__):
+                conn.execute(update(table).where(table.c.subscriber_id.in_(duplicates)).values(subscriber_id=keep))
+            conn.execute(delete(subscriber).where(subscriber.c.id.in_(duplicates)))
+            merged += len(duplicates)
+        conn.execute(update(subscriber).where(subscriber.c.id == keep).values(email=email))
+    if ids_by_address:
+        logging.info(f"Lowercased {len(ids_by_address)} subscriber addresses, merging {merged} duplicates")
+
+
+def _seed_default_art_forms(conn):
+    """Insert the seven classical art forms into an empty art_form table"""
+    if conn.execute(text("SELECT COUNT(*) FROM art_form")).scalar():
+        return
+    for art_form in DEFAULT_ART_FORMS:
+        conn.execute(text(
+            "INSERT INTO art_form (name, keywords, active, description) "
+            "VALUES (:name, :keywords, :active, :description)"
+        ), {'name': art_form['name'], 'keywords': json.dumps(art_form['keywords']),
+            'active': True, 'description': art_form['description']})
+    logging.info("Added default seven art forms to database")
+
+
+def _migrate(conn):
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': MIGRATION_LOCK_KEY})
+
+    # Another worker may have finished while we waited for the lock
+    version = None
+    if inspect(conn).has_table(SchemaVersion.__tablename__):
+        version = conn.execute(select(func.max(SchemaVersion.version))).scalar()
+    if version == SCHEMA_VERSION:
+        return False
+
+    tables = set(inspect(conn).get_table_names())
+    db.metadata.create_all(conn)
+    inspector = inspect(conn)
+    _add_missing_columns(conn, inspector)
+    _upgrade_json_columns(conn, inspector)
+    _add_missing_indexes(conn, inspector)
+    _migrate_legacy_topics(conn, inspector)
+    _lowercase_emails(conn)
+    _seed_default_art_forms(conn)
+    if 'archive_document' not in tables:
+        # First boot with the archive: index everything sent and ingested so far
+        from archive import backfill
+        backfill(conn)
+
+    conn.execute(SchemaVersion.__table__.insert().values(version=SCHEMA_VERSION, applied_at=datetime.utcnow()))
+    return True
+
+
+def bootstrap_schema():
+    """Bring the database up to SCHEMA_VERSION; a cheap no-op when it already is"""
+    started = time.perf_counter()
+    version = current_version()
+
+    if version == SCHEMA_VERSION:
+        logging.debug(f"Schema is current (v{version})")
+    elif version is not None and version > SCHEMA_VERSION:
+        logging.warning(f"Database schema v{version} is newer than this code (v{SCHEMA_VERSION})")
+    else:
+        try:
+            with db.engine.begin() as conn:
+                migrated = _migrate(conn)
+        except SQLAlchemyError:
+            # Without an advisory lock (SQLite) two workers can race on DDL;
+            # losing is fine as long as the winner got us to the current version
+            if current_version() != SCHEMA_VERSION:
+                raise
+            migrated = False
+        if migrated:
+            logging.info(f"Migrated database schema from v{version or 0} to v{SCHEMA_VERSION}")
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    budget_ms = float(os.environ.get('SCHEMA_BOOTSTRAP_BUDGET_MS', '250'))
+    if elapsed_ms > budget_ms:
+        logging.warning(f"Schema bootstrap took {elapsed_ms:.0f}ms (budget {budget_ms:.0f}ms)")
+    else:
+        logging.info(f"Schema bootstrap took {elapsed_ms:.1f}ms")
+    return elapsed_ms
@@ -0,0 +1,133 @@
+import smtplib
+import queue
+import threading
+import logging
+import time
+from metrics import SMTP_SECONDS, SMTP_MESSAGES, SMTP_RECONNECTS
+
+# SMTP reply codes that mean the server is dropping the session
+RECONNECT_CODES = {421}
+
+
+class PooledConnection:
+    """An authenticated SMTP session plus the number of messages it has carried"""
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.messages_sent = 0
+
+    def close(self):
+        """Politely end the session, ignoring a server that already hung up"""
+        try:
+            self.smtp.quit()
+        except Exception:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+
+
+class SMTPConnectionPool:
+    """Keep up to `size` authenticated SMTP connections alive and reuse them across messages"""
+
+    def __init__(self, host, port, username, password, size=4, max_messages_per_connection=100, timeout=30,
+                 use_tls=True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.max_messages_per_connection = max_messages_per_connection
+        self.timeout = timeout
+        self.use_tls = use_tls
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+    def _connect(self):
+        """Open a new session and run STARTTLS and AUTH once"""
+        with SMTP_SECONDS.time(stage='connect'):
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                with SMTP_SECONDS.time(stage='starttls'):
+                    server.starttls()
+            if self.username:
+                with SMTP_SECONDS.time(stage='auth'):
+                    server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        logging.debug(f"Opened SMTP connection to {self.host}:{self.port}")
+        return PooledConnection(server)
+
+    def _checkout(self):
+        """Take an idle connection, or open one if none is waiting"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _checkin(self, conn):
+        """Return a connection to the pool, recycling it once it has carried enough messages"""
+        if self._closed or conn.messages_sent >= self.max_messages_per_connection:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    def _needs_reconnect(self, error):
+        """Whether an error means the session is gone rather than the message being rejected"""
+        if isinstance(error, smtplib.SMTPServerDisconnected):
+            return True
+        if isinstance(error, smtplib.SMTPResponseException):
+            return error.smtp_code in RECONNECT_CODES
+        # SMTPException subclasses OSError, so only bare socket errors mean a lost session
+        return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+    def send_message(self, msg):
+        """Send a message over a pooled connection, reconnecting once if the session was dropped"""
+        if self._closed:
+            raise RuntimeError("SMTP connection pool is closed")
+
+        with self._slots:
+            for attempt in range(2):
+                conn = self._checkout()
+                started = time.perf_counter()
+                try:
+                    conn.smtp.send_message(msg)
+                except Exception as e:
+                    if self._needs_reconnect(e):
+                        conn.close()
+                        if attempt == 0:
+                            SMTP_RECONNECTS.inc()
+                            logging.warning(f"SMTP session to {self.host} dropped ({e}), reconnecting")
+                            continue
+                        SMTP_MESSAGES.inc(outcome='error')
+                        raise
+                    
+                    SMTP_MESSAGES.inc(outcome='rejected')
+
+                    # The message was refused but the session is still usable
+                    try:
+                        conn.smtp.rset()
+                        self._checkin(conn)
+                    except Exception:
+                        conn.close()
+                    raise
+
+                SMTP_SECONDS.observe(time.perf_counter() - started, stage='send')
+                SMTP_MESSAGES.inc(outcome='sent')
+                conn.messages_sent += 1
+                self._checkin(conn)
+                return
+
+    def close(self):
+        """Close every idle connection; busy ones are closed when they are returned"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
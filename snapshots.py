@@ -0,0 +1,103 @@
+"""
+Pre-built digest snapshots.
+
+Every NewsletterIssue is stored as an immutable snapshot: its articles plus
+the HTML and text bodies rendered with recipient placeholders. Issues are
+built PREBUILD_LEAD_MINUTES ahead of the delivery slots that will send them,
+so a slot's send only loads finished snapshots: it starts at once and
+doesn't depend on NewsAPI being up at that moment. The preview shows the
+stored snapshot, exactly as it will go out.
+"""
+
+import os
+import logging
+from datetime import datetime, timedelta
+from app import db
+from models import NewsletterIssue, Subscriber
+from archive import index_issues
+from article_store import mark_sent
+from delivery import DIGEST_SUBJECT
+from delivery_slots import SLOT_MINUTES, slot_start, due_filter
+from digests import group_by_preferences, plan_digests, signature_key
+
+PREBUILD_LEAD_MINUTES = int(os.environ.get('PREBUILD_LEAD_MINUTES', '60'))
+
+
+def render_snapshot(issue, email_service):
+    """Render an issue's bodies onto it, once; a rendered snapshot is never changed
+
+    The issue must have its ID already, since the tracked links carry it.
+    """
+    if issue.rendered_at is not None:
+        return
+    for field, body in email_service.render_bodies(issue.articles, issue.id).items():
+        setattr(issue, field, body)
+    issue.rendered_at = datetime.utcnow()
+
+
+def create_issues(plans, subject, edition=None, run_id=None, email_service=None):
+    """Snapshot an issue for every plan that doesn't reuse one; returns (issue, subscriber_ids) per plan
+
+    The new issues are indexed for the archive and their articles held back
+    from later issues. Commits.
+    """
+    from email_service import EmailService
+    email_service = email_service or EmailService()
+
+    issues = []
+    new_issues = []
+    for plan in plans:
+        if plan.issue_id is not None:
+            issues.append((db.session.get(NewsletterIssue, plan.issue_id), plan.subscriber_ids))
+            continue
+        issue = NewsletterIssue(run_id=run_id, subject=subject, articles=plan.articles,
+                                edition=edition, signature=signature_key(plan.signature))
+        db.session.add(issue)
+        issues.append((issue, plan.subscriber_ids))
+        new_issues.append(issue)
+    db.session.flush()
+    for issue in new_issues:
+        render_snapshot(issue, email_service)
+    index_issues(new_issues)
+    db.session.commit()
+
+    # Hold these articles back from the next issues
+    mark_sent({article['url'] for issue in new_issues for article in issue.articles})
+    return issues
+
+
+def upcoming_slots(now=None, lead_minutes=PREBUILD_LEAD_MINUTES):
+    """Start times of the delivery slots beginning within `lead_minutes` of `now`"""
+    start = slot_start(now)
+    return [start + timedelta(minutes=SLOT_MINUTES * step)
+            for step in range(1, lead_minutes // SLOT_MINUTES + 1)]
+
+
+def prebuild(news_service, now=None):
+    """Snapshot the issues the next hour's delivery slots will send; returns how many were built
+
+    Runs every slot, so each upcoming slot gets several chances should
+    NewsAPI be down; issues already built for an edition are left alone.
+    """
+    signatures_by_edition = {}
+    for start in upcoming_slots(now):
+        where = due_filter(start)
+        if where is not None:
+            signatures_by_edition.setdefault(start.date(), set()).update(
+                group_by_preferences(Subscriber.iter_active(where=where)))
+
+    built = 0
+    for edition, signatures in signatures_by_edition.items():
+        plans = plan_digests(news_service, {signature: [] for signature in signatures}, edition)
+        new_plans = [plan for plan in plans if plan.issue_id is None]
+        if new_plans:
+            create_issues(new_plans, DIGEST_SUBJECT, edition)
+            built += len(new_plans)
+            logging.info(f"Pre-built {len(new_plans)} digest snapshots for the {edition} edition")
+    return built
+
+
+def preview_issues(limit=20):
+    """Snapshots a preview can show: the newest editions' issues first"""
+    return NewsletterIssue.query.filter(NewsletterIssue.rendered_at.isnot(None)).order_by(
+        NewsletterIssue.edition.desc().nulls_last(), NewsletterIssue.id.desc()).limit(limit).all()
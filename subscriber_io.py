@@ -0,0 +1,279 @@
+"""
+Streaming subscriber import and export.
+
+Imports read CSV or JSON Lines incrementally, validate and normalise each
+address with email-validator (syntax only, no DNS, each distinct domain
+checked once), and upsert in large batches: COPY into a temp table and one
+INSERT .. SELECT .. ON CONFLICT on PostgreSQL, an executemany of
+INSERT .. ON CONFLICT (email) DO UPDATE on SQLite.
+Exports page through the table by primary key and yield one chunk per
+page, so neither direction holds the whole list in memory.
+"""
+
+import io
+import os
+import csv
+import json
+import logging
+from collections import namedtuple
+from sqlalchemy import insert, update, func
+from email_validator import validate_email, EmailNotValidError
+from app import db
+from models import Subscriber
+from metrics import DB_COMMIT_SECONDS
+from bulk import is_postgresql, copy_upsert_subscribers
+
+IMPORT_BATCH_SIZE = int(os.environ.get('SUBSCRIBER_IMPORT_BATCH_SIZE', '5000'))
+EXPORT_PAGE_SIZE = int(os.environ.get('SUBSCRIBER_EXPORT_PAGE_SIZE', '1000'))
+# How many rejected rows to report back in detail
+MAX_REPORTED_ERRORS = 20
+
+EXPORT_FIELDS = ('email', 'name', 'art_forms', 'active', 'created_at')
+
+ImportResult = namedtuple('ImportResult', 'rows imported invalid errors')
+
+
+class EmailBatchValidator:
+    """Validate many addresses, paying for each domain's IDNA checks only once
+
+    Most of email-validator's cost is in the domain. Each new domain is
+    validated with a placeholder local part and cached; each local part is
+    then validated against a domain literal, which is cheap, and the two
+    normalised halves are joined. The result is lowercased: nobody relies on
+    a case-sensitive local part, and one address typed two ways must not
+    become two subscribers.
+    """
+
+    # RFC 5321 limit on a whole address
+    MAX_LENGTH = 254
+
+    def __init__(self):
+        self._domains = {}
+
+    def _domain(self, domain):
+        key = domain.lower()
+        if key not in self._domains:
+            try:
+                self._domains[key] = validate_email(f'postmaster@{domain}', check_deliverability=False).domain
+            except EmailNotValidError as e:
+                self._domains[key] = e
+        result = self._domains[key]
+        if isinstance(result, EmailNotValidError):
+            raise result
+        return result
+
+    def normalize(self, email):
+        """Normalised address, or EmailNotValidError"""
+        local, at, domain = email.rpartition('@')
+        if not at or domain.startswith('['):
+            # No @-sign or a domain literal: let email-validator explain
+            return validate_email(email, check_deliverability=False).normalized.lower()
+        domain = self._domain(domain)
+        local = validate_email(f'{local}@[192.0.2.1]', allow_domain_literal=True,
+                               check_deliverability=False).local_part
+        normalized = f'{local}@{domain}'
+        if len(normalized) > self.MAX_LENGTH:
+            raise EmailNotValidError(f'The email address is too long ({len(normalized) - self.MAX_LENGTH} characters too many).')
+        return normalized.lower()
+
+
+def normalize_email(email):
+    """One address normalised as imports do it, or EmailNotValidError"""
+    return EmailBatchValidator().normalize((email or '').strip())
+
+
+def _truthy(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() not in ('0', 'false', 'no', 'n', 'off', '')
+
+
+def _parse_art_forms(value):
+    """A JSON list, or a ';' or '|' separated string as in CSV exports; None when absent"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, list):
+        return [str(item).strip() for item in value if str(item).strip()]
+    separator = '|' if '|' in value else ';'
+    return [item.strip() for item in value.split(separator) if item.strip()]
+
+
+def _read_csv(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        # Header is line 1
+        for line_number, row in enumerate(csv.DictReader(text), start=2):
+            yield line_number, {(key or '').strip().lower(): value for key, value in row.items()}
+    finally:
+        # Leave the caller's stream open
+        text.detach()
+
+
+def _read_jsonl(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    try:
+        for line_number, line in enumerate(text, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, ValueError(f'Invalid JSON: {str(e)}')
+                continue
+            if not isinstance(record, dict):
+                yield line_number, ValueError('Expected a JSON object')
+                continue
+            yield line_number, {str(key).lower(): value for key, value in record.items()}
+    finally:
+        text.detach()
+
+
+def _upsert_statement(update_art_forms):
+    """Dialect-native INSERT .. ON CONFLICT (email) DO UPDATE, or None where unsupported"""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+
+    table = Subscriber.__table__
+    statement = dialect_insert(table)
+    # Keep a stored name when the import leaves it blank
+    values = {'name': func.coalesce(statement.excluded.name, table.c.name), 'active': statement.excluded.active}
+    if update_art_forms:
+        values['art_forms'] = statement.excluded.art_forms
+    return statement.on_conflict_do_update(index_elements=[table.c.email], set_=values)
+
+
+def _upsert_portable(rows, update_art_forms):
+    """Set-based upsert for dialects without ON CONFLICT: one lookup, one bulk insert, one bulk update"""
+    existing = dict(db.session.query(Subscriber.email, Subscriber.id).filter(
+        Subscriber.email.in_([row['email'] for row in rows])))
+    new_rows = [row for row in rows if row['email'] not in existing]
+    if new_rows:
+        db.session.execute(insert(Subscriber), new_rows)
+    updates = []
+    for row in rows:
+        if row['email'] in existing:
+            values = {'id': existing[row['email']], 'active': row['active']}
+            if row['name'] is not None:
+                values['name'] = row['name']
+            if update_art_forms:
+                values['art_forms'] = row['art_forms']
+            updates.append(values)
+    if updates:
+        db.session.execute(update(Subscriber), updates)
+
+
+def _flush(batch):
+    """Upsert one batch, keyed by normalised email; returns how many rows it wrote"""
+    if not batch:
+        return 0
+    rows = list(batch.values())
+    batch.clear()
+    # Rows without art forms keep whatever the subscriber already picked
+    for update_art_forms in (True, False):
+        group = [dict(row, art_forms=row['art_forms'] or []) for row in rows
+                 if (row['art_forms'] is not None) == update_art_forms]
+        if not group:
+            continue
+        if is_postgresql():
+            copy_upsert_subscribers(group, update_art_forms)
+            continue
+        statement = _upsert_statement(update_art_forms)
+        if statement is None:
+            _upsert_portable(group, update_art_forms)
+        else:
+            # executemany: compiled once per statement shape and cached, whatever the batch size
+            db.session.execute(statement, group)
+    with DB_COMMIT_SECONDS.time(operation='import_subscribers'):
+        db.session.commit()
+    return len(rows)
+
+
+def import_subscribers(stream, fmt):
+    """Upsert subscribers from a binary CSV or JSONL stream; returns an ImportResult
+
+    CSV needs an `email` column and may have `name`, `art_forms` (separated
+    by ';' or '|') and `active`; JSONL objects use the same keys, with
+    `art_forms` as a list. Later rows for the same address win.
+    """
+    records = _read_csv(stream) if fmt == 'csv' else _read_jsonl(stream)
+    validator = EmailBatchValidator()
+    batch = {}
+    rows = imported = invalid = 0
+    errors = []
+
+    for line_number, record in records:
+        rows += 1
+        try:
+            if isinstance(record, Exception):
+                raise record
+            email = validator.normalize((record.get('email') or '').strip())
+            name = (record.get('name') or '').strip()[:100] or None
+            batch[email] = {
+                'email': email,
+                'name': name,
+                'art_forms': _parse_art_forms(record.get('art_forms')),
+                'active': _truthy(record['active']) if record.get('active') not in (None, '') else True,
+            }
+        except (EmailNotValidError, ValueError) as e:
+            invalid += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'line': line_number, 'email': record.get('email') if isinstance(record, dict) else None,
+                               'error': str(e)})
+            continue
+
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            imported += _flush(batch)
+
+    imported += _flush(batch)
+    logging.info(f"Imported {imported} subscribers from {rows} {fmt} rows ({invalid} invalid)")
+    return ImportResult(rows, imported, invalid, errors)
+
+
+def _iter_subscribers(active_only):
+    """Every subscriber row, one keyset page at a time"""
+    columns = [getattr(Subscriber, field) for field in EXPORT_FIELDS]
+    last_id = 0
+    while True:
+        query = db.session.query(Subscriber.id, *columns).filter(Subscriber.id > last_id)
+        if active_only:
+            query = query.filter(Subscriber.active.is_(True))
+        page = query.order_by(Subscriber.id).limit(EXPORT_PAGE_SIZE).all()
+        if not page:
+            return
+        yield page
+        last_id = page[-1].id
+
+
+def export_subscribers(fmt, active_only=True):
+    """Yield subscribers as CSV or JSONL text, one page per chunk"""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+    for page in _iter_subscribers(active_only):
+        if fmt == 'csv':
+            for row in page:
+                writer.writerow([row.email, row.name or '', ';'.join(row.art_forms or []),
+                                 'true' if row.active else 'false',
+                                 row.created_at.isoformat() if row.created_at else ''])
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            chunk = ''.join(json.dumps({
+                'email': row.email,
+                'name': row.name,
+                'art_forms': row.art_forms or [],
+                'active': bool(row.active),
+                'created_at': row.created_at.isoformat() if row.created_at else None,
+            }) + '\n' for row in page)
+        yield chunk
+    if fmt == 'csv' and buffer.getvalue():
+        # Header only, for an empty table
+        yield buffer.getvalue()
@@ -0,0 +1,74 @@
+"""
+Shared fixtures: a throwaway SQLite database and a recording SMTP relay.
+
+The environment is set before the app is imported, since app.py connects
+and bootstraps the schema at import time.
+"""
+
+import os
+import sys
+import smtplib
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_workdir = tempfile.mkdtemp(prefix='sevenarts-tests-')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_workdir, "test.db")}'
+os.environ['IMAGE_CACHE_DIR'] = os.path.join(_workdir, 'images')
+os.environ['NEWS_API_KEY'] = 'test'
+os.environ['PUBLIC_BASE_URL'] = 'http://sevenarts.test'
+
+from app import app as flask_app, db  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """The app inside an app context, on freshly created empty tables"""
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+class RecordingSMTP:
+    """Stands in for smtplib.SMTP, keeping every message it is handed"""
+
+    sent = None
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, username, password):
+        pass
+
+    def noop(self):
+        return 250, b'OK'
+
+    def send_message(self, msg):
+        self.sent.append(msg)
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    """Messages "sent" during the test"""
+    sent = []
+    monkeypatch.setattr(RecordingSMTP, 'sent', sent)
+    monkeypatch.setattr(smtplib, 'SMTP', RecordingSMTP)
+    return sent
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+from app import db
+from models import Article, ArtForm
+from news_service import NewsService
+import article_store
+
+START = datetime(2025, 6, 1, 8, 0)
+
+
+def upstream_article(i):
+    return {'title': f'Ballet premiere number {i}',
+            'description': f'The company opens its season with new work number {i} for forty dancers.',
+            'url': f'https://example.com/ballet/{i}', 'source': {'name': 'Stage'},
+            'publishedAt': (START + timedelta(minutes=i)).strftime('%Y-%m-%dT%H:%M:%SZ'), 'urlToImage': ''}
+
+
+def fake_upstream(articles, requests_made):
+    """search_everything over `articles`, honouring from, to and pageSize like NewsAPI"""
+    def search_everything(params):
+        requests_made.append(params)
+        since, until = params.get('from'), params.get('to')
+        matching = [raw for raw in articles
+                    if (since is None or raw['publishedAt'][:19] >= since)
+                    and (until is None or raw['publishedAt'][:19] <= until)]
+        matching.sort(key=lambda raw: raw['publishedAt'], reverse=True)
+        return matching[:params['pageSize']]
+    return search_everything
+
+
+def test_ingestion_pages_back_to_the_watermark(app, monkeypatch):
+    db.session.add(ArtForm(name='Dance', keywords=['ballet'], active=True))
+    db.session.commit()
+    article_store.store_articles([(upstream_article(0), {'Dance'})])
+
+    requests_made = []
+    news_service = NewsService()
+    monkeypatch.setattr(news_service, 'search_everything',
+                        fake_upstream([upstream_article(i) for i in range(121)], requests_made))
+
+    # 120 new articles since the watermark, more than two pages of 50
+    assert article_store.ingest_all(news_service) == 120
+    assert Article.query.count() == 121
+    assert [params.get('to') for params in requests_made] == [None, '2025-06-01T09:11:00', '2025-06-01T08:22:00']
+    assert all(params['from'] == '2025-06-01T08:00:00' for params in requests_made)
+
+
+def test_ingestion_stops_at_the_page_limit_and_says_so(app, monkeypatch, caplog):
+    db.session.add(ArtForm(name='Dance', keywords=['ballet'], active=True))
+    db.session.commit()
+    monkeypatch.setattr(article_store, 'INGEST_MAX_PAGES', 2)
+
+    requests_made = []
+    news_service = NewsService()
+    monkeypatch.setattr(news_service, 'search_everything',
+                        fake_upstream([upstream_article(i) for i in range(200)], requests_made))
+
+    assert article_store.ingest_all(news_service) == 99
+    assert len(requests_made) == 2
+    assert 'articles published between the start and 2025-06-01 09:41:00 were skipped' in caplog.text
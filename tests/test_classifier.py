@@ -0,0 +1,37 @@
+from classifier import ArtFormClassifier
+from schema import DEFAULT_ART_FORMS
+
+
+def classifier(*extra):
+    return ArtFormClassifier([(form['name'], form['keywords']) for form in DEFAULT_ART_FORMS] + list(extra))
+
+
+def test_overlapping_keywords_of_different_forms_all_count():
+    opera = classifier(('Opera', ['opera', 'music theater']))
+    assert opera.classify('A new music theater piece premieres') == {'Opera', 'Music', 'Theater'}
+
+    sculpture = ArtFormClassifier([('Painting', ['visual art']), ('Sculpture', ['art installation'])])
+    assert sculpture.classify('A visual art installation opens') == {'Painting', 'Sculpture'}
+
+
+def test_a_keyword_shared_by_several_forms_credits_each():
+    arts = ArtFormClassifier([('Dance', ['hip-hop']), ('Music', ['hip-hop', 'rap'])])
+    assert arts.classify("The city's hip-hop scene") == {'Dance', 'Music'}
+    assert arts.classify('A hip replacement') == set()
+
+
+def test_keywords_match_whole_words_across_texts():
+    arts = classifier()
+    assert arts.classify('Ballet   season', None, 'new COMPOSER in residence') == {'Dance', 'Music'}
+    assert arts.classify('Poetic licence at the theatrics club') == set()
+
+
+def test_add_remove_and_sync_recompile():
+    arts = classifier()
+    arts.add('Opera', ['aria'])
+    assert arts.classify('An aria for the ages') == {'Opera'}
+    arts.remove('Opera')
+    assert arts.classify('An aria for the ages') == set()
+    arts.sync([('Film', ['cinema'])])
+    assert arts.art_forms == {'Film'}
+    assert arts.classify('Cinema and dance') == {'Film'}
@@ -0,0 +1,41 @@
+import importlib
+from datetime import datetime
+import pytest
+import tzlocal
+from app import db
+from models import Subscriber
+import delivery_slots
+
+
+@pytest.fixture
+def server_in_madrid(monkeypatch):
+    """delivery_slots as loaded on a server whose local zone is Europe/Madrid"""
+    monkeypatch.delenv('DEFAULT_TIMEZONE', raising=False)
+    monkeypatch.setattr(tzlocal, 'get_localzone_name', lambda: 'Europe/Madrid')
+    yield importlib.reload(delivery_slots)
+    monkeypatch.undo()
+    importlib.reload(delivery_slots)
+
+
+def test_subscribers_without_a_zone_get_the_digest_at_8_server_time(app, server_in_madrid):
+    assert server_in_madrid.DEFAULT_TIMEZONE == 'Europe/Madrid'
+    db.session.add(Subscriber(email='reader@example.com', art_forms=[], active=True))
+    db.session.commit()
+
+    def due(start):
+        where = server_in_madrid.due_filter(start)
+        return where is not None and Subscriber.query.filter(where).count() == 1
+
+    # 08:00 in Madrid is 07:00 UTC in winter and 06:00 UTC in summer
+    assert due(datetime(2026, 1, 15, 7, 0))
+    assert not due(datetime(2026, 1, 15, 8, 0))
+    assert due(datetime(2026, 7, 15, 6, 0))
+
+
+def test_a_configured_default_zone_wins(monkeypatch):
+    monkeypatch.setenv('DEFAULT_TIMEZONE', 'Asia/Tokyo')
+    try:
+        assert importlib.reload(delivery_slots).DEFAULT_TIMEZONE == 'Asia/Tokyo'
+    finally:
+        monkeypatch.undo()
+        importlib.reload(delivery_slots)
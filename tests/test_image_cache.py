@@ -0,0 +1,35 @@
+import io
+from PIL import Image
+import image_cache
+
+
+def png(width, height, mode='RGBA'):
+    output = io.BytesIO()
+    Image.new(mode, (width, height), (200, 30, 30, 128) if mode == 'RGBA' else (200, 30, 30)).save(output, 'PNG')
+    return output.getvalue()
+
+
+def test_wide_images_are_downscaled_to_every_width(client):
+    digest = image_cache.store_image(png(1200, 600))
+
+    for width in image_cache.IMAGE_WIDTHS:
+        path, mimetype = image_cache.cached_file(digest, width)
+        assert mimetype == 'image/jpeg'
+        with Image.open(path) as resized:
+            assert resized.size == (width, width // 2)
+            assert resized.mode == 'RGB'
+
+    response = client.get(f'/img/{digest}/{image_cache.IMAGE_WIDTHS[0]}')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert 'immutable' in response.headers['Cache-Control']
+
+
+def test_narrow_images_are_served_as_they_are(app):
+    data = png(200, 100, 'RGB')
+    digest = image_cache.store_image(data)
+
+    path, mimetype = image_cache.cached_file(digest, image_cache.IMAGE_WIDTHS[-1])
+    assert mimetype == 'image/png'
+    with open(path, 'rb') as f:
+        assert f.read() == data
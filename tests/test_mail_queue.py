@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+from app import db
+from models import DigestRun, NewsletterIssue, NewsletterSent, Subscriber
+from email_service import EmailService
+import mail_queue
+
+ARTICLES = [{'title': 'Ballet returns', 'description': 'A new season', 'url': 'https://example.com/ballet',
+             'source': 'Stage', 'topic': 'Dance', 'art_form': 'Dance', 'published_date': 'June 01, 2025',
+             'image_url': ''}]
+
+
+def queue_deliveries(count):
+    run = DigestRun(subject='Digest', status='queued', queued_at=datetime.utcnow())
+    db.session.add(run)
+    db.session.flush()
+    issue = NewsletterIssue(run_id=run.id, subject='Digest', articles=ARTICLES)
+    db.session.add(issue)
+    for i in range(count):
+        subscriber = Subscriber(email=f'reader{i}@example.com', art_forms=['Dance'], active=True)
+        db.session.add(subscriber)
+        db.session.flush()
+        db.session.add(NewsletterSent(subscriber_id=subscriber.id, run_id=run.id, issue_id=issue.id,
+                                      status='pending', attempts=0))
+    db.session.commit()
+    return run
+
+
+def drain():
+    email_service = EmailService()
+    try:
+        return mail_queue.drain(email_service)
+    finally:
+        email_service.close()
+
+
+def test_drain_skips_deliveries_claimed_by_another_drain(app, smtp):
+    queue_deliveries(3)
+    # Another worker claims everything first
+    claimed = mail_queue._claim_batch(None, datetime.utcnow())
+    assert len(claimed) == 3
+
+    assert drain().sent == 0
+    assert smtp == []
+    assert mail_queue._claim_batch(None, datetime.utcnow()) is None
+
+
+def test_expired_claims_are_sent_once(app, smtp):
+    run = queue_deliveries(3)
+    mail_queue._claim_batch(None, datetime.utcnow())
+    # That worker died: its claims run out
+    NewsletterSent.query.update({'next_attempt_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+    assert drain().sent == 3
+    assert drain().sent == 0
+    assert sorted(msg['To'] for msg in smtp) == [f'reader{i}@example.com' for i in range(3)]
+    assert db.session.get(DigestRun, run.id).status == 'completed'
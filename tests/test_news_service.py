@@ -0,0 +1,32 @@
+from app import db
+from models import ArtForm, Subscriber
+from newsapi_client import get_client
+import news_service
+import scheduler
+
+UPSTREAM_ARTICLES = [{'title': 'Ballet returns to the opera house',
+                      'description': 'The company opens its season with a new full-length work for forty dancers.',
+                      'url': 'https://example.com/ballet', 'source': {'name': 'Stage'},
+                      'publishedAt': '2025-06-01T08:00:00Z', 'urlToImage': ''}]
+
+
+def test_digest_sends_share_one_article_cache(app, smtp, monkeypatch):
+    monkeypatch.setattr(news_service, '_shared', {})
+    db.session.add(ArtForm(name='Dance', keywords=['ballet'], active=True))
+    db.session.add(Subscriber(email='reader@example.com', art_forms=['Dance'], active=True))
+    db.session.commit()
+
+    requests_made = []
+    client = get_client(news_service.NewsService().base_url, 'test')
+
+    def get(endpoint, params):
+        requests_made.append((endpoint, params['q']))
+        return {'articles': UPSTREAM_ARTICLES}
+    monkeypatch.setattr(client, 'get', get)
+
+    # Each send builds its own NewsService, as the scheduled jobs do
+    assert scheduler._send_digest().sent == 1
+    assert scheduler._send_digest().sent == 1
+
+    assert requests_made == [('everything', 'ballet')]
+    assert len(smtp) == 2
@@ -0,0 +1,45 @@
+import json
+import time
+import pytest
+import requests
+import newsapi_client
+from newsapi_client import CircuitBreaker, NewsAPIClient, QuotaExceededError
+
+
+def response(status, body, headers=None):
+    resp = requests.Response()
+    resp.status_code = status
+    resp._content = json.dumps(body).encode()
+    resp.headers.update(headers or {})
+    return resp
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(newsapi_client, 'RETRY_BASE_SECONDS', 0)
+    client = NewsAPIClient('https://newsapi.test/v2', 'test')
+    client.breaker = CircuitBreaker(failure_threshold=1)
+    return client
+
+
+def test_quota_running_out_before_a_retry_still_counts_the_failure(client, monkeypatch):
+    # The 503 also reports the quota spent, so the retry can't go out
+    spent = {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(int(time.time()) + 3600)}
+    monkeypatch.setattr(client.session, 'get', lambda *args, **kwargs: response(
+        503, {'status': 'error', 'code': 'unexpectedError', 'message': 'Try later'}, spent))
+
+    with pytest.raises(QuotaExceededError) as raised:
+        client.get('everything', {'q': 'ballet'})
+
+    assert raised.value.__cause__.status == 503
+    assert client.breaker.state == 'open'
+
+
+def test_a_rate_limited_answer_keeps_the_circuit_closed(client, monkeypatch):
+    monkeypatch.setattr(client.session, 'get', lambda *args, **kwargs: response(
+        429, {'status': 'error', 'code': 'rateLimited', 'message': 'Too many requests'}, {'Retry-After': '60'}))
+
+    with pytest.raises(QuotaExceededError):
+        client.get('everything', {'q': 'ballet'})
+
+    assert client.breaker.state == 'closed'
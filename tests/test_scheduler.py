@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+from app import db
+from models import ArtForm, Lease, NewsletterSent, Subscriber
+import article_store
+import scheduler
+
+SLOT = datetime(2026, 10, 18, 8, 0)
+
+
+def setup_readers(*emails):
+    db.session.add(ArtForm(name='Dance', keywords=['ballet'], active=True))
+    for email in emails:
+        db.session.add(Subscriber(email=email, art_forms=['Dance'], active=True, delivery_hour=8, timezone='UTC'))
+    db.session.commit()
+    article_store.store_articles([({
+        'title': 'Ballet returns', 'description': 'The company opens its season with a new full-length work.',
+        'url': 'https://example.com/ballet', 'source': {'name': 'Stage'}, 'publishedAt': '2026-10-17T08:00:00Z',
+    }, {'Dance'})])
+
+
+def test_a_slot_whose_node_died_is_retried_without_resending(app, smtp, monkeypatch):
+    monkeypatch.setattr(scheduler, 'DISTRIBUTED', True)
+    setup_readers('first@example.com', 'second@example.com')
+    # A node claimed the 08:00 slot and died after queueing only the first reader
+    db.session.add(Lease(name=f'digest_slot:{SLOT.isoformat()}', holder='dead-node',
+                         expires_at=datetime.utcnow() - timedelta(seconds=1)))
+    db.session.commit()
+    first = Subscriber.query.filter_by(email='first@example.com').one()
+    scheduler._send_digest(where=Subscriber.id == first.id, edition=SLOT.date())
+    del smtp[:]
+
+    scheduler.send_scheduled_newsletter(SLOT + timedelta(minutes=30))
+
+    assert [msg['To'] for msg in smtp] == ['second@example.com']
+    assert NewsletterSent.query.count() == 2
+
+
+def test_a_finished_slot_is_not_retried(app, smtp, monkeypatch):
+    monkeypatch.setattr(scheduler, 'DISTRIBUTED', True)
+    setup_readers('reader@example.com')
+
+    scheduler.send_scheduled_newsletter(SLOT)
+    scheduler.send_scheduled_newsletter(SLOT + timedelta(minutes=15))
+    scheduler.send_scheduled_newsletter(SLOT + timedelta(minutes=30))
+
+    assert [msg['To'] for msg in smtp] == ['reader@example.com']
+    assert db.session.get(Lease, f'digest_slot:{SLOT.isoformat()}').expires_at > datetime.utcnow() + timedelta(minutes=30)
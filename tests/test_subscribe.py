@@ -0,0 +1,74 @@
+import io
+from app import db
+from models import NewsletterSent, SchemaVersion, Subscriber
+from schema import bootstrap_schema
+
+
+def test_mixed_case_resubscribe_updates_the_same_subscriber(client):
+    client.post('/subscribe', data={'email': ' Reader@Example.COM ', 'art_forms': ['Dance']})
+    client.post('/subscribe', data={'email': 'reader@example.com', 'art_forms': ['Music']})
+
+    subscribers = Subscriber.query.all()
+    assert [(s.email, s.art_forms) for s in subscribers] == [('reader@example.com', ['Music'])]
+
+
+def upgrade_schema():
+    """Run the schema migration again, as a deploy of this version would"""
+    SchemaVersion.query.delete()
+    db.session.commit()
+    bootstrap_schema()
+    db.session.expire_all()
+
+
+def test_upgrade_lowercases_stored_addresses_and_merges_duplicates(app):
+    old = Subscriber(email='Reader@example.com', art_forms=['Dance'], active=True)
+    other = Subscriber(email='Other@Example.com', art_forms=[], active=True)
+    db.session.add_all([old, other])
+    db.session.flush()
+    # Subscribed again after addresses were normalised
+    new = Subscriber(email='reader@example.com', art_forms=['Music'], active=True)
+    db.session.add(new)
+    db.session.flush()
+    db.session.add(NewsletterSent(subscriber_id=old.id, status='sent', attempts=1))
+    db.session.commit()
+
+    upgrade_schema()
+
+    assert sorted((s.id, s.email, s.art_forms) for s in Subscriber.query.all()) == [
+        (other.id, 'other@example.com', []), (new.id, 'reader@example.com', ['Music'])]
+    assert NewsletterSent.query.one().subscriber_id == new.id
+
+
+def test_import_after_upgrade_updates_a_mixed_case_subscriber(client):
+    db.session.add(Subscriber(email='Reader@example.com', art_forms=['Dance'], active=True))
+    db.session.commit()
+    upgrade_schema()
+
+    # As written by /subscribers/export before the upgrade
+    csv = io.BytesIO(b'email,name,art_forms,active\nReader@example.com,Reader,Dance;Music,true\n')
+    client.post('/subscribers/import', data={'file': (csv, 'subscribers.csv')})
+
+    assert [(s.email, s.name, s.art_forms) for s in Subscriber.query.all()] == [
+        ('reader@example.com', 'Reader', ['Dance', 'Music'])]
+
+
+def test_unsubscribe_matches_any_case(client):
+    client.post('/subscribe', data={'email': 'reader@example.com'})
+    client.get('/unsubscribe/Reader@EXAMPLE.com')
+
+    assert Subscriber.query.one().active is False
+
+
+def test_invalid_address_is_refused(client):
+    response = client.post('/subscribe', data={'email': 'not an address'}, follow_redirects=True)
+
+    assert Subscriber.query.count() == 0
+    assert b'look right' in response.data
+
+
+def test_import_normalises_like_subscribe(client):
+    client.post('/subscribe', data={'email': 'reader@example.com'})
+    csv = io.BytesIO(b'email,name\nREADER@Example.com,Reader\n')
+    client.post('/subscribers/import', data={'file': (csv, 'subscribers.csv')})
+
+    assert [(s.email, s.name) for s in Subscriber.query.all()] == [('reader@example.com', 'Reader')]
@@ -0,0 +1,77 @@
+import pytest
+from email_service import EmailService
+import tracking
+
+ARTICLES = [{'title': 'Ballet returns', 'description': 'A new season', 'url': 'https://example.com/ballet',
+             'source': 'Stage', 'topic': 'Dance', 'art_form': 'Dance', 'published_date': 'June 01, 2025',
+             'image_url': ''}]
+
+
+@pytest.fixture
+def recorded(monkeypatch):
+    """Reader events recorded during the test, kept out of the real buffer"""
+    events = []
+    monkeypatch.setattr(tracking.event_log, 'record', lambda kind, subscriber_id, *args: events.append(
+        (kind, subscriber_id)))
+    return events
+
+
+def send(token=''):
+    email_service = EmailService()
+    try:
+        email_service.send_newsletter('reader+arts@example.com', 'Digest', ARTICLES, 'Reader', token=token)
+    finally:
+        email_service.close()
+
+
+def bodies(msg):
+    return [part.get_payload(decode=True).decode() for part in msg.get_payload()]
+
+
+def test_digest_links_to_the_token_unsubscribe(app, smtp):
+    token = tracking.subscriber_token(7)
+    send(token)
+
+    msg, = smtp
+    url = f'http://sevenarts.test/u/{token}'
+    assert all(url in body for body in bodies(msg))
+    assert msg['List-Unsubscribe'] == f'<{url}>'
+    assert msg['List-Unsubscribe-Post'] == 'List-Unsubscribe=One-Click'
+
+
+def test_digest_without_a_token_falls_back_to_the_address_link(app, smtp):
+    send()
+
+    msg, = smtp
+    url = 'http://sevenarts.test/unsubscribe/reader%2Barts@example.com'
+    assert all(url in body and '/u/' not in body for body in bodies(msg))
+    assert msg['List-Unsubscribe'] == f'<{url}>'
+    # The old route can't take a one-click POST
+    assert msg['List-Unsubscribe-Post'] is None
+
+
+def test_unsubscribe_link_asks_before_unsubscribing(client, recorded):
+    token = tracking.subscriber_token(7)
+
+    page = client.get(f'/u/{token}')
+    assert page.status_code == 200
+    assert f'action="/u/{token}"'.encode() in page.data
+    assert recorded == []
+
+    done = client.post(f'/u/{token}')
+    assert b"You're unsubscribed" in done.data
+    assert recorded == [('unsubscribe', 7)]
+
+
+def test_one_click_post_unsubscribes_immediately(client, recorded):
+    token = tracking.subscriber_token(7)
+
+    assert client.post(f'/u/{token}', data={'List-Unsubscribe': 'One-Click'}).status_code == 204
+    assert client.post('/u/forged', data={'List-Unsubscribe': 'One-Click'}).status_code == 400
+    assert recorded == [('unsubscribe', 7)]
+
+
+def test_forged_unsubscribe_link_is_refused(client, recorded):
+    assert client.get('/u/forged').status_code == 302
+    assert client.post('/u/forged').status_code == 302
+    assert recorded == []
@@ -0,0 +1,158 @@
+"""
+Signed reader tokens and the buffered event log behind digest links.
+
+Every digest carries a per-subscriber token: the subscriber's ID signed with
+the app's secret key, so the unsubscribe, open and click endpoints verify it
+without a database read and no address ever appears in a URL. The endpoints
+only append to an in-process buffer. A background thread in each process
+writes the buffer out every EVENT_FLUSH_SECONDS, or as soon as
+EVENT_FLUSH_SIZE events are waiting: one bulk insert into the append-only
+delivery_event table and one set-based UPDATE deactivating everyone who
+unsubscribed. A normal shutdown flushes what is left; a process killed
+outright loses at most its last interval of events.
+"""
+
+import os
+import atexit
+import logging
+import threading
+from datetime import datetime
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import update
+from app import app, db
+from models import DeliveryEvent, NewsletterIssue, Subscriber
+from bulk import copy_insert
+from cache import TTLCache
+from dashboard import invalidate_dashboard
+from metrics import DB_COMMIT_SECONDS, TRACKING_EVENTS
+
+EVENT_FLUSH_SECONDS = float(os.environ.get('EVENT_FLUSH_SECONDS', '1'))
+EVENT_FLUSH_SIZE = int(os.environ.get('EVENT_FLUSH_SIZE', '5000'))
+# Events held through a database outage before the oldest are dropped
+EVENT_BUFFER_LIMIT = int(os.environ.get('EVENT_BUFFER_LIMIT', '200000'))
+# Subscriber IDs per deactivating UPDATE
+UNSUBSCRIBE_CHUNK_SIZE = 1000
+
+# Salted, so these tokens can't be swapped with anything else the secret key signs
+_serializer = URLSafeSerializer(app.secret_key, salt='sevenarts-reader')
+
+
+def subscriber_token(subscriber_id):
+    """Opaque token identifying a subscriber in digest links"""
+    return _serializer.dumps(subscriber_id)
+
+
+def read_token(token):
+    """Subscriber ID signed into `token`, or None if it is forged or malformed"""
+    try:
+        subscriber_id = _serializer.loads(token)
+    except BadSignature:
+        return None
+    return subscriber_id if isinstance(subscriber_id, int) else None
+
+
+# Article URLs by issue; snapshots never change, so entries only age out to bound memory
+_issue_links = TTLCache(maxsize=256, ttl=int(os.environ.get('ISSUE_LINK_CACHE_TTL', '3600')))
+
+
+def issue_links(issue_id):
+    """Article URLs of an issue in digest order, or None if there is no such issue"""
+    def load():
+        articles = db.session.query(NewsletterIssue.articles).filter(NewsletterIssue.id == issue_id).scalar()
+        return None if articles is None else [article.get('url') for article in articles]
+    links = _issue_links.get_or_load(issue_id, load)
+    if links is None:
+        # Not cached, so an issue created after a stray lookup still resolves
+        _issue_links.invalidate(issue_id)
+    return links
+
+
+class EventLog:
+    """Per-process buffer of reader events, written out in batches by a background thread"""
+
+    def __init__(self, flush_seconds=EVENT_FLUSH_SECONDS, flush_size=EVENT_FLUSH_SIZE, limit=EVENT_BUFFER_LIMIT):
+        self.flush_seconds = flush_seconds
+        self.flush_size = flush_size
+        self.limit = limit
+        self._events = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        # The writer thread doesn't survive a fork, so it's started per process
+        self._writer_pid = None
+
+    def record(self, kind, subscriber_id, issue_id=None, link=None):
+        """Buffer one event; never touches the database"""
+        with self._lock:
+            self._events.append((kind, subscriber_id, issue_id, link, datetime.utcnow()))
+            waiting = len(self._events)
+            if self._writer_pid != os.getpid():
+                self._writer_pid = os.getpid()
+                threading.Thread(target=self._write_forever, name='event-log', daemon=True).start()
+        TRACKING_EVENTS.inc(kind=kind)
+        if waiting >= self.flush_size:
+            self._wake.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._events)
+
+    def flush(self):
+        """Write out everything buffered and return how many events that was; needs an app context
+
+        On failure the events go back to the front of the buffer for the next
+        flush, and the error is raised.
+        """
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return 0
+
+        unsubscribed = sorted({subscriber_id for kind, subscriber_id, *_ in events if kind == 'unsubscribe'})
+        try:
+            copy_insert(DeliveryEvent, [
+                {'kind': kind, 'subscriber_id': subscriber_id, 'issue_id': issue_id, 'link': link,
+                 'created_at': created_at}
+                for kind, subscriber_id, issue_id, link, created_at in events
+            ])
+            for start in range(0, len(unsubscribed), UNSUBSCRIBE_CHUNK_SIZE):
+                db.session.execute(update(Subscriber).where(
+                    Subscriber.id.in_(unsubscribed[start:start + UNSUBSCRIBE_CHUNK_SIZE]),
+                    Subscriber.active.is_(True)
+                ).values(active=False))
+            with DB_COMMIT_SECONDS.time(operation='event_log'):
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                self._events[:0] = events
+                overflow = len(self._events) - self.limit
+                if overflow > 0:
+                    del self._events[:overflow]
+                    logging.error(f"Event log buffer full: dropped the {overflow} oldest events")
+            raise
+
+        if unsubscribed:
+            invalidate_dashboard()
+        return len(events)
+
+    def _write_forever(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            with app.app_context():
+                try:
+                    self.flush()
+                except Exception as e:
+                    logging.error(f"Could not write {self.pending()} buffered reader events: {e}")
+
+    def close(self):
+        """Flush what is left, e.g. at shutdown"""
+        with app.app_context():
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Lost {self.pending()} buffered reader events at shutdown: {e}")
+
+
+event_log = EventLog()
+atexit.register(event_log.close)